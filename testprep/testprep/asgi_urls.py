@@ -0,0 +1,17 @@
+"""
+URL configuration for requests served by the ASGI app (see testprep.asgi).
+
+The same URLs as testprep.urls, with the candidate session endpoints routed to async views.
+"""
+from django.contrib import admin
+from django.urls import path, include
+
+from testprep.instrumentation import metrics_view
+
+
+urlpatterns = [
+    path('admin/', admin.site.urls),
+    path("ckeditor/", include("ckeditor_uploader.urls")),
+    path("tests/", include("tests.async_urls")),
+    path("metrics/", metrics_view, name="metrics"),
+]
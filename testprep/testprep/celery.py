@@ -22,4 +22,15 @@ app.config_from_object('django.conf:settings', namespace='CELERY')
 app.conf.task_default_queue = 'celery'
 app.conf.accept_content = ['application/json']
 app.conf.task_track_started = True
+app.conf.beat_schedule = {
+    'flush-answer-buffers': {
+        'task': 'flush_answer_buffers',
+        'schedule': settings.ANSWER_BUFFER_FLUSH_INTERVAL,
+    },
+    'provision-upcoming-exams': {
+        'task': 'provision_upcoming_exams',
+        'schedule': crontab(hour=settings.EXAM_PROVISIONING_HOUR, minute=0),
+    },
+}
+app.autodiscover_tasks()
 
@@ -0,0 +1,338 @@
+import contextvars
+import logging
+import random
+import threading
+import time
+from bisect import bisect_left
+from contextlib import ExitStack
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction, sync_to_async
+from cacheops.signals import cache_read
+from django.conf import settings
+from django.db import connections
+from django.http import HttpResponse, HttpResponseForbidden
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+_current_request_stats = contextvars.ContextVar('current_request_stats', default=None)
+
+
+class Histogram:
+    def __init__(self, name, documentation, buckets):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(buckets)
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, labels, value):
+        with self._lock:
+            series = self._series.get(labels)
+            if series is None:
+                series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} histogram']
+        with self._lock:
+            series = {labels: (list(counts), total, count) for labels, (counts, total, count) in self._series.items()}
+        for labels, (counts, total, count) in sorted(series.items()):
+            label_text = _format_labels(labels)
+            cumulative = 0
+            for upper_bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                lines.append(f'{self.name}_bucket{_format_labels(labels, le=upper_bound)} {cumulative}')
+            lines.append(f'{self.name}_bucket{_format_labels(labels, le="+Inf")} {count}')
+            lines.append(f'{self.name}_sum{label_text} {total}')
+            lines.append(f'{self.name}_count{label_text} {count}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Counter:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def inc(self, labels, value=1):
+        with self._lock:
+            self._series[labels] = self._series.get(labels, 0) + value
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} counter']
+        with self._lock:
+            series = dict(self._series)
+        for labels, value in sorted(series.items()):
+            lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+class Gauge:
+    def __init__(self, name, documentation):
+        self.name = name
+        self.documentation = documentation
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def set(self, labels, value):
+        with self._lock:
+            self._series[labels] = value
+
+    def replace(self, series):
+        # Drops every series not given, for gauges rebuilt from a full snapshot.
+        with self._lock:
+            self._series = dict(series)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} gauge']
+        with self._lock:
+            series = dict(self._series)
+        for labels, value in sorted(series.items()):
+            lines.append(f'{self.name}{_format_labels(labels)} {value}')
+        return lines
+
+    def clear(self):
+        with self._lock:
+            self._series.clear()
+
+
+def _escape_label_value(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels, le=None):
+    pairs = list(labels)
+    if le is not None:
+        pairs.append(('le', le))
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape_label_value(value)}"' for name, value in pairs) + '}'
+
+
+request_duration = Histogram(
+    'testprep_request_duration_seconds', 'Wall time per request.', DURATION_BUCKETS
+)
+request_db_queries = Histogram(
+    'testprep_request_db_queries', 'Database queries per sampled request.', QUERY_COUNT_BUCKETS
+)
+request_db_duration = Histogram(
+    'testprep_request_db_duration_seconds', 'Time spent in database queries per sampled request.', DURATION_BUCKETS
+)
+request_serializer_duration = Histogram(
+    'testprep_request_serializer_duration_seconds', 'Time spent building serializer data per sampled request.',
+    DURATION_BUCKETS,
+)
+cacheops_reads = Counter('testprep_cacheops_reads_total', 'Cacheops reads on sampled requests.')
+
+METRICS = [request_duration, request_db_queries, request_db_duration, request_serializer_duration, cacheops_reads]
+
+
+def register_metric(metric):
+    METRICS.append(metric)
+    return metric
+
+
+def render_metrics():
+    lines = []
+    for metric in METRICS:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+class RequestStats:
+    def __init__(self, capture_sql=False):
+        self.queries = 0
+        self.query_time = 0.0
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.serializer_time = 0.0
+        self.capture_sql = capture_sql
+        self.sql = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            elapsed = time.perf_counter() - started_at
+            self.queries += 1
+            self.query_time += elapsed
+            if self.capture_sql and len(self.sql) < settings.INSTRUMENTATION_SLOW_REQUEST_MAX_QUERIES:
+                self.sql.append((round(elapsed * 1000, 2), sql))
+
+
+def get_current_request_stats():
+    return _current_request_stats.get()
+
+
+def _record_cache_read(sender, func=None, hit=False, **kwargs):
+    request_stats = _current_request_stats.get()
+    if request_stats is None:
+        return
+    if hit:
+        request_stats.cache_hits += 1
+    else:
+        request_stats.cache_misses += 1
+
+
+cache_read.connect(_record_cache_read, dispatch_uid='testprep_instrumentation_cache_read')
+
+
+def serializer_data(serializer):
+    # Times `serializer.data` against the current request, if it is being sampled.
+    request_stats = _current_request_stats.get()
+    if request_stats is None:
+        return serializer.data
+    started_at = time.perf_counter()
+    try:
+        return serializer.data
+    finally:
+        request_stats.serializer_time += time.perf_counter() - started_at
+
+
+class InstrumentedListMixin:
+    # For DRF list views: the same as ListModelMixin.list, with serializer time recorded.
+
+    def list(self, request, *args, **kwargs):
+        queryset = self.filter_queryset(self.get_queryset())
+
+        page = self.paginate_queryset(queryset)
+        if page is not None:
+            serializer = self.get_serializer(page, many=True)
+            return self.get_paginated_response(serializer_data(serializer))
+
+        serializer = self.get_serializer(queryset, many=True)
+        return Response(serializer_data(serializer))
+
+
+def _get_route_name(request):
+    resolver_match = getattr(request, 'resolver_match', None)
+    if resolver_match is None:
+        return 'unresolved'
+    return resolver_match.view_name or resolver_match.route or 'unnamed'
+
+
+class RequestInstrumentationMiddleware:
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        if not settings.INSTRUMENTATION_ENABLED:
+            return self.get_response(request)
+
+        request_stats = self.sample()
+        token = None
+        started_at = time.perf_counter()
+        with ExitStack() as stack:
+            if request_stats is not None:
+                token = _current_request_stats.set(request_stats)
+                self.wrap_connections(stack, request_stats)
+            try:
+                response = self.get_response(request)
+            finally:
+                if token is not None:
+                    _current_request_stats.reset(token)
+        self.observe(request, response, time.perf_counter() - started_at, request_stats)
+        return response
+
+    async def __acall__(self, request):
+        if not settings.INSTRUMENTATION_ENABLED:
+            return await self.get_response(request)
+
+        request_stats = self.sample()
+        token = None
+        stack = ExitStack()
+        started_at = time.perf_counter()
+        if request_stats is not None:
+            token = _current_request_stats.set(request_stats)
+            # The async ORM runs queries in the request's sync_to_async thread, whose connections are
+            # not the event loop thread's, so the wrappers are installed and removed there.
+            await sync_to_async(self.wrap_connections)(stack, request_stats)
+        try:
+            response = await self.get_response(request)
+        finally:
+            if token is not None:
+                _current_request_stats.reset(token)
+                await sync_to_async(stack.close)()
+        self.observe(request, response, time.perf_counter() - started_at, request_stats)
+        return response
+
+    @staticmethod
+    def sample():
+        if random.random() >= settings.INSTRUMENTATION_SAMPLE_RATE:
+            return None
+        return RequestStats(capture_sql=settings.INSTRUMENTATION_SLOW_REQUEST_MS is not None)
+
+    @staticmethod
+    def wrap_connections(stack, request_stats):
+        for alias in connections:
+            stack.enter_context(connections[alias].execute_wrapper(request_stats))
+
+    def observe(self, request, response, duration, request_stats):
+        route = _get_route_name(request)
+        labels = (('route', route), ('method', request.method), ('status', response.status_code))
+        request_duration.observe(labels, duration)
+        if request_stats is not None:
+            self.record(request, route, duration, request_stats)
+
+    @staticmethod
+    def record(request, route, duration, request_stats):
+        route_labels = (('route', route),)
+        request_db_queries.observe(route_labels, request_stats.queries)
+        request_db_duration.observe(route_labels, request_stats.query_time)
+        request_serializer_duration.observe(route_labels, request_stats.serializer_time)
+        if request_stats.cache_hits:
+            cacheops_reads.inc(route_labels + (('result', 'hit'),), request_stats.cache_hits)
+        if request_stats.cache_misses:
+            cacheops_reads.inc(route_labels + (('result', 'miss'),), request_stats.cache_misses)
+
+        slow_request_ms = settings.INSTRUMENTATION_SLOW_REQUEST_MS
+        if slow_request_ms is not None and duration * 1000 >= slow_request_ms:
+            logger.warning(
+                'Slow request %s %s (%s): %.1f ms, %s queries in %.1f ms, serializers %.1f ms, '
+                'cacheops %s hits / %s misses\n%s',
+                request.method,
+                request.path,
+                route,
+                duration * 1000,
+                request_stats.queries,
+                request_stats.query_time * 1000,
+                request_stats.serializer_time * 1000,
+                request_stats.cache_hits,
+                request_stats.cache_misses,
+                '\n'.join(f'  [{elapsed_ms} ms] {sql}' for elapsed_ms, sql in request_stats.sql),
+            )
+
+
+def metrics_view(request):
+    # Without a token the metrics are only served to staff, or to anyone in DEBUG.
+    token = settings.INSTRUMENTATION_METRICS_TOKEN
+    if token:
+        if request.headers.get('Authorization') != f'Bearer {token}':
+            return HttpResponseForbidden()
+    elif not settings.DEBUG and not getattr(request.user, 'is_staff', False):
+        return HttpResponseForbidden()
+    return HttpResponse(render_metrics(), content_type='text/plain; version=0.0.4; charset=utf-8')
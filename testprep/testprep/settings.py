@@ -58,6 +58,7 @@ CACHEOPS = {
 }
 
 MIDDLEWARE = [
+    'testprep.instrumentation.RequestInstrumentationMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -68,6 +69,8 @@ MIDDLEWARE = [
 ]
 
 ROOT_URLCONF = 'testprep.urls'
+# Used by the ASGI app instead of ROOT_URLCONF: the same URLs, with async session endpoints.
+ASGI_ROOT_URLCONF = 'testprep.asgi_urls'
 
 TEMPLATES = [
     {
@@ -111,6 +114,77 @@ DATABASES = {
 CELERY_BROKER_URL = "redis://127.0.0.1:6379/0"
 CELERY_RESULT_BACKEND = "redis://127.0.0.1:6379/0"
 
+REDIS_URL = "redis://127.0.0.1:6379/2"
+REDIS_CLIENT_CLASS = "redis.StrictRedis"
+ASYNC_REDIS_CLIENT_CLASS = "redis.asyncio.StrictRedis"
+
+# Write-behind buffer for answer submits: None (write synchronously), 'redis' or 'local'.
+ANSWER_BUFFER_BACKEND = None
+ANSWER_BUFFER_FLUSH_BATCH_SIZE = 5000
+ANSWER_BUFFER_FLUSH_INTERVAL = 5
+ANSWER_BUFFER_DRAIN_TIMEOUT = 30
+# Per-session index of buffered answers, read when a candidate completes their session.
+ANSWER_BUFFER_SESSION_TTL = 24*60*60
+
+# Once the answer table has been converted with `manage.py answer_partitions convert` (PostgreSQL
+# only), new exams get their own partition when they are created.
+ANSWER_PARTITIONING_ENABLED = False
+ANSWER_PARTITION_ARCHIVE_SCHEMA = 'archive'
+
+ANSWER_KEY_CACHE_SIZE = 256
+ANSWER_KEY_CACHE_TIMEOUT = 8*60*60
+
+PAPER_SNAPSHOT_CACHE_SIZE = 64
+PAPER_SNAPSHOT_CACHE_TIMEOUT = 8*60*60
+
+PREDICTION_CACHE_SIZE = 64
+
+RESOLVER_CACHE_SIZE = 10000
+RESOLVER_LOCAL_TTL = 5
+RESOLVER_CACHE_TIMEOUT = 8*60*60
+
+# Sessions of registered candidates are created ahead of time by a nightly task, for exams
+# starting within the lead time.
+EXAM_PROVISIONING_LEAD_TIME = 36*60*60
+EXAM_PROVISIONING_HOUR = 3
+
+# Rate limit on session starts per exam: None (disabled), 'redis' or 'local'. Candidates over the
+# rate are given a queue position and a Retry-After instead of an error.
+ADMISSION_CONTROL_BACKEND = None
+ADMISSION_RATE = 100
+ADMISSION_BURST = 200
+ADMISSION_RESERVATION_TTL = 15*60
+
+# Exams with at least this many sessions compute their leaderboard as a pipeline of Celery chords:
+# sessions are scored in id ranges of LEADERBOARD_PARTITION_SIZE and ranks written back in score bands
+# of about LEADERBOARD_WRITER_BAND_SIZE. None keeps every exam on a single worker.
+LEADERBOARD_DISTRIBUTED_MIN_SESSIONS = None
+LEADERBOARD_PARTITION_SIZE = 50000
+LEADERBOARD_WRITER_BAND_SIZE = 50000
+
+# Admin changelists on the session and answer tables show exact counts below this many rows and
+# Postgres' estimates above it.
+ADMIN_EXACT_COUNT_THRESHOLD = 10000
+
+# Rows fetched per round trip by the streaming results exports; also the number of lines per
+# chunk written to the response.
+EXPORT_CHUNK_SIZE = 2000
+
+# Provisional leaderboard kept while an exam runs: None (disabled), 'redis' or 'local'.
+LIVE_LEADERBOARD_BACKEND = None
+LIVE_LEADERBOARD_RETENTION = 24*60*60
+LIVE_LEADERBOARD_MAX_LIMIT = 500
+
+# Per-route request metrics, served in Prometheus text format at /metrics/. Wall time is recorded
+# for every request; queries, cacheops reads and serializer time only for the sampled fraction.
+INSTRUMENTATION_ENABLED = True
+INSTRUMENTATION_SAMPLE_RATE = 0.1
+# Scrapers send it as a Bearer token; when None, /metrics/ is served only to staff (or anyone in DEBUG).
+INSTRUMENTATION_METRICS_TOKEN = None
+# Sampled requests slower than this are logged with their SQL; None disables the log.
+INSTRUMENTATION_SLOW_REQUEST_MS = 1000
+INSTRUMENTATION_SLOW_REQUEST_MAX_QUERIES = 50
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
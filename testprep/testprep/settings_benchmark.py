@@ -0,0 +1,28 @@
+import os
+
+from testprep.settings import *  # noqa
+
+# Settings for `manage.py benchmark`: a dedicated local Postgres database, Redis replaced by
+# fakeredis and Celery tasks run inline.
+BENCHMARK_ENABLED = True
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': os.environ.get('BENCHMARK_DATABASE_NAME', 'testprep_benchmark'),
+        'USER': os.environ.get('BENCHMARK_DATABASE_USER', ''),
+        'PASSWORD': os.environ.get('BENCHMARK_DATABASE_PASSWORD', ''),
+        'HOST': os.environ.get('BENCHMARK_DATABASE_HOST', 'localhost'),
+        'PORT': os.environ.get('BENCHMARK_DATABASE_PORT', '5432'),
+    }
+}
+
+ALLOWED_HOSTS = ['testserver']
+
+REDIS_CLIENT_CLASS = 'fakeredis.FakeStrictRedis'
+ASYNC_REDIS_CLIENT_CLASS = 'fakeredis.FakeAsyncRedis'
+CACHEOPS_CLIENT_CLASS = 'fakeredis.FakeStrictRedis'
+
+CELERY_TASK_ALWAYS_EAGER = True
+
+INSTRUMENTATION_SLOW_REQUEST_MS = None
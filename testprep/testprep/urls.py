@@ -17,9 +17,12 @@ Including another URLconf
 from django.contrib import admin
 from django.urls import path, include
 
+from testprep.instrumentation import metrics_view
+
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path("ckeditor/", include("ckeditor_uploader.urls")),
     path("tests/", include("tests.urls")),
+    path("metrics/", metrics_view, name="metrics"),
 ]
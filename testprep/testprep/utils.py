@@ -1,4 +1,138 @@
+import asyncio
+import json
+import threading
+import time
 import uuid
+import weakref
+from collections import OrderedDict
+from functools import lru_cache
+
+from django.conf import settings
+from django.db import connection, connections
+from django.utils.module_loading import import_string
+
 
 def generate_random_uuid() -> str:
     return str(uuid.uuid4())
+
+
+@lru_cache(maxsize=None)
+def get_redis_client():
+    return import_string(settings.REDIS_CLIENT_CLASS).from_url(settings.REDIS_URL)
+
+
+_async_redis_clients = weakref.WeakKeyDictionary()
+
+
+def get_async_redis_client():
+    # Async connection pools belong to the event loop that opened them, so there is one client per loop.
+    loop = asyncio.get_running_loop()
+    client = _async_redis_clients.get(loop)
+    if client is None:
+        client = _async_redis_clients[loop] = import_string(settings.ASYNC_REDIS_CLIENT_CLASS).from_url(
+            settings.REDIS_URL
+        )
+    return client
+
+
+def estimate_queryset_count(queryset):
+    # Uses the planner's row estimate on Postgres instead of counting; other databases count exactly.
+    database_connection = connections[queryset.db]
+    if database_connection.vendor != 'postgresql':
+        return queryset.count()
+
+    sql, params = queryset.order_by().values('pk').query.sql_with_params()
+    with database_connection.cursor() as cursor:
+        cursor.execute(f'EXPLAIN (FORMAT JSON) {sql}', params)
+        plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan[0]['Plan']['Plan Rows']
+
+
+def estimate_table_count(model, using='default'):
+    # Reads the row count Postgres keeps in pg_class from the last VACUUM/ANALYZE; other databases count exactly.
+    database_connection = connections[using]
+    if database_connection.vendor != 'postgresql':
+        return model._default_manager.using(using).count()
+
+    with database_connection.cursor() as cursor:
+        cursor.execute('SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass', [model._meta.db_table])
+        row = cursor.fetchone()
+    if row is None or row[0] < 0:
+        # Never analysed: the planner still has an estimate from the table's size on disk.
+        return estimate_queryset_count(model._default_manager.using(using).all())
+    return row[0]
+
+
+class QueryStats:
+    def __init__(self):
+        self.queries = 0
+        self.query_time = 0.0
+        self.duration = 0.0
+        self._started_at = None
+        self._execute_wrapper = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started_at = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - started_at
+
+    def __enter__(self):
+        self._execute_wrapper = connection.execute_wrapper(self)
+        self._execute_wrapper.__enter__()
+        self._started_at = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.duration = time.perf_counter() - self._started_at
+        self._execute_wrapper.__exit__(exc_type, exc_value, traceback)
+
+    def as_dict(self):
+        return {
+            'queries': self.queries,
+            'query_time_ms': round(self.query_time * 1000, 2),
+            'duration_ms': round(self.duration * 1000, 2),
+        }
+
+
+class LRUCache:
+    def __init__(self, maxsize=128, ttl=None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            try:
+                expires_at, value = self._entries[key]
+            except KeyError:
+                return default
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._entries[key]
+                return default
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        expires_at = time.monotonic() + self.ttl if self.ttl is not None else None
+        with self._lock:
+            self._entries[key] = (expires_at, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
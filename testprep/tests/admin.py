@@ -1,17 +1,97 @@
+from django.conf import settings
 from django.contrib import admin
+from django.contrib.auth.models import User
+from django.core.paginator import Paginator
+from django.db import connections
+from django.db.models import Q
+from django.utils.functional import cached_property
+
+from testprep.utils import estimate_queryset_count, estimate_table_count
 
 from .models import (
     Exam,
     ExamMultipleChoiceQuestionMapping,
+    ExamRegistration,
     ExamTopicMapping,
+    ExamTopicRanking,
     ExamUserMapping,
     ExamUserMultipleChoiceQuestionMapping,
     MultipleChoiceQuestion,
     Topic,
     UserExamTypeProfile,
     UserTopicPerformanceProfile,
+    has_packed_answer_sheets,
 )
 
+# Prefix searches resolve at most this many users or sessions before filtering the big tables.
+SEARCH_PREFIX_MATCH_LIMIT = 1000
+RECENT_EXAMS_FILTER_LIMIT = 50
+
+
+class EstimatedCountPaginator(Paginator):
+    # COUNT(*) on the session and answer tables scans millions of rows, so large changelists are
+    # paged with the table statistics (unfiltered) or the planner's estimate (filtered) instead.
+
+    @cached_property
+    def count(self):
+        queryset = self.object_list
+        if connections[queryset.db].vendor != "postgresql":
+            return queryset.count()
+        if queryset.query.where:
+            estimate = estimate_queryset_count(queryset)
+        else:
+            estimate = estimate_table_count(queryset.model, using=queryset.db)
+        if estimate < settings.ADMIN_EXACT_COUNT_THRESHOLD:
+            return queryset.count()
+        return estimate
+
+
+class LargeTableAdmin(admin.ModelAdmin):
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
+    list_only = ()
+    search_help_text = "Prefix of the hash or the username."
+
+    def get_queryset(self, request):
+        queryset = super().get_queryset(request)
+        if self.list_only and request.resolver_match and request.resolver_match.url_name.endswith("_changelist"):
+            queryset = queryset.only(*self.list_only)
+        return queryset
+
+    def get_search_results(self, request, queryset, search_term):
+        # Only index-backed prefix matches: hash LIKE 'term%' on the varchar_pattern_ops index, and the
+        # matching users resolved up front instead of an icontains join over three tables.
+        for term in search_term.split():
+            queryset = queryset.filter(self.get_prefix_search_filter(term))
+        return queryset, False
+
+    @staticmethod
+    def get_matching_user_ids(term):
+        return list(
+            User.objects.filter(username__startswith=term).values_list("id", flat=True)[:SEARCH_PREFIX_MATCH_LIMIT]
+        )
+
+    def get_prefix_search_filter(self, term):
+        raise NotImplementedError
+
+
+class ExamFilter(admin.SimpleListFilter):
+    # Recent exams only; the default related filter lists every exam ever held.
+    title = "exam"
+    parameter_name = "exam"
+
+    def lookups(self, request, model_admin):
+        return Exam.objects.order_by("-start_timestamp").values_list("id", "title")[:RECENT_EXAMS_FILTER_LIMIT]
+
+    def queryset(self, request, queryset):
+        if not self.value():
+            return queryset
+        try:
+            exam_id = int(self.value())
+        except ValueError:
+            return queryset.none()
+        return queryset.filter(exam_id=exam_id)
+
 
 class ExamTopicMappingInline(admin.TabularInline):
     model = ExamTopicMapping
@@ -24,6 +104,16 @@ class ExamMultipleChoiceQuestionMappingInline(admin.TabularInline):
     extra = 1
     autocomplete_fields = ("multiple_choice_question",)
 
+    # Shown read-only once a packed exam has sessions, since its answer sheet slots follow these rows.
+    def has_add_permission(self, request, obj=None):
+        return super().has_add_permission(request, obj) and not (obj and has_packed_answer_sheets([obj.id]))
+
+    def has_change_permission(self, request, obj=None):
+        return super().has_change_permission(request, obj) and not (obj and has_packed_answer_sheets([obj.id]))
+
+    def has_delete_permission(self, request, obj=None):
+        return super().has_delete_permission(request, obj) and not (obj and has_packed_answer_sheets([obj.id]))
+
 
 @admin.register(Topic)
 class TopicAdmin(admin.ModelAdmin):
@@ -47,6 +137,16 @@ class ExamAdmin(admin.ModelAdmin):
     search_fields = ("title", "topics__title")
     inlines = [ExamTopicMappingInline, ExamMultipleChoiceQuestionMappingInline]
     readonly_fields = ("hash", "created_at", "complete_exam_celery_task_id")
+    actions = ["provision_registered_sessions"]
+
+    @admin.action(description="Provision sessions for registered candidates")
+    def provision_registered_sessions(self, request, queryset):
+        from tests.tasks import provision_registered_exam_sessions
+
+        exam_ids = list(queryset.values_list("id", flat=True))
+        for exam_id in exam_ids:
+            provision_registered_exam_sessions.delay(exam_id)
+        self.message_user(request, f"Queued provisioning for {len(exam_ids)} exam(s).")
 
 
 @admin.register(MultipleChoiceQuestion)
@@ -58,24 +158,29 @@ class MultipleChoiceQuestionAdmin(admin.ModelAdmin):
 
 
 @admin.register(ExamUserMapping)
-class ExamUserMappingAdmin(admin.ModelAdmin):
+class ExamUserMappingAdmin(LargeTableAdmin):
     list_display = (
         "exam",
         "user",
         "start_timestamp",
         "end_timestamp",
         "total_score",
+        "activated",
         "completed",
     )
-    list_filter = ("completed", "exam")
-    search_fields = (
-        "exam__title",
+    list_filter = ("completed", "activated", ExamFilter)
+    list_select_related = ("exam", "user")
+    list_only = (
+        "id", "start_timestamp", "end_timestamp", "total_score", "activated", "completed", "exam__id", "user__id",
         "user__username",
-        "user__email",
     )
+    search_fields = ("hash", "user__username")
     readonly_fields = ("start_timestamp",)
     autocomplete_fields = ("exam", "user")
 
+    def get_prefix_search_filter(self, term):
+        return Q(hash__startswith=term) | Q(user_id__in=self.get_matching_user_ids(term))
+
 
 @admin.register(ExamTopicMapping)
 class ExamTopicMappingAdmin(admin.ModelAdmin):
@@ -94,9 +199,32 @@ class ExamMultipleChoiceQuestionMappingAdmin(admin.ModelAdmin):
     readonly_fields = ("created_at",)
     autocomplete_fields = ("exam", "multiple_choice_question")
 
+    def has_change_permission(self, request, obj=None):
+        return super().has_change_permission(request, obj) and not (obj and has_packed_answer_sheets([obj.exam_id]))
+
+    def has_delete_permission(self, request, obj=None):
+        return super().has_delete_permission(request, obj) and not (obj and has_packed_answer_sheets([obj.exam_id]))
+
+
+@admin.register(ExamRegistration)
+class ExamRegistrationAdmin(admin.ModelAdmin):
+    list_display = ("exam", "user", "created_at", "provisioned_at")
+    list_filter = ("exam",)
+    search_fields = ("exam__title", "user__username", "user__email")
+    readonly_fields = ("created_at", "provisioned_at")
+    autocomplete_fields = ("exam", "user")
+
+
+@admin.register(ExamTopicRanking)
+class ExamTopicRankingAdmin(admin.ModelAdmin):
+    list_display = ("exam", "topic", "exam_user_mapping", "score", "rank", "percentile")
+    list_filter = ("exam", "topic")
+    search_fields = ("exam__title", "topic__title", "exam_user_mapping__user__username")
+    autocomplete_fields = ("exam", "topic", "exam_user_mapping")
+
 
 @admin.register(ExamUserMultipleChoiceQuestionMapping)
-class ExamUserMultipleChoiceQuestionMappingAdmin(admin.ModelAdmin):
+class ExamUserMultipleChoiceQuestionMappingAdmin(LargeTableAdmin):
     list_display = (
         "exam_user_mapping",
         "multiple_choice_question",
@@ -105,15 +233,25 @@ class ExamUserMultipleChoiceQuestionMappingAdmin(admin.ModelAdmin):
         "is_completed",
         "completed_at",
     )
-    list_filter = ("is_correct", "is_completed")
-    search_fields = (
-        "exam_user_mapping__exam__title",
-        "exam_user_mapping__user__username",
-        "multiple_choice_question__hash",
+    list_filter = ("is_correct", "is_completed", ExamFilter)
+    list_select_related = ("exam_user_mapping", "multiple_choice_question")
+    list_only = (
+        "id", "selected_choice", "is_correct", "is_completed", "completed_at", "exam_user_mapping__id",
+        "multiple_choice_question__id",
     )
+    search_fields = ("hash", "exam_user_mapping__hash", "exam_user_mapping__user__username")
+    search_help_text = "Prefix of the answer hash, the session hash or the username."
     readonly_fields = ("hash", "created_at")
     autocomplete_fields = ("exam_user_mapping", "multiple_choice_question")
 
+    def get_prefix_search_filter(self, term):
+        exam_user_mapping_ids = list(
+            ExamUserMapping.objects.filter(
+                Q(hash__startswith=term) | Q(user_id__in=self.get_matching_user_ids(term))
+            ).values_list("id", flat=True)[:SEARCH_PREFIX_MATCH_LIMIT]
+        )
+        return Q(hash__startswith=term) | Q(exam_user_mapping_id__in=exam_user_mapping_ids)
+
 
 @admin.register(UserExamTypeProfile)
 class UserExamTypeProfileAdmin(admin.ModelAdmin):
@@ -0,0 +1,193 @@
+import math
+import threading
+import time
+from collections import namedtuple
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+
+from testprep.instrumentation import Counter, Histogram, register_metric
+from testprep.utils import get_redis_client
+
+ADMISSION_CONTROL_BACKEND_REDIS = 'redis'
+ADMISSION_CONTROL_BACKEND_LOCAL = 'local'
+
+Admission = namedtuple('Admission', ['admitted', 'admit_at', 'requested_at', 'position', 'retry_after'])
+
+admission_decisions = register_metric(Counter(
+    'testprep_admission_decisions_total', 'Exam start requests admitted or queued by the admission controller.'
+))
+admission_queue_wait = register_metric(Histogram(
+    'testprep_admission_queue_wait_seconds', 'Time from first queued request to admission.',
+    (1, 5, 10, 30, 60, 120, 300, 600),
+))
+
+# Generic cell rate algorithm: KEYS[1] holds the exam's theoretical arrival time, the moment the
+# bucket would be empty again. A request that does not conform reserves the next free slot under
+# KEYS[2] instead of failing, so candidates are admitted in arrival order and asking again before
+# the slot opens never moves anyone forward. KEYS[3] marks candidates whose session already started;
+# they are let through without taking a slot.
+ADMIT_SCRIPT = """
+local now = tonumber(ARGV[1])
+local interval = tonumber(ARGV[2])
+local tolerance = tonumber(ARGV[3])
+local ttl = tonumber(ARGV[4])
+
+if redis.call('EXISTS', KEYS[3]) == 1 then
+    return {1, tostring(now), tostring(now)}
+end
+
+local reservation = redis.call('GET', KEYS[2])
+if reservation then
+    local admit_at, requested_at = string.match(reservation, '([^:]+):([^:]+)')
+    if tonumber(admit_at) <= now then
+        redis.call('DEL', KEYS[2])
+        return {1, admit_at, requested_at}
+    end
+    return {0, admit_at, requested_at}
+end
+
+local tat = tonumber(redis.call('GET', KEYS[1]) or '0')
+if tat < now then
+    tat = now
+end
+local admit_at = math.max(tat - tolerance, now)
+redis.call('SET', KEYS[1], tostring(tat + interval), 'EX', ttl)
+if admit_at <= now then
+    return {1, tostring(now), tostring(now)}
+end
+redis.call('SET', KEYS[2], tostring(admit_at) .. ':' .. tostring(now), 'EX', ttl)
+return {0, tostring(admit_at), tostring(now)}
+"""
+
+
+def get_admission_parameters():
+    interval = 1 / settings.ADMISSION_RATE
+    return interval, (settings.ADMISSION_BURST - 1) * interval, settings.ADMISSION_RESERVATION_TTL
+
+
+def build_admission(admitted, admit_at, requested_at, now):
+    interval = 1 / settings.ADMISSION_RATE
+    wait = max(admit_at - now, 0)
+    return Admission(
+        admitted=bool(admitted),
+        admit_at=admit_at,
+        requested_at=requested_at,
+        position=0 if admitted else max(math.ceil(wait / interval), 1),
+        retry_after=0 if admitted else max(math.ceil(wait), 1),
+    )
+
+
+class RedisAdmissionController:
+    def __init__(self, client):
+        self.client = client
+        self._admit = client.register_script(ADMIT_SCRIPT)
+
+    @staticmethod
+    def get_bucket_key(exam_id):
+        return f'admission:{exam_id}'
+
+    @staticmethod
+    def get_reservation_key(exam_id, user_id):
+        return f'admission:{exam_id}:reservation:{user_id}'
+
+    @staticmethod
+    def get_started_key(exam_id, user_id):
+        return f'admission:{exam_id}:started:{user_id}'
+
+    def admit(self, exam_id, user_id, now=None):
+        now = time.time() if now is None else now
+        interval, tolerance, ttl = get_admission_parameters()
+        admitted, admit_at, requested_at = self._admit(
+            keys=[
+                self.get_bucket_key(exam_id),
+                self.get_reservation_key(exam_id, user_id),
+                self.get_started_key(exam_id, user_id),
+            ],
+            args=[repr(now), repr(interval), repr(tolerance), ttl],
+        )
+        return build_admission(int(admitted), float(admit_at), float(requested_at), now)
+
+    def mark_started(self, exam_id, user_id, ttl):
+        self.client.set(self.get_started_key(exam_id, user_id), 1, ex=ttl)
+
+
+class LocalAdmissionController:
+    # In-process stand-in for the Redis script, for tests and single-process development.
+
+    def __init__(self):
+        self._arrival_times = {}
+        self._reservations = {}
+        self._started = {}
+        self._mutex = threading.Lock()
+
+    def admit(self, exam_id, user_id, now=None):
+        now = time.time() if now is None else now
+        interval, tolerance, _ = get_admission_parameters()
+        with self._mutex:
+            if self._started.get((exam_id, user_id), 0) > now:
+                return build_admission(True, now, now, now)
+
+            reservation = self._reservations.get((exam_id, user_id))
+            if reservation is not None:
+                admit_at, requested_at = reservation
+                if admit_at <= now:
+                    del self._reservations[(exam_id, user_id)]
+                    return build_admission(True, admit_at, requested_at, now)
+                return build_admission(False, admit_at, requested_at, now)
+
+            arrival_time = max(self._arrival_times.get(exam_id, 0.0), now)
+            admit_at = max(arrival_time - tolerance, now)
+            self._arrival_times[exam_id] = arrival_time + interval
+            if admit_at <= now:
+                return build_admission(True, now, now, now)
+            self._reservations[(exam_id, user_id)] = (admit_at, now)
+            return build_admission(False, admit_at, now, now)
+
+    def mark_started(self, exam_id, user_id, ttl, now=None):
+        now = time.time() if now is None else now
+        with self._mutex:
+            self._started[(exam_id, user_id)] = now + ttl
+
+
+_local_admission_controller = LocalAdmissionController()
+
+
+def get_admission_controller():
+    backend = settings.ADMISSION_CONTROL_BACKEND
+    if backend == ADMISSION_CONTROL_BACKEND_REDIS:
+        return RedisAdmissionController(get_redis_client())
+    if backend == ADMISSION_CONTROL_BACKEND_LOCAL:
+        return _local_admission_controller
+    return None
+
+
+def admit_exam_start(exam_id, user_id):
+    admission_controller = get_admission_controller()
+    if admission_controller is None:
+        return None
+
+    admission = admission_controller.admit(exam_id, user_id)
+    if admission.admitted:
+        admission_decisions.inc((('result', 'admitted'),))
+        if admission.admit_at > admission.requested_at:
+            admission_queue_wait.observe((), time.time() - admission.requested_at)
+    else:
+        admission_decisions.inc((('result', 'queued'),))
+    return admission
+
+
+def mark_exam_started(exam_id, user_id, end_timestamp):
+    # Until the session ends, asking to start again answers from the session instead of queueing.
+    admission_controller = get_admission_controller()
+    if admission_controller is None or end_timestamp is None:
+        return
+    ttl = math.ceil((end_timestamp - datetime.now(tz=dt_timezone.utc)).total_seconds())
+    if ttl > 0:
+        admission_controller.mark_started(exam_id, user_id, ttl)
+
+
+def get_requested_at(admission):
+    if admission is None:
+        return None
+    return datetime.fromtimestamp(admission.requested_at, tz=dt_timezone.utc)
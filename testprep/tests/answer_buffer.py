@@ -0,0 +1,463 @@
+import itertools
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from testprep.instrumentation import Gauge, register_metric
+from testprep.utils import get_async_redis_client, get_redis_client
+from tests.answer_keys import get_answer_key
+from tests.answer_sheets import set_answer_slot
+from tests.models import ExamUserMapping, ExamUserMultipleChoiceQuestionMapping
+from tests.session_state import bump_session_state_versions
+
+ANSWER_BUFFER_BACKEND_REDIS = 'redis'
+ANSWER_BUFFER_BACKEND_LOCAL = 'local'
+
+answer_buffer_pending = register_metric(Gauge(
+    'testprep_answer_buffer_pending', 'Answers accepted but not yet written, per exam.'
+))
+answer_buffer_oldest_age = register_metric(Gauge(
+    'testprep_answer_buffer_oldest_age_seconds', 'Age of the oldest answer not yet written, per exam.'
+))
+
+
+class AnswerBufferLockTimeout(APIException):
+    # Surfaces as a 503 with a Retry-After, like DRF's Throttled.
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = 'Answers are still being saved, retry shortly.'
+    default_code = 'answer_buffer_busy'
+
+    def __init__(self, detail=None, code=None):
+        super().__init__(detail, code)
+        self.wait = settings.ANSWER_BUFFER_FLUSH_INTERVAL
+
+
+class AnswerBufferBusy(Exception):
+    # Raised by drain_answer_buffer outside of requests, where the caller retries.
+    pass
+
+
+def encode_stream_fields(entry):
+    return {key: '' if value is None else str(value) for key, value in entry.items()}
+
+
+def get_session_entry_field(entry):
+    # Later answers to the same question or slot replace earlier ones in a session's index.
+    if entry.get('answer_slot') is not None:
+        return f'slot:{entry["answer_slot"]}'
+    return str(entry['exam_user_multiple_choice_question_mapping_id'])
+
+
+class RedisAnswerBuffer:
+    exams_key = 'answer_buffer:exams'
+
+    def __init__(self, client):
+        self.client = client
+
+    @staticmethod
+    def get_stream_key(exam_id):
+        return f'answer_buffer:{exam_id}'
+
+    @staticmethod
+    def get_session_key(exam_id, exam_user_mapping_id):
+        return f'answer_buffer:{exam_id}:{exam_user_mapping_id}'
+
+    @classmethod
+    def add_append_commands(cls, pipeline, exam_id, entry):
+        # Each answer also goes into an index of its session, so completing one session does not
+        # have to wait for, or scan, the flush of the whole exam.
+        session_key = cls.get_session_key(exam_id, entry['exam_user_mapping_id'])
+        pipeline.xadd(cls.get_stream_key(exam_id), encode_stream_fields(entry))
+        pipeline.sadd(cls.exams_key, exam_id)
+        pipeline.hset(session_key, get_session_entry_field(entry), json.dumps(entry))
+        pipeline.expire(session_key, settings.ANSWER_BUFFER_SESSION_TTL)
+
+    def append(self, exam_id, entry):
+        pipeline = self.client.pipeline()
+        self.add_append_commands(pipeline, exam_id, entry)
+        entry_id, *_ = pipeline.execute()
+        return entry_id
+
+    def read(self, exam_id, count):
+        entries = self.client.xrange(self.get_stream_key(exam_id), min='-', max='+', count=count)
+        return [
+            (entry_id, {key.decode(): value.decode() or None for key, value in fields.items()})
+            for entry_id, fields in entries
+        ]
+
+    def acknowledge(self, exam_id, entry_ids):
+        if entry_ids:
+            self.client.xdel(self.get_stream_key(exam_id), *entry_ids)
+
+    def read_session(self, exam_id, exam_user_mapping_id):
+        entries = self.client.hvals(self.get_session_key(exam_id, exam_user_mapping_id))
+        return [json.loads(entry) for entry in entries]
+
+    def forget_session(self, exam_id, exam_user_mapping_id):
+        self.client.delete(self.get_session_key(exam_id, exam_user_mapping_id))
+
+    def exam_ids(self):
+        return [int(exam_id) for exam_id in self.client.smembers(self.exams_key)]
+
+    def forget(self, exam_id):
+        self.client.srem(self.exams_key, exam_id)
+
+    def lock(self, exam_id, blocking_timeout=None):
+        return self.client.lock(
+            f'answer_buffer_flush:{exam_id}',
+            timeout=settings.ANSWER_BUFFER_DRAIN_TIMEOUT * 2,
+            blocking_timeout=blocking_timeout,
+        )
+
+    def lag(self, exam_id):
+        stream_key = self.get_stream_key(exam_id)
+        pipeline = self.client.pipeline()
+        pipeline.xlen(stream_key)
+        pipeline.xrange(stream_key, min='-', max='+', count=1)
+        pending, oldest = pipeline.execute()
+        oldest_age_seconds = 0.0
+        if oldest:
+            oldest_timestamp = int(oldest[0][0].split(b'-')[0]) / 1000
+            oldest_age_seconds = max(0.0, time.time() - oldest_timestamp)
+        return {'pending': pending, 'oldest_age_seconds': round(oldest_age_seconds, 3)}
+
+
+class AsyncRedisAnswerBuffer:
+    # The submit side of RedisAnswerBuffer for async views; flushing stays on the sync client.
+
+    def __init__(self, client):
+        self.client = client
+
+    async def append(self, exam_id, entry):
+        pipeline = self.client.pipeline()
+        RedisAnswerBuffer.add_append_commands(pipeline, exam_id, entry)
+        entry_id, *_ = await pipeline.execute()
+        return entry_id
+
+
+class LocalAnswerBufferLock:
+    def __init__(self, lock, blocking_timeout=None):
+        self._lock = lock
+        self.blocking_timeout = blocking_timeout
+
+    def acquire(self, blocking=True):
+        if not blocking:
+            return self._lock.acquire(blocking=False)
+        timeout = -1 if self.blocking_timeout is None else self.blocking_timeout
+        return self._lock.acquire(timeout=timeout)
+
+    def release(self):
+        self._lock.release()
+
+
+class LocalAnswerBuffer:
+    # In-process stand-in for the Redis stream, for tests and single-process development.
+
+    def __init__(self):
+        self._streams = defaultdict(deque)
+        self._sessions = defaultdict(dict)
+        self._locks = defaultdict(threading.Lock)
+        self._mutex = threading.Lock()
+        self._sequence = itertools.count(1)
+
+    def append(self, exam_id, entry):
+        with self._mutex:
+            entry_id = next(self._sequence)
+            self._streams[exam_id].append((entry_id, time.time(), dict(entry)))
+            self._sessions[exam_id, int(entry['exam_user_mapping_id'])][get_session_entry_field(entry)] = dict(entry)
+        return entry_id
+
+    def read_session(self, exam_id, exam_user_mapping_id):
+        with self._mutex:
+            return list(self._sessions.get((exam_id, int(exam_user_mapping_id)), {}).values())
+
+    def forget_session(self, exam_id, exam_user_mapping_id):
+        with self._mutex:
+            self._sessions.pop((exam_id, int(exam_user_mapping_id)), None)
+
+    def read(self, exam_id, count):
+        with self._mutex:
+            return [
+                (entry_id, entry)
+                for entry_id, _, entry in itertools.islice(self._streams.get(exam_id, ()), count)
+            ]
+
+    def acknowledge(self, exam_id, entry_ids):
+        entry_ids = set(entry_ids)
+        with self._mutex:
+            stream = self._streams.get(exam_id)
+            if stream is None:
+                return
+            self._streams[exam_id] = deque(item for item in stream if item[0] not in entry_ids)
+
+    def exam_ids(self):
+        with self._mutex:
+            return list(self._streams.keys())
+
+    def forget(self, exam_id):
+        with self._mutex:
+            if not self._streams.get(exam_id):
+                self._streams.pop(exam_id, None)
+
+    def lock(self, exam_id, blocking_timeout=None):
+        with self._mutex:
+            return LocalAnswerBufferLock(self._locks[exam_id], blocking_timeout=blocking_timeout)
+
+    def lag(self, exam_id):
+        with self._mutex:
+            stream = self._streams.get(exam_id) or ()
+            pending = len(stream)
+            oldest_age_seconds = max(0.0, time.time() - stream[0][1]) if stream else 0.0
+        return {'pending': pending, 'oldest_age_seconds': round(oldest_age_seconds, 3)}
+
+
+_local_answer_buffer = LocalAnswerBuffer()
+
+
+class AsyncLocalAnswerBuffer:
+    def __init__(self, answer_buffer):
+        self.answer_buffer = answer_buffer
+
+    async def append(self, exam_id, entry):
+        return self.answer_buffer.append(exam_id, entry)
+
+
+_async_local_answer_buffer = AsyncLocalAnswerBuffer(_local_answer_buffer)
+
+
+def get_answer_buffer():
+    backend = settings.ANSWER_BUFFER_BACKEND
+    if backend == ANSWER_BUFFER_BACKEND_REDIS:
+        return RedisAnswerBuffer(get_redis_client())
+    if backend == ANSWER_BUFFER_BACKEND_LOCAL:
+        return _local_answer_buffer
+    return None
+
+
+def get_async_answer_buffer():
+    backend = settings.ANSWER_BUFFER_BACKEND
+    if backend == ANSWER_BUFFER_BACKEND_REDIS:
+        return AsyncRedisAnswerBuffer(get_async_redis_client())
+    if backend == ANSWER_BUFFER_BACKEND_LOCAL:
+        return _async_local_answer_buffer
+    return None
+
+
+def build_buffer_entry(exam_user_mapping_id, exam_user_multiple_choice_question_mapping_id, selected_choice,
+                       submitted_at):
+    return {
+        'exam_user_mapping_id': exam_user_mapping_id,
+        'exam_user_multiple_choice_question_mapping_id': exam_user_multiple_choice_question_mapping_id,
+        'selected_choice': selected_choice,
+        'submitted_at': submitted_at.timestamp(),
+    }
+
+
+def buffer_answer(answer_buffer, exam_id, exam_user_mapping_id, exam_user_multiple_choice_question_mapping_id,
+                  selected_choice, submitted_at):
+    return answer_buffer.append(exam_id, build_buffer_entry(
+        exam_user_mapping_id, exam_user_multiple_choice_question_mapping_id, selected_choice, submitted_at
+    ))
+
+
+async def abuffer_answer(answer_buffer, exam_id, exam_user_mapping_id, exam_user_multiple_choice_question_mapping_id,
+                         selected_choice, submitted_at):
+    return await answer_buffer.append(exam_id, build_buffer_entry(
+        exam_user_mapping_id, exam_user_multiple_choice_question_mapping_id, selected_choice, submitted_at
+    ))
+
+
+def build_answer_slot_buffer_entry(exam_user_mapping_id, slot, selected_choice, submitted_at):
+    return {
+        'exam_user_mapping_id': exam_user_mapping_id,
+        'answer_slot': slot,
+        'selected_choice': selected_choice,
+        'submitted_at': submitted_at.timestamp(),
+    }
+
+
+def buffer_answer_slot(answer_buffer, exam_id, exam_user_mapping_id, slot, selected_choice, submitted_at):
+    return answer_buffer.append(exam_id, build_answer_slot_buffer_entry(
+        exam_user_mapping_id, slot, selected_choice, submitted_at
+    ))
+
+
+async def abuffer_answer_slot(answer_buffer, exam_id, exam_user_mapping_id, slot, selected_choice, submitted_at):
+    return await answer_buffer.append(exam_id, build_answer_slot_buffer_entry(
+        exam_user_mapping_id, slot, selected_choice, submitted_at
+    ))
+
+
+def get_submitted_at(entry):
+    return datetime.fromtimestamp(float(entry['submitted_at']), tz=dt_timezone.utc)
+
+
+def is_submitted_before_close(entry, completed, completed_at, end_timestamp):
+    # Entries are flushed some seconds after they were accepted, possibly after their session was
+    # completed. Only answers submitted after the session closed are dropped.
+    if not completed:
+        return True
+    closed_at = completed_at or end_timestamp
+    return closed_at is None or get_submitted_at(entry) <= closed_at
+
+
+def apply_buffered_answer_slots(exam_id, entries):
+    latest_entries = defaultdict(dict)
+    for entry in entries:
+        latest_entries[int(entry['exam_user_mapping_id'])][int(entry['answer_slot'])] = entry
+
+    exam_user_mappings = ExamUserMapping.objects.filter(
+        exam_id=exam_id,
+        id__in=latest_entries.keys(),
+        answer_sheet__isnull=False,
+    ).only('id', 'answer_sheet', 'answer_attempts', 'completed', 'completed_at', 'end_timestamp')
+
+    updated = []
+    for exam_user_mapping in exam_user_mappings:
+        answer_sheet, answer_attempts = bytes(exam_user_mapping.answer_sheet), bytes(exam_user_mapping.answer_attempts)
+        for slot, entry in latest_entries[exam_user_mapping.id].items():
+            if not is_submitted_before_close(
+                entry, exam_user_mapping.completed, exam_user_mapping.completed_at, exam_user_mapping.end_timestamp
+            ):
+                continue
+            answer_sheet, answer_attempts = set_answer_slot(
+                answer_sheet, answer_attempts, slot, int(entry['selected_choice'])
+            ) or (answer_sheet, answer_attempts)
+        exam_user_mapping.answer_sheet, exam_user_mapping.answer_attempts = answer_sheet, answer_attempts
+        updated.append(exam_user_mapping)
+
+    ExamUserMapping.objects.bulk_update(
+        updated, ['answer_sheet', 'answer_attempts'], batch_size=settings.ANSWER_BUFFER_FLUSH_BATCH_SIZE
+    )
+    bump_session_state_versions([exam_user_mapping.id for exam_user_mapping in updated])
+    return len(updated)
+
+
+def apply_buffered_answers(exam_id, entries, answer_key):
+    latest_entries = {}
+    answer_slot_entries = []
+    for entry in entries:
+        if entry.get('answer_slot') is not None:
+            answer_slot_entries.append(entry)
+            continue
+        latest_entries[int(entry['exam_user_multiple_choice_question_mapping_id'])] = entry
+    if answer_slot_entries:
+        apply_buffered_answer_slots(exam_id, answer_slot_entries)
+
+    exam_user_multiple_choice_question_mappings = ExamUserMultipleChoiceQuestionMapping.objects.filter(
+        exam_id=exam_id,
+        id__in=latest_entries.keys(),
+    ).only(
+        'id', 'exam_id', 'exam_user_mapping_id', 'multiple_choice_question_id', 'input_puzzle_answer'
+    ).annotate(
+        session_completed=F('exam_user_mapping__completed'),
+        session_completed_at=F('exam_user_mapping__completed_at'),
+        session_end_timestamp=F('exam_user_mapping__end_timestamp'),
+    )
+
+    updated = []
+    for exam_user_multiple_choice_question_mapping in exam_user_multiple_choice_question_mappings:
+        entry = latest_entries[exam_user_multiple_choice_question_mapping.id]
+        if not is_submitted_before_close(
+            entry,
+            exam_user_multiple_choice_question_mapping.session_completed,
+            exam_user_multiple_choice_question_mapping.session_completed_at,
+            exam_user_multiple_choice_question_mapping.session_end_timestamp,
+        ):
+            continue
+        exam_user_multiple_choice_question_mapping.selected_choice = int(entry['selected_choice'])
+        exam_user_multiple_choice_question_mapping.is_completed = True
+        exam_user_multiple_choice_question_mapping.completed_at = get_submitted_at(entry)
+        exam_user_multiple_choice_question_mapping.is_correct = exam_user_multiple_choice_question_mapping.get_is_correct(
+            answer_key=answer_key
+        )
+        updated.append(exam_user_multiple_choice_question_mapping)
+
+    ExamUserMultipleChoiceQuestionMapping.objects.filter(exam_id=exam_id).bulk_update(
+        updated,
+        ['selected_choice', 'is_completed', 'completed_at', 'is_correct'],
+        batch_size=settings.ANSWER_BUFFER_FLUSH_BATCH_SIZE,
+    )
+    bump_session_state_versions(
+        {exam_user_multiple_choice_question_mapping.exam_user_mapping_id for exam_user_multiple_choice_question_mapping in updated},
+        [exam_user_multiple_choice_question_mapping.id for exam_user_multiple_choice_question_mapping in updated],
+        exam_id=exam_id,
+    )
+    return len(updated)
+
+
+def _flush_locked(answer_buffer, exam_id, batch_size):
+    flushed = 0
+    while True:
+        entries = answer_buffer.read(exam_id, batch_size)
+        if not entries:
+            return flushed
+        with transaction.atomic():
+            apply_buffered_answers(exam_id, (entry for _, entry in entries), get_answer_key(exam_id))
+        answer_buffer.acknowledge(exam_id, [entry_id for entry_id, _ in entries])
+        flushed += len(entries)
+
+
+def flush_answer_buffer(exam_id, answer_buffer=None, batch_size=None):
+    answer_buffer = answer_buffer or get_answer_buffer()
+    if answer_buffer is None:
+        return 0
+
+    lock = answer_buffer.lock(exam_id)
+    if not lock.acquire(blocking=False):
+        return 0
+    try:
+        return _flush_locked(answer_buffer, exam_id, batch_size or settings.ANSWER_BUFFER_FLUSH_BATCH_SIZE)
+    finally:
+        lock.release()
+
+
+def drain_answer_buffer(exam_id, answer_buffer=None, batch_size=None):
+    # Waits for any in-flight flush so that every answer acknowledged so far is in the database on return.
+    answer_buffer = answer_buffer or get_answer_buffer()
+    if answer_buffer is None:
+        return 0
+
+    lock = answer_buffer.lock(exam_id, blocking_timeout=settings.ANSWER_BUFFER_DRAIN_TIMEOUT)
+    if not lock.acquire():
+        raise AnswerBufferBusy(f'Timed out waiting to drain the answer buffer of exam {exam_id}.')
+    try:
+        return _flush_locked(answer_buffer, exam_id, batch_size or settings.ANSWER_BUFFER_FLUSH_BATCH_SIZE)
+    finally:
+        lock.release()
+
+
+def apply_session_answer_buffer(exam_user_mapping, answer_buffer=None):
+    # Writes the answers still buffered for one session, for completing it inside its own transaction.
+    # The entries stay in the exam's stream; the next flush rewrites the same values.
+    answer_buffer = answer_buffer or get_answer_buffer()
+    if answer_buffer is None:
+        return 0
+    entries = answer_buffer.read_session(exam_user_mapping.exam_id, exam_user_mapping.id)
+    if not entries:
+        return 0
+    return apply_buffered_answers(exam_user_mapping.exam_id, entries, get_answer_key(exam_user_mapping.exam_id))
+
+
+def get_answer_buffer_lag(answer_buffer=None):
+    answer_buffer = answer_buffer or get_answer_buffer()
+    if answer_buffer is None:
+        return {}
+    return {exam_id: answer_buffer.lag(exam_id) for exam_id in answer_buffer.exam_ids()}
+
+
+def record_answer_buffer_lag(answer_buffer_lag):
+    answer_buffer_pending.replace({
+        (('exam_id', exam_id),): lag['pending'] for exam_id, lag in answer_buffer_lag.items()
+    })
+    answer_buffer_oldest_age.replace({
+        (('exam_id', exam_id),): lag['oldest_age_seconds'] for exam_id, lag in answer_buffer_lag.items()
+    })
@@ -0,0 +1,176 @@
+import json
+from collections import namedtuple
+from functools import cached_property
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from testprep.utils import LRUCache, get_async_redis_client, get_redis_client
+from tests.enums import ExamType, MultipleChoiceQuestionType
+from tests.exam_content import aget_exam_content_version, get_exam_content_version
+from tests.models import Exam, ExamMultipleChoiceQuestionMapping
+
+AnswerKeyEntry = namedtuple(
+    'AnswerKeyEntry',
+    ['question_type', 'correct_choice', 'correct_puzzle_answer', 'topic_id'],
+)
+
+_local_answer_keys = LRUCache(maxsize=settings.ANSWER_KEY_CACHE_SIZE)
+
+
+def normalize_puzzle_answer(answer):
+    return (answer or '').strip().lower()
+
+
+def grade_answer(entry, selected_choice, input_puzzle_answer):
+    if not selected_choice and not input_puzzle_answer:
+        return None
+    if entry.question_type == MultipleChoiceQuestionType.MULTIPLE_CHOICE_QUESTION:
+        try:
+            return int(selected_choice) == entry.correct_choice
+        except (TypeError, ValueError):
+            return False
+    elif entry.question_type == MultipleChoiceQuestionType.PUZZLE_QUESTION:
+        return normalize_puzzle_answer(input_puzzle_answer) == entry.correct_puzzle_answer
+    return False
+
+
+class AnswerKey:
+    def __init__(self, exam_id, exam_type, questions, topic_titles):
+        self.exam_id = exam_id
+        self.exam_type = exam_type
+        self.questions = questions
+        self.topic_titles = topic_titles
+        # Questions in exam order, which is also their slot order in packed answer sheets.
+        self.question_ids = list(questions)
+
+    @staticmethod
+    def entry_for_question(multiple_choice_question):
+        return AnswerKeyEntry(
+            multiple_choice_question.question_type,
+            multiple_choice_question.correct_choice,
+            normalize_puzzle_answer(multiple_choice_question.correct_puzzle_answer),
+            multiple_choice_question.topic_id,
+        )
+
+    def get(self, multiple_choice_question_id):
+        return self.questions.get(multiple_choice_question_id)
+
+    def get_question_id(self, slot):
+        if 0 <= slot < len(self.question_ids):
+            return self.question_ids[slot]
+        return None
+
+    @cached_property
+    def answer_sheet_grader(self):
+        from tests.answer_sheets import AnswerSheetGrader
+
+        return AnswerSheetGrader(self)
+
+    def get_topic_id(self, multiple_choice_question_id):
+        entry = self.questions.get(multiple_choice_question_id)
+        return entry.topic_id if entry else None
+
+    def grade(self, multiple_choice_question_id, selected_choice, input_puzzle_answer):
+        entry = self.questions.get(multiple_choice_question_id)
+        if entry is None:
+            return None
+        return grade_answer(entry, selected_choice, input_puzzle_answer)
+
+    def get_points(self, is_correct):
+        if is_correct is True:
+            return ExamType.get_marks_per_correct(self.exam_type)
+        if is_correct is False:
+            return -ExamType.get_negative_marks_per_wrong(self.exam_type)
+        return 0
+
+    def to_json(self):
+        return json.dumps({
+            'exam_type': self.exam_type,
+            'questions': {str(question_id): list(entry) for question_id, entry in self.questions.items()},
+            'topic_titles': {str(topic_id): title for topic_id, title in self.topic_titles.items()},
+        })
+
+    @classmethod
+    def from_json(cls, exam_id, payload):
+        data = json.loads(payload)
+        return cls(
+            exam_id,
+            data['exam_type'],
+            {int(question_id): AnswerKeyEntry(*entry) for question_id, entry in data['questions'].items()},
+            {int(topic_id): title for topic_id, title in data['topic_titles'].items()},
+        )
+
+
+def compile_answer_key(exam_id):
+    rows = ExamMultipleChoiceQuestionMapping.objects.filter(exam_id=exam_id).order_by('id').values_list(
+        'multiple_choice_question_id',
+        'multiple_choice_question__question_type',
+        'multiple_choice_question__correct_choice',
+        'multiple_choice_question__correct_puzzle_answer',
+        'multiple_choice_question__topic_id',
+        'multiple_choice_question__topic__title',
+    )
+
+    questions = {}
+    topic_titles = {}
+    for question_id, question_type, correct_choice, correct_puzzle_answer, topic_id, topic_title in rows:
+        questions[question_id] = AnswerKeyEntry(
+            question_type, correct_choice, normalize_puzzle_answer(correct_puzzle_answer), topic_id
+        )
+        if topic_id is not None:
+            topic_titles[topic_id] = topic_title
+
+    exam_type = Exam.objects.filter(id=exam_id).values_list('exam_type', flat=True).first()
+    return AnswerKey(exam_id, exam_type, questions, topic_titles)
+
+
+def _get_cache_key(exam_id, version):
+    return f'answer_key:{exam_id}:{version}'
+
+
+def get_answer_key(exam_id):
+    version = get_exam_content_version(exam_id)
+
+    answer_key = _local_answer_keys.get((exam_id, version))
+    if answer_key is not None:
+        return answer_key
+
+    redis_client = get_redis_client()
+    payload = redis_client.get(_get_cache_key(exam_id, version))
+    if payload:
+        answer_key = AnswerKey.from_json(exam_id, payload)
+    else:
+        answer_key = compile_answer_key(exam_id)
+        redis_client.set(
+            _get_cache_key(exam_id, version),
+            answer_key.to_json(),
+            ex=settings.ANSWER_KEY_CACHE_TIMEOUT,
+        )
+
+    _local_answer_keys.set((exam_id, version), answer_key)
+    return answer_key
+
+
+
+async def aget_answer_key(exam_id):
+    version = await aget_exam_content_version(exam_id)
+
+    answer_key = _local_answer_keys.get((exam_id, version))
+    if answer_key is not None:
+        return answer_key
+
+    redis_client = get_async_redis_client()
+    payload = await redis_client.get(_get_cache_key(exam_id, version))
+    if payload:
+        answer_key = AnswerKey.from_json(exam_id, payload)
+    else:
+        answer_key = await sync_to_async(compile_answer_key)(exam_id)
+        await redis_client.set(
+            _get_cache_key(exam_id, version),
+            answer_key.to_json(),
+            ex=settings.ANSWER_KEY_CACHE_TIMEOUT,
+        )
+
+    _local_answer_keys.set((exam_id, version), answer_key)
+    return answer_key
@@ -0,0 +1,230 @@
+from collections import namedtuple
+
+import numpy as np
+from django.db import connection, transaction
+from django.db.models import BinaryField, F, Func, Value
+from django.db.models.functions import Length
+
+from tests.answer_keys import aget_answer_key, get_answer_key, grade_answer
+from tests.models import ExamUserMapping, MultipleChoiceQuestion
+from tests.resolvers import exam_user_mapping_resolver
+
+# Packed answer sheets keep a session's answers on its ExamUserMapping: answer_sheet holds one byte per
+# question slot, in the exam's question order, with the chosen option or 0, and answer_attempts a
+# little-endian bitmap of the slots that were answered. The per-question API addresses a slot with
+# "<session hash>.<slot>", which the submit views resolve through resolve_answer_slot.
+
+ANSWER_SLOT_HASH_SEPARATOR = '.'
+SLOT_CHOICES = tuple(choice for choice, _ in MultipleChoiceQuestion.ANSWER_CHOICES)
+
+AnswerSlotRef = namedtuple(
+    'AnswerSlotRef',
+    ['id', 'hash', 'exam_user_mapping_id', 'exam_user_mapping_hash', 'multiple_choice_question_id',
+     'input_puzzle_answer', 'exam_id', 'slot'],
+)
+
+
+class SetByte(Func):
+    function = 'set_byte'
+    output_field = BinaryField()
+
+
+class SetBit(Func):
+    function = 'set_bit'
+    output_field = BinaryField()
+
+
+def get_attempts_length(slots):
+    return (slots + 7) // 8
+
+
+def build_empty_answer_sheet(slots):
+    return bytes(slots), bytes(get_attempts_length(slots))
+
+
+def get_answer_slot_hash(exam_user_mapping_hash, slot):
+    return f'{exam_user_mapping_hash}{ANSWER_SLOT_HASH_SEPARATOR}{slot}'
+
+
+def is_answer_slot_hash(hash):
+    return bool(hash) and ANSWER_SLOT_HASH_SEPARATOR in hash
+
+
+def parse_answer_slot_hash(hash):
+    exam_user_mapping_hash, _, slot = (hash or '').rpartition(ANSWER_SLOT_HASH_SEPARATOR)
+    if not exam_user_mapping_hash or not slot.isdigit():
+        return None
+    return exam_user_mapping_hash, int(slot)
+
+
+def parse_slot_choice(selected_choice):
+    try:
+        selected_choice = int(selected_choice)
+    except (TypeError, ValueError):
+        return None
+    return selected_choice if selected_choice in SLOT_CHOICES else None
+
+
+def _build_answer_slot_ref(hash, slot, exam_user_mapping_ref, answer_key):
+    multiple_choice_question_id = answer_key.get_question_id(slot)
+    if multiple_choice_question_id is None:
+        return None
+    return AnswerSlotRef(
+        None, hash, exam_user_mapping_ref.id, exam_user_mapping_ref.hash, multiple_choice_question_id, None,
+        exam_user_mapping_ref.exam_id, slot,
+    )
+
+
+def resolve_answer_slot(hash):
+    parsed_hash = parse_answer_slot_hash(hash)
+    if parsed_hash is None:
+        return None
+    exam_user_mapping_hash, slot = parsed_hash
+    exam_user_mapping_ref = exam_user_mapping_resolver.resolve(exam_user_mapping_hash)
+    if exam_user_mapping_ref is None:
+        return None
+    return _build_answer_slot_ref(hash, slot, exam_user_mapping_ref, get_answer_key(exam_user_mapping_ref.exam_id))
+
+
+async def aresolve_answer_slot(hash):
+    parsed_hash = parse_answer_slot_hash(hash)
+    if parsed_hash is None:
+        return None
+    exam_user_mapping_hash, slot = parsed_hash
+    exam_user_mapping_ref = await exam_user_mapping_resolver.aresolve(exam_user_mapping_hash)
+    if exam_user_mapping_ref is None:
+        return None
+    return _build_answer_slot_ref(
+        hash, slot, exam_user_mapping_ref, await aget_answer_key(exam_user_mapping_ref.exam_id)
+    )
+
+
+def set_answer_slot(answer_sheet, answer_attempts, slot, selected_choice):
+    # Returns patched copies, or None when the sheet predates the slot.
+    if slot >= len(answer_sheet):
+        return None
+    answer_sheet = bytearray(answer_sheet)
+    answer_attempts = bytearray(answer_attempts)
+    answer_sheet[slot] = selected_choice
+    answer_attempts[slot // 8] |= 1 << (slot % 8)
+    return bytes(answer_sheet), bytes(answer_attempts)
+
+
+def save_answer_slot(exam_user_mapping_id, slot, selected_choice, now):
+    # Postgres rewrites the slot byte and attempt bit in place in a single UPDATE; other databases
+    # patch the sheet under a row lock. The state version is bumped in the same statement either way.
+    exam_user_mappings = ExamUserMapping.objects.filter(
+        id=exam_user_mapping_id,
+        completed=False,
+        end_timestamp__gt=now,
+        answer_sheet__isnull=False,
+    )
+    if connection.vendor == 'postgresql':
+        updated = exam_user_mappings.alias(answer_sheet_length=Length('answer_sheet')).filter(
+            answer_sheet_length__gt=slot,
+        ).update(
+            answer_sheet=SetByte(F('answer_sheet'), Value(slot), Value(selected_choice)),
+            answer_attempts=SetBit(F('answer_attempts'), Value(slot), Value(1)),
+            state_version=F('state_version') + 1,
+        )
+        return bool(updated)
+
+    with transaction.atomic():
+        row = exam_user_mappings.select_for_update().values_list('answer_sheet', 'answer_attempts').first()
+        patched = row and set_answer_slot(bytes(row[0]), bytes(row[1]), slot, selected_choice)
+        if not patched:
+            return False
+        answer_sheet, answer_attempts = patched
+        ExamUserMapping.objects.filter(id=exam_user_mapping_id).update(
+            answer_sheet=answer_sheet,
+            answer_attempts=answer_attempts,
+            state_version=F('state_version') + 1,
+        )
+    return True
+
+
+def _stack(buffers, width):
+    # Sheets written before questions were added to the exam are shorter; missing slots read as unanswered.
+    buffers = [bytes(buffer or b'') for buffer in buffers]
+    if all(len(buffer) == width for buffer in buffers):
+        return np.frombuffer(b''.join(buffers), dtype=np.uint8).reshape(len(buffers), width)
+    matrix = np.zeros((len(buffers), width), dtype=np.uint8)
+    for index, buffer in enumerate(buffers):
+        buffer = buffer[:width]
+        matrix[index, :len(buffer)] = np.frombuffer(buffer, dtype=np.uint8)
+    return matrix
+
+
+class AnswerSheetGrader:
+    # Grades packed answer sheets against an exam's answer key. grades[slot, choice] is 1 when the
+    # choice is correct for that slot and -1 when it is not, so a batch of sheets is graded with one
+    # lookup, and per-topic counts come from a product with the slot-to-topic matrix.
+
+    def __init__(self, answer_key):
+        self.slots = len(answer_key.question_ids)
+        self.grades = np.zeros((self.slots, max(SLOT_CHOICES) + 1), dtype=np.int8)
+        slot_topic_ids = []
+        for slot, multiple_choice_question_id in enumerate(answer_key.question_ids):
+            entry = answer_key.get(multiple_choice_question_id)
+            for choice in SLOT_CHOICES:
+                self.grades[slot, choice] = 1 if grade_answer(entry, choice, None) else -1
+            slot_topic_ids.append(entry.topic_id)
+
+        self.topic_ids = list(dict.fromkeys(slot_topic_ids))
+        topic_indexes = {topic_id: index for index, topic_id in enumerate(self.topic_ids)}
+        self.topic_matrix = np.zeros((self.slots, len(self.topic_ids)), dtype=np.int32)
+        self.topic_matrix[np.arange(self.slots), [topic_indexes[topic_id] for topic_id in slot_topic_ids]] = 1
+
+    def grade(self, answer_sheets, answer_attempts):
+        # (sessions, slots) matrix of 1 for correct, -1 for incorrect and 0 for unanswered slots.
+        choices = _stack(answer_sheets, self.slots)
+        attempted = np.unpackbits(
+            _stack(answer_attempts, get_attempts_length(self.slots)), axis=1, count=self.slots, bitorder='little'
+        )
+        choices = np.where(choices < self.grades.shape[1], choices, 0)
+        return self.grades[np.arange(self.slots), choices] * attempted.astype(np.int8)
+
+    def get_topic_counts(self, answer_sheets, answer_attempts):
+        # One topic_counts dict per sheet, in the shape the row-based scorers build: topics with at
+        # least one answered question, with their correct and incorrect counts.
+        graded = self.grade(answer_sheets, answer_attempts)
+        correct = (graded == 1).astype(np.int32) @ self.topic_matrix
+        incorrect = (graded == -1).astype(np.int32) @ self.topic_matrix
+        return [
+            {
+                topic_id: {'correct': int(correct[row, index]), 'incorrect': int(incorrect[row, index])}
+                for index, topic_id in enumerate(self.topic_ids)
+                if correct[row, index] or incorrect[row, index]
+            }
+            for row in range(graded.shape[0])
+        ]
+
+    def get_slots(self, answer_sheet, answer_attempts):
+        # (selected_choice, is_completed, is_correct) per slot of one sheet.
+        graded = self.grade([answer_sheet], [answer_attempts])[0]
+        choices = _stack([answer_sheet], self.slots)[0]
+        return [
+            (int(choice) if grade else None, bool(grade), None if not grade else bool(grade > 0))
+            for choice, grade in zip(choices.tolist(), graded.tolist())
+        ]
+
+
+def get_answer_sheet_rows(exam_user_mapping, answer_key):
+    # Stands in for the session's ExamUserMultipleChoiceQuestionMapping rows in the session payloads.
+    # Slots keep no timestamps of their own, so created_at is the session's start and completed_at is empty.
+    return [
+        {
+            'hash': get_answer_slot_hash(exam_user_mapping.hash, slot),
+            'multiple_choice_question_id': multiple_choice_question_id,
+            'selected_choice': selected_choice,
+            'input_puzzle_answer': None,
+            'created_at': exam_user_mapping.start_timestamp,
+            'completed_at': None,
+            'is_completed': is_completed,
+            'is_correct': is_correct,
+        }
+        for slot, (multiple_choice_question_id, (selected_choice, is_completed, is_correct)) in enumerate(zip(
+            answer_key.question_ids,
+            answer_key.answer_sheet_grader.get_slots(exam_user_mapping.answer_sheet, exam_user_mapping.answer_attempts),
+        ))
+    ]
@@ -0,0 +1,21 @@
+from django.urls import path
+
+from .async_views import ExamUserMappingDetailAsyncView, ExamUserMultipleChoiceQuestionMappingSubmitAsyncView
+from .urls import urlpatterns as sync_urlpatterns
+
+app_name = "tests"
+
+# Same routes and names as tests.urls; the async views are matched first and everything else falls
+# through to the DRF views.
+urlpatterns = [
+      path(
+          "exam-user-mappings/<str:hash_exam_user_mapping>/",
+          ExamUserMappingDetailAsyncView.as_view(),
+          name="exam-user-mapping-detail",
+      ),
+      path(
+          "exam-user-multiple-choice-question-mappings/<str:hash_exam_user_multiple_choice_question_mapping>/submit/",
+          ExamUserMultipleChoiceQuestionMappingSubmitAsyncView.as_view(),
+          name="exam-user-mcq-submit",
+      ),
+  ] + sync_urlpatterns
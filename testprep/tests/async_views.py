@@ -0,0 +1,247 @@
+import json
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse, JsonResponse, QueryDict
+from django.utils import timezone
+from django.views import View
+from django.views.decorators.csrf import csrf_exempt
+from rest_framework.authentication import CSRFCheck
+
+from tests.answer_buffer import AnswerBufferLockTimeout, abuffer_answer, abuffer_answer_slot, \
+    get_async_answer_buffer
+from tests.answer_keys import aget_answer_key
+from tests.answer_sheets import AnswerSlotRef, aresolve_answer_slot, is_answer_slot_hash, parse_slot_choice, \
+    save_answer_slot
+from tests.live_leaderboard import arecord_live_answer, get_async_live_leaderboard
+from tests.models import ExamUserMapping, ExamUserMultipleChoiceQuestionMapping
+from tests.paper_snapshots import render_exam_user_mapping_detail
+from tests.resolvers import exam_user_mapping_resolver, exam_user_multiple_choice_question_mapping_resolver
+from tests.session_state import aget_session_etag, etag_matches, render_session_changes
+from tests.utils import complete_exam_user_mapping, save_submitted_answer
+
+
+class AsyncAPIView(View):
+    # Async counterparts of the hottest DRF views, served by the ASGI app under the same URLs
+    # (see testprep.asgi_urls). They answer with the same status codes and bodies as the DRF views.
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        # As with DRF's SessionAuthentication, CSRF is only enforced for logged-in sessions.
+        return csrf_exempt(super().as_view(**initkwargs))
+
+    @staticmethod
+    async def enforce_csrf(request):
+        user = await request.auser()
+        if not user or not user.is_active:
+            return None
+        check = CSRFCheck(lambda request: None)
+        check.process_request(request)
+        reason = check.process_view(request, None, (), {})
+        if reason:
+            return JsonResponse({"detail": f"CSRF Failed: {reason}"}, status=403)
+        return None
+
+    @staticmethod
+    def get_data(request):
+        if request.content_type == 'application/json':
+            data = json.loads(request.body or b'{}')
+            return data if isinstance(data, dict) else {}
+        return QueryDict(request.body, encoding=request.encoding)
+
+
+class ExamUserMappingDetailAsyncView(AsyncAPIView):
+    @staticmethod
+    async def get_exam_user_mapping(hash_exam_user_mapping):
+        exam_user_mapping_ref = await exam_user_mapping_resolver.aresolve(hash_exam_user_mapping)
+        if not exam_user_mapping_ref:
+            return None, JsonResponse({"detail": "Exam user mapping not found."}, status=404)
+        if not exam_user_mapping_ref.activated:
+            return None, JsonResponse({"message": "Exam not started yet."}, status=400)
+        return await ExamUserMapping.objects.aget(id=exam_user_mapping_ref.id), None
+
+    async def get(self, request, hash_exam_user_mapping):
+        exam_user_mapping, error_response = await self.get_exam_user_mapping(hash_exam_user_mapping)
+        if error_response:
+            return error_response
+
+        since = request.GET.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return JsonResponse({
+                    "message": "since must be an integer state version."
+                }, status=400)
+
+        etag = await aget_session_etag(exam_user_mapping, since)
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
+
+        include_answers = bool(exam_user_mapping.completed)
+        if since is not None:
+            content = await sync_to_async(render_session_changes)(exam_user_mapping, since, include_answers)
+        else:
+            content = await sync_to_async(render_exam_user_mapping_detail)(exam_user_mapping, include_answers, request)
+
+        response = HttpResponse(content, content_type='application/json', status=200)
+        response['ETag'] = etag
+        return response
+
+    async def put(self, request, hash_exam_user_mapping):
+        csrf_response = await self.enforce_csrf(request)
+        if csrf_response:
+            return csrf_response
+
+        exam_user_mapping, error_response = await self.get_exam_user_mapping(hash_exam_user_mapping)
+        if error_response:
+            return error_response
+
+        if exam_user_mapping.completed:
+            return JsonResponse(
+                {
+                    "message": "Exam already marked as completed.",
+                    "status": 400
+                },
+                status=400
+            )
+
+        # Writing the session's buffered answers and completing it stay synchronous; Django's async
+        # ORM has no transactions.
+        try:
+            await sync_to_async(complete_exam_user_mapping)(exam_user_mapping)
+        except AnswerBufferLockTimeout as exc:
+            response = JsonResponse({"detail": exc.detail}, status=exc.status_code)
+            response['Retry-After'] = exc.wait
+            return response
+
+        return JsonResponse(
+            {
+                "message": "Exam marked as completed.",
+                "status": 200
+            },
+            status=200
+        )
+
+
+class ExamUserMultipleChoiceQuestionMappingSubmitAsyncView(AsyncAPIView):
+    @staticmethod
+    async def get_is_correct(exam_user_multiple_choice_question_mapping, answer_key):
+        # Questions missing from a stale answer key are graded from the question row, which needs the ORM.
+        if answer_key.get(exam_user_multiple_choice_question_mapping.multiple_choice_question_id) is None:
+            return await sync_to_async(exam_user_multiple_choice_question_mapping.get_is_correct)(answer_key=answer_key)
+        return exam_user_multiple_choice_question_mapping.get_is_correct(answer_key=answer_key)
+
+    async def put(self, request, hash_exam_user_multiple_choice_question_mapping):
+        csrf_response = await self.enforce_csrf(request)
+        if csrf_response:
+            return csrf_response
+
+        if is_answer_slot_hash(hash_exam_user_multiple_choice_question_mapping):
+            exam_user_multiple_choice_question_mapping_ref = await aresolve_answer_slot(
+                hash_exam_user_multiple_choice_question_mapping
+            )
+        else:
+            exam_user_multiple_choice_question_mapping_ref = \
+                await exam_user_multiple_choice_question_mapping_resolver.aresolve(
+                    hash_exam_user_multiple_choice_question_mapping
+                )
+        if exam_user_multiple_choice_question_mapping_ref is None:
+            return JsonResponse({
+                "message": "Exam user multiple choice question mapping not found."
+            }, status=400)
+        exam_user_mapping_ref = await exam_user_mapping_resolver.aresolve(
+            exam_user_multiple_choice_question_mapping_ref.exam_user_mapping_hash
+        )
+        now = timezone.now()
+        if exam_user_mapping_ref is None or not exam_user_mapping_ref.activated or exam_user_mapping_ref.completed or \
+           exam_user_mapping_ref.end_timestamp <= now:
+            return JsonResponse({
+                "message": "Cannot submit answer for a completed or expired exam."
+            }, status=400)
+
+        try:
+            data = self.get_data(request)
+        except ValueError:
+            return JsonResponse({"detail": "JSON parse error."}, status=400)
+        selected_choice = data.get('selected_choice')
+        if not selected_choice:
+            return JsonResponse({
+                "message": "Selected choice is required."
+            }, status=400)
+
+        answer_slot = None
+        if isinstance(exam_user_multiple_choice_question_mapping_ref, AnswerSlotRef):
+            answer_slot = exam_user_multiple_choice_question_mapping_ref.slot
+            selected_choice = parse_slot_choice(selected_choice)
+            if selected_choice is None:
+                return JsonResponse({
+                    "message": "Selected choice is invalid."
+                }, status=400)
+
+        answer_key = await aget_answer_key(exam_user_mapping_ref.exam_id)
+        live_leaderboard = get_async_live_leaderboard()
+        exam_user_multiple_choice_question_mapping = ExamUserMultipleChoiceQuestionMapping(
+            id=exam_user_multiple_choice_question_mapping_ref.id,
+            exam_id=exam_user_mapping_ref.exam_id,
+            exam_user_mapping_id=exam_user_multiple_choice_question_mapping_ref.exam_user_mapping_id,
+            multiple_choice_question_id=exam_user_multiple_choice_question_mapping_ref.multiple_choice_question_id,
+            input_puzzle_answer=exam_user_multiple_choice_question_mapping_ref.input_puzzle_answer,
+            selected_choice=selected_choice,
+        )
+        is_correct = await self.get_is_correct(exam_user_multiple_choice_question_mapping, answer_key)
+
+        answer_buffer = get_async_answer_buffer()
+        if answer_buffer and answer_slot is not None:
+            await abuffer_answer_slot(
+                answer_buffer,
+                exam_user_mapping_ref.exam_id,
+                exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                answer_slot,
+                selected_choice,
+                timezone.now(),
+            )
+        elif answer_buffer:
+            await abuffer_answer(
+                answer_buffer,
+                exam_user_mapping_ref.exam_id,
+                exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                exam_user_multiple_choice_question_mapping.id,
+                selected_choice,
+                timezone.now(),
+            )
+        else:
+            if answer_slot is not None:
+                updated = await sync_to_async(save_answer_slot)(
+                    exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                    answer_slot,
+                    selected_choice,
+                    timezone.now(),
+                )
+            else:
+                updated = await sync_to_async(save_submitted_answer)(
+                    exam_user_mapping_ref.exam_id,
+                    exam_user_multiple_choice_question_mapping.id,
+                    exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                    selected_choice,
+                    is_correct,
+                    timezone.now(),
+                )
+            if not updated:
+                return JsonResponse({
+                    "message": "Cannot submit answer for a completed or expired exam."
+                }, status=400)
+
+        if live_leaderboard:
+            await arecord_live_answer(
+                live_leaderboard,
+                answer_key,
+                exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                exam_user_multiple_choice_question_mapping.multiple_choice_question_id,
+                is_correct,
+            )
+
+        return JsonResponse({
+            "message": "Answer submitted successfully.",
+        }, status=200)
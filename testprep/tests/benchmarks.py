@@ -0,0 +1,211 @@
+import statistics
+import time
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test import Client
+from django.urls import reverse
+from django.utils import timezone
+
+from testprep.utils import QueryStats
+from tests.models import Exam, ExamUserMapping, ExamUserMultipleChoiceQuestionMapping, Topic
+from tests.synthetic import SYNTHETIC_EXAM_FINISHED, SYNTHETIC_EXAM_OPEN, create_synthetic_users, \
+    generate_synthetic_exam
+from tests.tasks import compute_exam_leaderboard
+
+BENCHMARK_CASES = {}
+
+
+def benchmark(name, iterations=None):
+    # `iterations` caps the run for cases that are too heavy to repeat as often as the request paths.
+    def register(case):
+        BENCHMARK_CASES[name] = (case, iterations)
+        return case
+    return register
+
+
+class BenchmarkContext:
+    def __init__(self, users, questions, topics, seed):
+        self.users = users
+        self.questions = questions
+        self.topics = topics
+        self.seed = seed
+        self.open_exam = None
+        self.finished_exam = None
+        self._clients = {}
+
+    def prepare(self):
+        open_exam = generate_synthetic_exam(
+            users=self.users, questions=self.questions, topics=self.topics,
+            state=SYNTHETIC_EXAM_OPEN, answer_rate=0.5, seed=self.seed,
+        )
+        finished_exam = generate_synthetic_exam(
+            users=self.users, questions=self.questions, topics=self.topics,
+            state=SYNTHETIC_EXAM_FINISHED, seed=self.seed,
+        )
+        self.open_exam = Exam.objects.get(id=open_exam['exam_id'])
+        self.finished_exam = Exam.objects.get(id=finished_exam['exam_id'])
+        return {'open_exam': open_exam, 'finished_exam': finished_exam}
+
+    def get_client(self, user_id):
+        client = self._clients.get(user_id)
+        if client is None:
+            client = self._clients[user_id] = Client()
+            client.force_login(User.objects.get(id=user_id))
+        return client
+
+    def get_sessions(self, exam, count, **filters):
+        return list(
+            ExamUserMapping.objects.filter(exam_id=exam.id, **filters).order_by('id').values_list('hash', 'user_id')[:count]
+        )
+
+
+@benchmark('exam_start')
+def exam_start(context, iterations):
+    users = create_synthetic_users(f'benchmark-{context.open_exam.hash[:8]}-{time.time_ns()}', iterations)
+    url = reverse('tests:exam-user-mapping-create', args=[context.open_exam.hash])
+    for user in users:
+        client = context.get_client(user.id)
+        yield lambda: client.post(url)
+
+
+@benchmark('answer_submit')
+def answer_submit(context, iterations):
+    rows = ExamUserMultipleChoiceQuestionMapping.objects.filter(
+        exam_id=context.open_exam.id,
+        exam_user_mapping__completed=False,
+        is_completed=False,
+        multiple_choice_question__correct_choice__isnull=False,
+    ).order_by('id').values_list('hash', 'exam_user_mapping__user_id')[:iterations]
+    for exam_user_multiple_choice_question_mapping_hash, user_id in rows:
+        client = context.get_client(user_id)
+        url = reverse('tests:exam-user-mcq-submit', args=[exam_user_multiple_choice_question_mapping_hash])
+        yield lambda: client.put(url, {'selected_choice': 1}, content_type='application/json')
+
+
+@benchmark('session_detail')
+def session_detail(context, iterations):
+    for exam_user_mapping_hash, user_id in context.get_sessions(context.open_exam, iterations, completed=False):
+        client = context.get_client(user_id)
+        url = reverse('tests:exam-user-mapping-detail', args=[exam_user_mapping_hash])
+        yield lambda: client.get(url)
+
+
+@benchmark('session_complete')
+def session_complete(context, iterations):
+    # Completes sessions from the end of the list so session_detail keeps reading open ones.
+    sessions = list(
+        ExamUserMapping.objects.filter(exam_id=context.open_exam.id, completed=False)
+        .order_by('-id').values_list('hash', 'user_id')[:iterations]
+    )
+    for exam_user_mapping_hash, user_id in sessions:
+        client = context.get_client(user_id)
+        url = reverse('tests:exam-user-mapping-detail', args=[exam_user_mapping_hash])
+        yield lambda: client.put(url)
+
+
+@benchmark('compute_exam_leaderboard', iterations=3)
+def compute_exam_leaderboard_case(context, iterations):
+    for _ in range(iterations):
+        yield lambda: compute_exam_leaderboard(context.finished_exam.id)
+
+
+@benchmark('subject_leaderboard')
+def subject_leaderboard(context, iterations):
+    topic = Topic.objects.filter(exam_topic_mapping__exam=context.finished_exam).order_by('id').first()
+    exam_user_mapping_hash, user_id = context.get_sessions(context.finished_exam, 1)[0]
+    client = context.get_client(user_id)
+    url = reverse('tests:exam-leaderboard', args=[context.finished_exam.hash])
+    for _ in range(iterations):
+        yield lambda: client.get(url, {'subject_hash': topic.hash, 'limit': 100})
+
+
+@benchmark('prediction')
+def prediction(context, iterations):
+    for exam_user_mapping_hash, user_id in context.get_sessions(context.finished_exam, iterations, completed=True):
+        client = context.get_client(user_id)
+        url = reverse('tests:exam-result-predict', args=[exam_user_mapping_hash])
+        yield lambda: client.get(url)
+
+
+def percentile(values, fraction):
+    values = sorted(values)
+    return values[min(int(round(fraction * (len(values) - 1))), len(values) - 1)]
+
+
+def summarize(durations, queries):
+    return {
+        'iterations': len(durations),
+        'first_ms': round(durations[0], 2),
+        'median_ms': round(statistics.median(durations), 2),
+        'p95_ms': round(percentile(durations, 0.95), 2),
+        'max_ms': round(max(durations), 2),
+        'median_queries': statistics.median(queries),
+        'max_queries': max(queries),
+    }
+
+
+def run_benchmark_case(context, name, iterations):
+    case, max_iterations = BENCHMARK_CASES[name]
+    if max_iterations is not None:
+        iterations = min(iterations, max_iterations)
+
+    durations = []
+    queries = []
+    for operation in case(context, iterations):
+        with QueryStats() as query_stats:
+            result = operation()
+        status_code = getattr(result, 'status_code', 200)
+        if status_code >= 400:
+            raise RuntimeError(f'Benchmark {name} got HTTP {status_code}: {result.content[:200]!r}')
+        durations.append(query_stats.duration * 1000)
+        queries.append(query_stats.queries)
+
+    if not durations:
+        raise RuntimeError(f'Benchmark {name} had nothing to run; increase --users')
+    return summarize(durations, queries)
+
+
+def run_benchmarks(users, questions, topics, iterations, seed=None, names=None):
+    context = BenchmarkContext(users, questions, topics, seed)
+    datasets = context.prepare()
+    results = {}
+    for name in names or BENCHMARK_CASES:
+        results[name] = run_benchmark_case(context, name, iterations)
+    return {
+        'meta': {
+            'created_at': timezone.now().isoformat(),
+            'database': connection.vendor,
+            'users': users,
+            'questions': questions,
+            'topics': topics,
+            'iterations': iterations,
+            'seed': seed,
+            'datasets': datasets,
+        },
+        'results': results,
+    }
+
+
+def compare_to_baseline(results, baseline, tolerance):
+    # A case regresses when its median time grows by more than `tolerance` or it issues more queries.
+    regressions = []
+    for name, result in results['results'].items():
+        baseline_result = baseline.get('results', {}).get(name)
+        if baseline_result is None:
+            continue
+        if result['median_ms'] > baseline_result['median_ms'] * (1 + tolerance):
+            regressions.append({
+                'case': name,
+                'metric': 'median_ms',
+                'baseline': baseline_result['median_ms'],
+                'current': result['median_ms'],
+            })
+        if result['median_queries'] > baseline_result['median_queries']:
+            regressions.append({
+                'case': name,
+                'metric': 'median_queries',
+                'baseline': baseline_result['median_queries'],
+                'current': result['median_queries'],
+            })
+    return regressions
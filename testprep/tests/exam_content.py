@@ -0,0 +1,24 @@
+from testprep.utils import get_async_redis_client, get_redis_client
+
+
+def _get_version_key(exam_id):
+    return f'exam_content_version:{exam_id}'
+
+
+def get_exam_content_version(exam_id):
+    return int(get_redis_client().get(_get_version_key(exam_id)) or 0)
+
+
+async def aget_exam_content_version(exam_id):
+    return int(await get_async_redis_client().get(_get_version_key(exam_id)) or 0)
+
+
+def invalidate_exam_content(exam_ids):
+    exam_ids = set(exam_ids)
+    if not exam_ids:
+        return
+
+    pipeline = get_redis_client().pipeline()
+    for exam_id in exam_ids:
+        pipeline.incr(_get_version_key(exam_id))
+    pipeline.execute()
@@ -0,0 +1,268 @@
+import csv
+import json
+import zlib
+from itertools import groupby
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.db import transaction
+
+from tests.answer_keys import get_answer_key
+from tests.models import (
+    ExamMultipleChoiceQuestionMapping,
+    ExamTopicRanking,
+    ExamUserMapping,
+    ExamUserMultipleChoiceQuestionMapping,
+    MultipleChoiceQuestion,
+    Topic,
+)
+
+EXPORT_KIND_OVERALL = 'overall'
+EXPORT_KIND_SUBJECTS = 'subjects'
+EXPORT_KIND_ANSWERS = 'answers'
+EXPORT_KINDS = (EXPORT_KIND_OVERALL, EXPORT_KIND_SUBJECTS, EXPORT_KIND_ANSWERS)
+
+EXPORT_FORMAT_CSV = 'csv'
+EXPORT_FORMAT_NDJSON = 'ndjson'
+EXPORT_FORMATS = (EXPORT_FORMAT_CSV, EXPORT_FORMAT_NDJSON)
+
+EXPORT_CONTENT_TYPES = {
+    EXPORT_FORMAT_CSV: 'text/csv; charset=utf-8',
+    EXPORT_FORMAT_NDJSON: 'application/x-ndjson',
+}
+
+CHOICE_LABELS = dict(MultipleChoiceQuestion.ANSWER_CHOICES)
+
+
+def _format_percentile(percentile):
+    return None if percentile is None else float(percentile)
+
+
+def _format_timestamp(timestamp):
+    return None if timestamp is None else timestamp.isoformat()
+
+
+class OverallResultsExport:
+    # One row per ranked session in overall rank order, with every exam subject's score and percentile.
+
+    def __init__(self, exam_id, chunk_size):
+        self.exam_id = exam_id
+        self.chunk_size = chunk_size
+        self.subjects = list(
+            Topic.objects.filter(exam_topic_mapping__exam_id=exam_id).order_by('title').values_list('title', flat=True)
+        )
+
+    def get_header(self):
+        return (
+            ['overall_rank', 'overall_percentile', 'hash', 'username', 'total_score', 'completed_at']
+            + [f'{subject} score' for subject in self.subjects]
+            + [f'{subject} percentile' for subject in self.subjects]
+        )
+
+    def iter_records(self):
+        rows = ExamUserMapping.objects.filter(
+            exam_id=self.exam_id, overall_rank__isnull=False
+        ).order_by('overall_rank', 'id').values_list(
+            'overall_rank', 'overall_percentile', 'hash', 'user__username', 'total_score', 'completed_at',
+            'subject_scores', 'subject_percentiles',
+        ).iterator(chunk_size=self.chunk_size)
+        for (overall_rank, overall_percentile, exam_user_mapping_hash, username, total_score, completed_at,
+             subject_scores, subject_percentiles) in rows:
+            yield {
+                'overall_rank': overall_rank,
+                'overall_percentile': _format_percentile(overall_percentile),
+                'hash': exam_user_mapping_hash,
+                'username': username,
+                'total_score': total_score,
+                'completed_at': _format_timestamp(completed_at),
+                'subject_scores': subject_scores or {},
+                'subject_percentiles': subject_percentiles or {},
+            }
+
+    def to_csv_row(self, record):
+        return (
+            [record['overall_rank'], record['overall_percentile'], record['hash'], record['username'],
+             record['total_score'], record['completed_at']]
+            + [record['subject_scores'].get(subject) for subject in self.subjects]
+            + [record['subject_percentiles'].get(subject) for subject in self.subjects]
+        )
+
+
+class SubjectResultsExport:
+    # Subject standings from ExamTopicRanking, subject by subject in rank order, or a single subject.
+
+    def __init__(self, exam_id, chunk_size, topic_id=None):
+        self.exam_id = exam_id
+        self.chunk_size = chunk_size
+        self.topic_id = topic_id
+
+    @staticmethod
+    def get_header():
+        return ['subject', 'rank', 'percentile', 'hash', 'username', 'score']
+
+    def iter_records(self):
+        exam_topic_rankings = ExamTopicRanking.objects.filter(exam_id=self.exam_id)
+        if self.topic_id is not None:
+            exam_topic_rankings = exam_topic_rankings.filter(topic_id=self.topic_id)
+        # Ordered along the (exam, topic, rank, exam_user_mapping) index rather than by title.
+        rows = exam_topic_rankings.order_by('topic_id', 'rank', 'exam_user_mapping_id').values_list(
+            'topic__title', 'rank', 'percentile', 'exam_user_mapping__hash', 'exam_user_mapping__user__username',
+            'score',
+        ).iterator(chunk_size=self.chunk_size)
+        for subject, rank, percentile, exam_user_mapping_hash, username, score in rows:
+            yield {
+                'subject': subject,
+                'rank': rank,
+                'percentile': _format_percentile(percentile),
+                'hash': exam_user_mapping_hash,
+                'username': username,
+                'score': score,
+            }
+
+    @staticmethod
+    def to_csv_row(record):
+        return [record['subject'], record['rank'], record['percentile'], record['hash'], record['username'],
+                record['score']]
+
+
+class AnswerMatrixExport:
+    # One row per session with its answer to every exam question: the choice letter, the puzzle
+    # answer, or empty when unanswered. Answer rows arrive ordered by session and are folded one
+    # session at a time; sessions with packed answer sheets follow, decoded slot by slot.
+
+    def __init__(self, exam_id, chunk_size):
+        self.exam_id = exam_id
+        self.chunk_size = chunk_size
+        self.questions = [
+            (question_id, question_hash or str(question_id))
+            for question_id, question_hash in ExamMultipleChoiceQuestionMapping.objects.filter(
+                exam_id=exam_id
+            ).order_by('id').values_list('multiple_choice_question_id', 'multiple_choice_question__hash')
+        ]
+
+    def get_header(self):
+        return ['hash', 'username'] + [question_hash for _, question_hash in self.questions]
+
+    def iter_records(self):
+        rows = ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam_id=self.exam_id, exam_user_mapping__activated=True
+        ).order_by('exam_user_mapping_id').values_list(
+            'exam_user_mapping_id', 'exam_user_mapping__hash', 'exam_user_mapping__user__username',
+            'multiple_choice_question_id', 'selected_choice', 'input_puzzle_answer',
+        ).iterator(chunk_size=self.chunk_size)
+        for (_, exam_user_mapping_hash, username), answers in groupby(rows, key=lambda row: row[:3]):
+            answers_by_question = {
+                question_id: CHOICE_LABELS.get(selected_choice) or input_puzzle_answer or None
+                for _, _, _, question_id, selected_choice, input_puzzle_answer in answers
+            }
+            yield {
+                'hash': exam_user_mapping_hash,
+                'username': username,
+                'answers': {
+                    question_hash: answers_by_question.get(question_id)
+                    for question_id, question_hash in self.questions
+                },
+            }
+
+        packed_rows = ExamUserMapping.objects.filter(
+            exam_id=self.exam_id, activated=True, answer_sheet__isnull=False
+        ).order_by('id').values_list(
+            'hash', 'user__username', 'answer_sheet', 'answer_attempts'
+        ).iterator(chunk_size=self.chunk_size)
+        answer_sheet_grader = get_answer_key(self.exam_id).answer_sheet_grader
+        for exam_user_mapping_hash, username, answer_sheet, answer_attempts in packed_rows:
+            answers_by_slot = answer_sheet_grader.get_slots(answer_sheet, answer_attempts)
+            yield {
+                'hash': exam_user_mapping_hash,
+                'username': username,
+                'answers': {
+                    question_hash: CHOICE_LABELS.get(answers_by_slot[slot][0]) if slot < len(answers_by_slot) else None
+                    for slot, (_, question_hash) in enumerate(self.questions)
+                },
+            }
+
+    def to_csv_row(self, record):
+        return [record['hash'], record['username']] + [
+            record['answers'][question_hash] for _, question_hash in self.questions
+        ]
+
+
+def get_results_export(exam_id, kind, topic_id=None, chunk_size=None):
+    chunk_size = chunk_size or settings.EXPORT_CHUNK_SIZE
+    if kind == EXPORT_KIND_OVERALL:
+        return OverallResultsExport(exam_id, chunk_size)
+    if kind == EXPORT_KIND_SUBJECTS:
+        return SubjectResultsExport(exam_id, chunk_size, topic_id=topic_id)
+    if kind == EXPORT_KIND_ANSWERS:
+        return AnswerMatrixExport(exam_id, chunk_size)
+    raise ValueError(f'Unknown export kind: {kind}')
+
+
+class _Echo:
+    # csv.writer target that hands each formatted line back instead of buffering it.
+
+    @staticmethod
+    def write(value):
+        return value
+
+
+def _iter_lines(export, export_format):
+    if export_format == EXPORT_FORMAT_CSV:
+        writer = csv.writer(_Echo())
+        yield writer.writerow(export.get_header())
+        for record in export.iter_records():
+            yield writer.writerow(export.to_csv_row(record))
+    elif export_format == EXPORT_FORMAT_NDJSON:
+        for record in export.iter_records():
+            yield json.dumps(record, separators=(',', ':')) + '\n'
+    else:
+        raise ValueError(f'Unknown export format: {export_format}')
+
+
+def stream_results_export(export, export_format, compress=False):
+    # Yields the export as byte chunks of about export.chunk_size lines, gzipped when asked.
+    # The rows are read inside a transaction so that Postgres serves iterator() from a plain
+    # server-side cursor; outside one, Django declares it WITH HOLD and Postgres materialises
+    # the whole result on commit before the first row is sent.
+    compressor = zlib.compressobj(wbits=zlib.MAX_WBITS | 16) if compress else None
+    with transaction.atomic():
+        lines = []
+        for line in _iter_lines(export, export_format):
+            lines.append(line)
+            if len(lines) >= export.chunk_size:
+                chunk = ''.join(lines).encode()
+                lines = []
+                if compressor is not None:
+                    chunk = compressor.compress(chunk)
+                if chunk:
+                    yield chunk
+    chunk = ''.join(lines).encode()
+    if compressor is not None:
+        chunk = compressor.compress(chunk) + compressor.flush()
+    if chunk:
+        yield chunk
+
+
+def get_export_filename(hash_exam, kind, export_format, compress=False):
+    return f'{hash_exam}-{kind}.{export_format}' + ('.gz' if compress else '')
+
+
+class AsyncChunkIterator:
+    # Lets ASGI servers pull a synchronous export one chunk at a time. Given a plain generator,
+    # StreamingHttpResponse would read all of it into a list before sending anything. Chunks are
+    # produced on the thread-sensitive executor, where the request's database connection lives.
+
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        chunk = await sync_to_async(next)(self.chunks, None)
+        if chunk is None:
+            raise StopAsyncIteration
+        return chunk
+
+    def close(self):
+        self.chunks.close()
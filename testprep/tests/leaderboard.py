@@ -0,0 +1,233 @@
+from collections import Counter
+
+import numpy as np
+
+from tests.answer_keys import get_answer_key
+from tests.models import ExamTopicRanking, ExamUserMapping, Topic
+
+LEADERBOARD_CHUNK_SIZE = 5000
+
+RANK_METHOD_ORDINAL = 'ordinal'
+RANK_METHOD_COMPETITION = 'competition'
+RANK_METHOD_DENSE = 'dense'
+
+OVERALL_RANK_METHOD = RANK_METHOD_ORDINAL
+SUBJECT_RANK_METHOD = RANK_METHOD_COMPETITION
+
+MISSING_TIMESTAMP = np.iinfo(np.int64).max
+
+
+def compute_ranks(scores, tiebreakers=(), method=RANK_METHOD_COMPETITION):
+    # Higher scores rank first. Tiebreakers (ascending) only matter for the ordinal
+    # method, where every row needs a distinct rank; the last one should be unique.
+    scores = np.asarray(scores, dtype=np.float64)
+    count = len(scores)
+    if not count:
+        return np.empty(0, dtype=np.int64)
+
+    if method == RANK_METHOD_ORDINAL:
+        order = np.lexsort(tuple(reversed(tiebreakers)) + (-scores,))
+        ranks = np.empty(count, dtype=np.int64)
+        ranks[order] = np.arange(1, count + 1)
+        return ranks
+
+    if method == RANK_METHOD_COMPETITION:
+        ascending = np.sort(-scores)
+    elif method == RANK_METHOD_DENSE:
+        ascending = np.unique(-scores)
+    else:
+        raise ValueError(f'Unknown rank method: {method}')
+    return np.searchsorted(ascending, -scores, side='left').astype(np.int64) + 1
+
+
+def compute_percentiles(ranks, total=None):
+    ranks = np.asarray(ranks, dtype=np.float64)
+    total = len(ranks) if total is None else total
+    if not total:
+        return np.empty(0, dtype=np.float64)
+    return np.round(100 * (1 - ((ranks - 1) / total)), 2)
+
+
+class ExamScoreArrays:
+    def __init__(self, size):
+        self.size = 0
+        self.ids = np.empty(size, dtype=np.int64)
+        self.total_scores = np.empty(size, dtype=np.float64)
+        self.completed_at = np.empty(size, dtype=np.int64)
+        self.subject_scores = {}
+
+    def append(self, exam_user_mapping_id, total_score, completed_at, subject_scores):
+        position = self.size
+        self.ids[position] = exam_user_mapping_id
+        self.total_scores[position] = total_score
+        self.completed_at[position] = (
+            int(completed_at.timestamp() * 1_000_000) if completed_at else MISSING_TIMESTAMP
+        )
+        for subject, score in (subject_scores or {}).items():
+            if score is None:
+                continue
+            if subject not in self.subject_scores:
+                self.subject_scores[subject] = np.full(len(self.ids), np.nan, dtype=np.float64)
+            self.subject_scores[subject][position] = score
+        self.size += 1
+
+    def trim(self):
+        self.ids = self.ids[:self.size]
+        self.total_scores = self.total_scores[:self.size]
+        self.completed_at = self.completed_at[:self.size]
+        for subject in self.subject_scores:
+            self.subject_scores[subject] = self.subject_scores[subject][:self.size]
+        return self
+
+
+def load_exam_scores(exam_id, chunk_size=LEADERBOARD_CHUNK_SIZE):
+    queryset = ExamUserMapping.objects.filter(exam_id=exam_id, total_score__isnull=False)
+    arrays = ExamScoreArrays(queryset.count())
+
+    rows = queryset.order_by('id').values_list(
+        'id', 'total_score', 'completed_at', 'subject_scores'
+    ).iterator(chunk_size=chunk_size)
+    for exam_user_mapping_id, total_score, completed_at, subject_scores in rows:
+        if arrays.size == len(arrays.ids):
+            break
+        arrays.append(exam_user_mapping_id, total_score, completed_at, subject_scores)
+
+    return arrays.trim()
+
+
+def rank_exam_scores(arrays, overall_method=OVERALL_RANK_METHOD, subject_method=SUBJECT_RANK_METHOD):
+    overall_ranks = compute_ranks(
+        arrays.total_scores,
+        tiebreakers=(arrays.completed_at, arrays.ids),
+        method=overall_method,
+    )
+    overall_percentiles = compute_percentiles(overall_ranks)
+
+    subject_ranks = {}
+    subject_percentiles = {}
+    for subject, scores in arrays.subject_scores.items():
+        present = ~np.isnan(scores)
+        ranks = compute_ranks(
+            scores[present],
+            tiebreakers=(arrays.completed_at[present], arrays.ids[present]),
+            method=subject_method,
+        )
+        subject_ranks[subject] = np.full(len(scores), np.nan, dtype=np.float64)
+        subject_ranks[subject][present] = ranks
+        percentiles = np.full(len(scores), np.nan, dtype=np.float64)
+        percentiles[present] = compute_percentiles(ranks)
+        subject_percentiles[subject] = percentiles
+
+    return overall_ranks, overall_percentiles, subject_ranks, subject_percentiles
+
+
+def write_exam_ranks(arrays, overall_ranks, overall_percentiles, subject_percentiles,
+                     chunk_size=LEADERBOARD_CHUNK_SIZE):
+    subjects = list(subject_percentiles.items())
+
+    for start in range(0, arrays.size, chunk_size):
+        stop = min(start + chunk_size, arrays.size)
+        exam_user_mappings = []
+        for position in range(start, stop):
+            percentiles = {}
+            for subject, values in subjects:
+                value = values[position]
+                if not np.isnan(value):
+                    percentiles[subject] = float(value)
+
+            exam_user_mappings.append(ExamUserMapping(
+                id=int(arrays.ids[position]),
+                overall_rank=int(overall_ranks[position]),
+                overall_percentile=float(overall_percentiles[position]),
+                subject_percentiles=percentiles,
+            ))
+
+        ExamUserMapping.objects.bulk_update(
+            exam_user_mappings,
+            ['overall_rank', 'overall_percentile', 'subject_percentiles'],
+            batch_size=chunk_size,
+        )
+
+
+def get_topic_ids_by_title(exam_id, subjects):
+    topic_ids_by_title = {title: topic_id for topic_id, title in get_answer_key(exam_id).topic_titles.items()}
+    missing_subjects = [subject for subject in subjects if subject not in topic_ids_by_title]
+    if missing_subjects:
+        topic_ids_by_title.update(Topic.objects.filter(title__in=missing_subjects).values_list('title', 'id'))
+    return topic_ids_by_title
+
+
+def write_topic_rankings(exam_id, arrays, subject_ranks, subject_percentiles, chunk_size=LEADERBOARD_CHUNK_SIZE):
+    # Subject standings are rebuilt from scratch on every run so that the (exam, topic, rank) index
+    # serves subject leaderboards directly.
+    ExamTopicRanking.objects.filter(exam_id=exam_id).delete()
+    topic_ids_by_title = get_topic_ids_by_title(exam_id, subject_ranks.keys())
+
+    exam_topic_rankings = []
+    for subject, ranks in subject_ranks.items():
+        topic_id = topic_ids_by_title.get(subject)
+        if topic_id is None:
+            continue
+        scores = arrays.subject_scores[subject]
+        percentiles = subject_percentiles[subject]
+        for position in np.flatnonzero(~np.isnan(ranks)):
+            exam_topic_rankings.append(ExamTopicRanking(
+                exam_id=exam_id,
+                topic_id=topic_id,
+                exam_user_mapping_id=int(arrays.ids[position]),
+                score=int(scores[position]),
+                rank=int(ranks[position]),
+                percentile=float(percentiles[position]),
+            ))
+            if len(exam_topic_rankings) >= chunk_size:
+                ExamTopicRanking.objects.bulk_create(exam_topic_rankings, batch_size=chunk_size)
+                exam_topic_rankings = []
+
+    if exam_topic_rankings:
+        ExamTopicRanking.objects.bulk_create(exam_topic_rankings, batch_size=chunk_size)
+
+
+def merge_score_histograms(histograms):
+    # Histograms are [score, count] pairs, which survive a round trip through Celery's JSON.
+    merged = Counter()
+    for histogram in histograms:
+        for score, count in histogram:
+            merged[score] += count
+    return merged
+
+
+def build_rank_table(histogram):
+    # For each score, how many sessions scored higher: its competition rank minus one.
+    above = []
+    higher = 0
+    for score in sorted(histogram, reverse=True):
+        above.append([score, higher])
+        higher += histogram[score]
+    return {'total': higher, 'above': above}
+
+
+def split_score_bands(histogram, band_size):
+    # Splits the score range into (highest, lowest) bands of roughly band_size sessions. A score is
+    # never split across bands, so each band can assign ordinal ranks to its ties on its own.
+    bands = []
+    band_high = None
+    band_sessions = 0
+    for score in sorted(histogram, reverse=True):
+        if band_high is None:
+            band_high = score
+        band_sessions += histogram[score]
+        if band_sessions >= band_size:
+            bands.append((band_high, score))
+            band_high = None
+            band_sessions = 0
+    if band_high is not None:
+        bands.append((band_high, min(histogram)))
+    return bands
+
+
+def rank_exam(exam_id, chunk_size=LEADERBOARD_CHUNK_SIZE):
+    arrays = load_exam_scores(exam_id, chunk_size=chunk_size)
+    overall_ranks, overall_percentiles, subject_ranks, subject_percentiles = rank_exam_scores(arrays)
+    write_exam_ranks(arrays, overall_ranks, overall_percentiles, subject_percentiles, chunk_size=chunk_size)
+    write_topic_rankings(exam_id, arrays, subject_ranks, subject_percentiles, chunk_size=chunk_size)
+    return arrays.size
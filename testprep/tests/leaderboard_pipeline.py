@@ -0,0 +1,221 @@
+import logging
+import time
+from collections import Counter, defaultdict
+from itertools import islice
+
+from django.db.models import F
+from redis.exceptions import LockError
+
+from testprep.utils import get_redis_client
+from tests.leaderboard import LEADERBOARD_CHUNK_SIZE, compute_percentiles, get_topic_ids_by_title
+from tests.models import ExamTopicRanking, ExamUserMapping
+from tests.profiles import PROFILE_BATCH_SIZE
+from tests.session_state import bump_exam_state_versions
+from tests.signals import exam_user_mappings_completed
+
+logger = logging.getLogger(__name__)
+
+LEADERBOARD_LOCK_TIMEOUT = 60 * 60
+LEADERBOARD_PROGRESS_TTL = 24 * 60 * 60
+
+LEADERBOARD_STATE_SCORING = 'scoring'
+LEADERBOARD_STATE_WRITING = 'writing'
+LEADERBOARD_STATE_FINALIZING = 'finalizing'
+LEADERBOARD_STATE_DONE = 'done'
+LEADERBOARD_STATE_FAILED = 'failed'
+
+
+def get_leaderboard_lock(exam_id):
+    return get_redis_client().lock(
+        f'compute_exam_leaderboard:{exam_id}', blocking_timeout=0, timeout=LEADERBOARD_LOCK_TIMEOUT
+    )
+
+
+def release_leaderboard_lock(exam_id, token):
+    # The distributed pipeline finishes on another worker, which releases with the coordinator's token.
+    try:
+        get_leaderboard_lock(exam_id).do_release(token)
+    except LockError:
+        logger.warning('Leaderboard lock for exam %s expired before the computation finished.', exam_id)
+
+
+def _get_progress_key(exam_id):
+    return f'leaderboard_progress:{exam_id}'
+
+
+def start_leaderboard_progress(exam_id, partitions):
+    now = time.time()
+    pipeline = get_redis_client().pipeline()
+    pipeline.delete(_get_progress_key(exam_id))
+    pipeline.hset(_get_progress_key(exam_id), mapping={
+        'state': LEADERBOARD_STATE_SCORING,
+        'partitions': partitions,
+        'partitions_scored': 0,
+        'bands': 0,
+        'bands_written': 0,
+        'started_at': now,
+        'updated_at': now,
+    })
+    pipeline.expire(_get_progress_key(exam_id), LEADERBOARD_PROGRESS_TTL)
+    pipeline.execute()
+
+
+def update_leaderboard_progress(exam_id, **fields):
+    get_redis_client().hset(_get_progress_key(exam_id), mapping={**fields, 'updated_at': time.time()})
+
+
+def increment_leaderboard_progress(exam_id, field):
+    pipeline = get_redis_client().pipeline()
+    pipeline.hincrby(_get_progress_key(exam_id), field, 1)
+    pipeline.hset(_get_progress_key(exam_id), 'updated_at', time.time())
+    pipeline.execute()
+
+
+def get_leaderboard_progress(exam_id):
+    progress = get_redis_client().hgetall(_get_progress_key(exam_id))
+    return {key.decode(): value.decode() for key, value in progress.items()}
+
+
+def force_complete_exam_user_mappings(exam):
+    # Pre-provisioned sessions that were never started are no-shows and stay out of the results.
+    incomplete_exam_user_mappings = dict(
+        ExamUserMapping.objects.filter(exam_id=exam.id, completed=False, activated=True).values_list('id', 'hash')
+    )
+    ExamUserMapping.objects.filter(exam_id=exam.id, completed=False, activated=True).update(
+        completed=True,
+        completed_at=exam.end_timestamp,
+    )
+    exam_user_mappings_completed.send(
+        sender=ExamUserMapping, exam_id=exam.id, exam_user_mappings=incomplete_exam_user_mappings,
+    )
+    return set(incomplete_exam_user_mappings)
+
+
+def get_partition_ranges(exam_id, partition_size):
+    # Inclusive id ranges holding partition_size sessions each; an exam's ids are rarely contiguous.
+    ranges = []
+    first_id = None
+    last_id = None
+    sessions = 0
+    exam_user_mapping_ids = ExamUserMapping.objects.filter(exam_id=exam_id).order_by('id').values_list(
+        'id', flat=True
+    ).iterator(chunk_size=LEADERBOARD_CHUNK_SIZE)
+    for exam_user_mapping_id in exam_user_mapping_ids:
+        if first_id is None:
+            first_id = exam_user_mapping_id
+        last_id = exam_user_mapping_id
+        sessions += 1
+        if sessions == partition_size:
+            ranges.append((first_id, last_id))
+            first_id = None
+            sessions = 0
+    if first_id is not None:
+        ranges.append((first_id, last_id))
+    return ranges
+
+
+def build_partition_histograms(exam_id, first_id, last_id, chunk_size=LEADERBOARD_CHUNK_SIZE):
+    total_scores = Counter()
+    subject_scores = defaultdict(Counter)
+    rows = ExamUserMapping.objects.filter(
+        exam_id=exam_id, id__range=(first_id, last_id), total_score__isnull=False
+    ).values_list('total_score', 'subject_scores').iterator(chunk_size=chunk_size)
+    for total_score, scores in rows:
+        total_scores[total_score] += 1
+        for subject, score in (scores or {}).items():
+            if score is not None:
+                subject_scores[subject][score] += 1
+    return {
+        'total_scores': sorted(total_scores.items()),
+        'subject_scores': {subject: sorted(histogram.items()) for subject, histogram in subject_scores.items()},
+    }
+
+
+def _load_rank_table(rank_table):
+    return {score: above for score, above in rank_table['above']}, rank_table['total']
+
+
+def write_score_band(exam_id, highest_score, lowest_score, overall_rank_table, subject_rank_tables,
+                     chunk_size=LEADERBOARD_CHUNK_SIZE):
+    # Overall ranks are ordinal, ties ordered by completion time and then id as in rank_exam_scores,
+    # so a band walks its sessions in that order and offsets each tie by the sessions above its score.
+    overall_above, overall_total = _load_rank_table(overall_rank_table)
+    subject_tables = {subject: _load_rank_table(table) for subject, table in subject_rank_tables.items()}
+    topic_ids_by_title = get_topic_ids_by_title(exam_id, subject_tables.keys())
+
+    rows = ExamUserMapping.objects.filter(
+        exam_id=exam_id, total_score__lte=highest_score, total_score__gte=lowest_score
+    ).order_by('-total_score', F('completed_at').asc(nulls_last=True), 'id').values_list(
+        'id', 'total_score', 'subject_scores'
+    ).iterator(chunk_size=chunk_size)
+
+    previous_score = None
+    position = 0
+    written = 0
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return written
+
+        overall_ranks = []
+        subject_entries = defaultdict(list)
+        for index, (_, total_score, subject_scores) in enumerate(chunk):
+            if total_score != previous_score:
+                previous_score = total_score
+                position = 0
+            position += 1
+            overall_ranks.append(overall_above[total_score] + position)
+            for subject, score in (subject_scores or {}).items():
+                if score is not None and subject in subject_tables:
+                    subject_entries[subject].append((index, score, subject_tables[subject][0][score] + 1))
+        overall_percentiles = compute_percentiles(overall_ranks, overall_total)
+
+        subject_percentiles = [{} for _ in chunk]
+        exam_topic_rankings = []
+        for subject, entries in subject_entries.items():
+            topic_id = topic_ids_by_title.get(subject)
+            percentiles = compute_percentiles([rank for _, _, rank in entries], subject_tables[subject][1])
+            for (index, score, rank), percentile in zip(entries, percentiles):
+                subject_percentiles[index][subject] = float(percentile)
+                if topic_id is not None:
+                    exam_topic_rankings.append(ExamTopicRanking(
+                        exam_id=exam_id,
+                        topic_id=topic_id,
+                        exam_user_mapping_id=chunk[index][0],
+                        score=int(score),
+                        rank=int(rank),
+                        percentile=float(percentile),
+                    ))
+
+        ExamUserMapping.objects.bulk_update(
+            [
+                ExamUserMapping(
+                    id=exam_user_mapping_id,
+                    overall_rank=int(overall_rank),
+                    overall_percentile=float(overall_percentile),
+                    subject_percentiles=percentiles,
+                )
+                for (exam_user_mapping_id, _, _), overall_rank, overall_percentile, percentiles in zip(
+                    chunk, overall_ranks, overall_percentiles, subject_percentiles
+                )
+            ],
+            ['overall_rank', 'overall_percentile', 'subject_percentiles'],
+            batch_size=chunk_size,
+        )
+        ExamTopicRanking.objects.bulk_create(exam_topic_rankings, batch_size=chunk_size)
+        written += len(chunk)
+
+
+def complete_exam_leaderboard(exam, performance_profile_accumulator):
+    bump_exam_state_versions(exam.id)
+
+    if not exam.completed:
+        overall_percentiles = ExamUserMapping.objects.filter(
+            exam_id=exam.id, overall_percentile__isnull=False
+        ).values_list('user_id', 'overall_percentile').iterator(chunk_size=PROFILE_BATCH_SIZE)
+        for user_id, overall_percentile in overall_percentiles:
+            performance_profile_accumulator.add_percentile(user_id, exam.exam_type, overall_percentile)
+    performance_profile_accumulator.apply()
+
+    exam.completed = True
+    exam.save(update_fields=["completed",])
@@ -0,0 +1,346 @@
+import logging
+import threading
+from collections import defaultdict
+
+from django.conf import settings
+from django.db import transaction
+
+from testprep.utils import get_async_redis_client, get_redis_client
+from tests.models import ExamUserMapping
+
+logger = logging.getLogger(__name__)
+
+LIVE_LEADERBOARD_BACKEND_REDIS = 'redis'
+LIVE_LEADERBOARD_BACKEND_LOCAL = 'local'
+
+LIVE_LEADERBOARD_CHUNK_SIZE = 5000
+
+# Replaces the points a session holds for one question and moves its exam and topic scores by the
+# difference, so a changed answer never counts twice. Once a session's final scores are set, its
+# answers hash only holds the finalized marker and late answers leave the boards alone.
+RECORD_ANSWER_SCRIPT = """
+if redis.call('HEXISTS', KEYS[1], 'finalized') == 1 then
+    return '0'
+end
+local previous = tonumber(redis.call('HGET', KEYS[1], ARGV[1]) or '0')
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[2])
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+local delta = tonumber(ARGV[2]) - previous
+redis.call('ZINCRBY', KEYS[2], delta, ARGV[3])
+if KEYS[3] then
+    redis.call('ZINCRBY', KEYS[3], delta, ARGV[3])
+end
+return tostring(delta)
+"""
+
+# Score, rank and board size from one snapshot of the board.
+POSITION_SCRIPT = """
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+    return nil
+end
+return {score, redis.call('ZCOUNT', KEYS[1], '(' .. score, '+inf'), redis.call('ZCARD', KEYS[1])}
+"""
+
+
+def build_position(score, rank, total):
+    return {
+        'score': score,
+        'rank': rank,
+        'percentile': round(100 * (1 - ((rank - 1) / total)), 2),
+        'total': total,
+    }
+
+
+def rank_top_entries(entries):
+    # Entries arrive in descending score order from the top of the board, so the competition
+    # rank of each one is its position unless it ties with the entry before it.
+    ranked = []
+    previous_score = None
+    rank = 0
+    for position, (exam_user_mapping_id, score) in enumerate(entries, start=1):
+        if score != previous_score:
+            rank = position
+            previous_score = score
+        ranked.append((exam_user_mapping_id, score, rank))
+    return ranked
+
+
+class RedisLiveLeaderboard:
+    def __init__(self, client):
+        self.client = client
+        self._record_answer = client.register_script(RECORD_ANSWER_SCRIPT)
+        self._position = client.register_script(POSITION_SCRIPT)
+
+    @staticmethod
+    def get_board_key(exam_id, topic_id=None):
+        if topic_id is None:
+            return f'live_leaderboard:{exam_id}'
+        return f'live_leaderboard:{exam_id}:topic:{topic_id}'
+
+    @staticmethod
+    def get_answers_key(exam_id, exam_user_mapping_id):
+        return f'live_leaderboard:{exam_id}:answers:{exam_user_mapping_id}'
+
+    def register(self, exam_id, exam_user_mapping_id, topic_ids=()):
+        pipeline = self.client.pipeline()
+        pipeline.zadd(self.get_board_key(exam_id), {exam_user_mapping_id: 0}, nx=True)
+        for topic_id in topic_ids:
+            pipeline.zadd(self.get_board_key(exam_id, topic_id), {exam_user_mapping_id: 0}, nx=True)
+        pipeline.execute()
+
+    def record_answer(self, exam_id, exam_user_mapping_id, multiple_choice_question_id, topic_id, points):
+        keys = [self.get_answers_key(exam_id, exam_user_mapping_id), self.get_board_key(exam_id)]
+        if topic_id is not None:
+            keys.append(self.get_board_key(exam_id, topic_id))
+        return float(self._record_answer(
+            keys=keys,
+            args=[multiple_choice_question_id, points, exam_user_mapping_id, settings.LIVE_LEADERBOARD_RETENTION],
+        ))
+
+    def set_scores(self, exam_id, exam_user_mapping_id, total_score, topic_scores):
+        pipeline = self.client.pipeline()
+        self._set_scores(pipeline, exam_id, exam_user_mapping_id, total_score, topic_scores)
+        pipeline.execute()
+
+    def _set_scores(self, pipeline, exam_id, exam_user_mapping_id, total_score, topic_scores):
+        pipeline.zadd(self.get_board_key(exam_id), {exam_user_mapping_id: total_score})
+        for topic_id, score in topic_scores.items():
+            pipeline.zadd(self.get_board_key(exam_id, topic_id), {exam_user_mapping_id: score})
+        answers_key = self.get_answers_key(exam_id, exam_user_mapping_id)
+        pipeline.delete(answers_key)
+        pipeline.hset(answers_key, 'finalized', 1)
+        pipeline.expire(answers_key, settings.LIVE_LEADERBOARD_RETENTION)
+
+    def position(self, exam_id, exam_user_mapping_id, topic_id=None):
+        position = self._position(keys=[self.get_board_key(exam_id, topic_id)], args=[exam_user_mapping_id])
+        if position is None:
+            return None
+        score, higher, total = position
+        return build_position(float(score), higher + 1, total)
+
+    def top(self, exam_id, limit, topic_id=None):
+        entries = self.client.zrevrange(self.get_board_key(exam_id, topic_id), 0, limit - 1, withscores=True)
+        return rank_top_entries((int(member), score) for member, score in entries)
+
+    def reconcile(self, exam_id, rows):
+        # rows: (exam_user_mapping_id, total_score, topic_scores) from the authoritative scoring pass.
+        pipeline = self.client.pipeline()
+        for exam_user_mapping_id, _, _ in rows:
+            pipeline.zscore(self.get_board_key(exam_id), exam_user_mapping_id)
+        live_scores = pipeline.execute()
+
+        drifted = 0
+        pipeline = self.client.pipeline()
+        for (exam_user_mapping_id, total_score, topic_scores), live_score in zip(rows, live_scores):
+            if live_score is None or live_score != total_score:
+                drifted += 1
+            self._set_scores(pipeline, exam_id, exam_user_mapping_id, total_score, topic_scores)
+        pipeline.execute()
+        return drifted
+
+    def expire(self, exam_id, topic_ids, seconds):
+        pipeline = self.client.pipeline()
+        pipeline.expire(self.get_board_key(exam_id), seconds)
+        for topic_id in topic_ids:
+            pipeline.expire(self.get_board_key(exam_id, topic_id), seconds)
+        pipeline.execute()
+
+
+class AsyncRedisLiveLeaderboard:
+    # The answer-recording side of RedisLiveLeaderboard for async views.
+
+    def __init__(self, client):
+        self.client = client
+        self._record_answer = client.register_script(RECORD_ANSWER_SCRIPT)
+
+    async def record_answer(self, exam_id, exam_user_mapping_id, multiple_choice_question_id, topic_id, points):
+        keys = [
+            RedisLiveLeaderboard.get_answers_key(exam_id, exam_user_mapping_id),
+            RedisLiveLeaderboard.get_board_key(exam_id),
+        ]
+        if topic_id is not None:
+            keys.append(RedisLiveLeaderboard.get_board_key(exam_id, topic_id))
+        return float(await self._record_answer(
+            keys=keys,
+            args=[multiple_choice_question_id, points, exam_user_mapping_id, settings.LIVE_LEADERBOARD_RETENTION],
+        ))
+
+
+class LocalLiveLeaderboard:
+    # In-process stand-in for the Redis sorted sets, for tests and single-process development.
+    # Lookups are linear here; only the Redis backend gives logarithmic ranks.
+
+    def __init__(self):
+        self._boards = defaultdict(dict)
+        self._answers = defaultdict(dict)
+        self._finalized = set()
+        self._mutex = threading.Lock()
+
+    def register(self, exam_id, exam_user_mapping_id, topic_ids=()):
+        with self._mutex:
+            self._boards[(exam_id, None)].setdefault(exam_user_mapping_id, 0.0)
+            for topic_id in topic_ids:
+                self._boards[(exam_id, topic_id)].setdefault(exam_user_mapping_id, 0.0)
+
+    def record_answer(self, exam_id, exam_user_mapping_id, multiple_choice_question_id, topic_id, points):
+        with self._mutex:
+            if (exam_id, exam_user_mapping_id) in self._finalized:
+                return 0.0
+            answers = self._answers[(exam_id, exam_user_mapping_id)]
+            delta = float(points) - answers.get(multiple_choice_question_id, 0.0)
+            answers[multiple_choice_question_id] = float(points)
+            board_keys = [(exam_id, None)] if topic_id is None else [(exam_id, None), (exam_id, topic_id)]
+            for board_key in board_keys:
+                board = self._boards[board_key]
+                board[exam_user_mapping_id] = board.get(exam_user_mapping_id, 0.0) + delta
+        return delta
+
+    def set_scores(self, exam_id, exam_user_mapping_id, total_score, topic_scores):
+        with self._mutex:
+            self._set_scores(exam_id, exam_user_mapping_id, total_score, topic_scores)
+
+    def _set_scores(self, exam_id, exam_user_mapping_id, total_score, topic_scores):
+        self._boards[(exam_id, None)][exam_user_mapping_id] = float(total_score)
+        for topic_id, score in topic_scores.items():
+            self._boards[(exam_id, topic_id)][exam_user_mapping_id] = float(score)
+        self._answers.pop((exam_id, exam_user_mapping_id), None)
+        self._finalized.add((exam_id, exam_user_mapping_id))
+
+    def position(self, exam_id, exam_user_mapping_id, topic_id=None):
+        with self._mutex:
+            board = self._boards.get((exam_id, topic_id)) or {}
+            score = board.get(exam_user_mapping_id)
+            if score is None:
+                return None
+            higher = sum(1 for other_score in board.values() if other_score > score)
+            return build_position(score, higher + 1, len(board))
+
+    def top(self, exam_id, limit, topic_id=None):
+        with self._mutex:
+            board = self._boards.get((exam_id, topic_id)) or {}
+            entries = sorted(board.items(), key=lambda item: (-item[1], -item[0]))[:limit]
+        return rank_top_entries(entries)
+
+    def reconcile(self, exam_id, rows):
+        drifted = 0
+        with self._mutex:
+            board = self._boards[(exam_id, None)]
+            for exam_user_mapping_id, total_score, topic_scores in rows:
+                if board.get(exam_user_mapping_id) != total_score:
+                    drifted += 1
+                self._set_scores(exam_id, exam_user_mapping_id, total_score, topic_scores)
+        return drifted
+
+    def expire(self, exam_id, topic_ids, seconds):
+        # Finalized boards stay until the process exits; there is nothing to schedule in-process.
+        pass
+
+
+_local_live_leaderboard = LocalLiveLeaderboard()
+
+
+class AsyncLocalLiveLeaderboard:
+    def __init__(self, live_leaderboard):
+        self.live_leaderboard = live_leaderboard
+
+    async def record_answer(self, exam_id, exam_user_mapping_id, multiple_choice_question_id, topic_id, points):
+        return self.live_leaderboard.record_answer(
+            exam_id, exam_user_mapping_id, multiple_choice_question_id, topic_id, points
+        )
+
+
+_async_local_live_leaderboard = AsyncLocalLiveLeaderboard(_local_live_leaderboard)
+
+
+def get_live_leaderboard():
+    backend = settings.LIVE_LEADERBOARD_BACKEND
+    if backend == LIVE_LEADERBOARD_BACKEND_REDIS:
+        return RedisLiveLeaderboard(get_redis_client())
+    if backend == LIVE_LEADERBOARD_BACKEND_LOCAL:
+        return _local_live_leaderboard
+    return None
+
+
+def get_async_live_leaderboard():
+    backend = settings.LIVE_LEADERBOARD_BACKEND
+    if backend == LIVE_LEADERBOARD_BACKEND_REDIS:
+        return AsyncRedisLiveLeaderboard(get_async_redis_client())
+    if backend == LIVE_LEADERBOARD_BACKEND_LOCAL:
+        return _async_local_live_leaderboard
+    return None
+
+
+def get_topic_scores(subject_scores, topic_titles):
+    subject_scores = subject_scores or {}
+    return {topic_id: subject_scores.get(title, 0) for topic_id, title in topic_titles.items()}
+
+
+def register_live_session(exam_id, exam_user_mapping_id, topic_ids):
+    live_leaderboard = get_live_leaderboard()
+    if live_leaderboard is None:
+        return
+    topic_ids = list(topic_ids)
+    transaction.on_commit(lambda: live_leaderboard.register(exam_id, exam_user_mapping_id, topic_ids))
+
+
+def record_live_answer(live_leaderboard, answer_key, exam_user_mapping_id, multiple_choice_question_id, is_correct):
+    return live_leaderboard.record_answer(
+        answer_key.exam_id,
+        exam_user_mapping_id,
+        multiple_choice_question_id,
+        answer_key.get_topic_id(multiple_choice_question_id),
+        answer_key.get_points(is_correct),
+    )
+
+
+async def arecord_live_answer(live_leaderboard, answer_key, exam_user_mapping_id, multiple_choice_question_id,
+                              is_correct):
+    return await live_leaderboard.record_answer(
+        answer_key.exam_id,
+        exam_user_mapping_id,
+        multiple_choice_question_id,
+        answer_key.get_topic_id(multiple_choice_question_id),
+        answer_key.get_points(is_correct),
+    )
+
+
+def publish_live_session_scores(exam_id, exam_user_mapping_id, total_score, subject_scores, topic_titles):
+    live_leaderboard = get_live_leaderboard()
+    if live_leaderboard is None:
+        return
+    topic_scores = get_topic_scores(subject_scores, topic_titles)
+    transaction.on_commit(
+        lambda: live_leaderboard.set_scores(exam_id, exam_user_mapping_id, total_score, topic_scores)
+    )
+
+
+def reconcile_live_leaderboard(exam_id, topic_titles, chunk_size=LIVE_LEADERBOARD_CHUNK_SIZE):
+    # Overwrites the provisional boards with the final scores, then lets them expire so the
+    # post-exam leaderboard takes over.
+    live_leaderboard = get_live_leaderboard()
+    if live_leaderboard is None:
+        return None
+
+    reconciled = 0
+    drifted = 0
+    rows = []
+    exam_user_mappings = ExamUserMapping.objects.filter(exam_id=exam_id, activated=True).values_list(
+        'id', 'total_score', 'subject_scores'
+    ).iterator(chunk_size=chunk_size)
+    for exam_user_mapping_id, total_score, subject_scores in exam_user_mappings:
+        rows.append((exam_user_mapping_id, total_score or 0, get_topic_scores(subject_scores, topic_titles)))
+        if len(rows) >= chunk_size:
+            drifted += live_leaderboard.reconcile(exam_id, rows)
+            reconciled += len(rows)
+            rows = []
+    if rows:
+        drifted += live_leaderboard.reconcile(exam_id, rows)
+        reconciled += len(rows)
+
+    live_leaderboard.expire(exam_id, topic_titles.keys(), settings.LIVE_LEADERBOARD_RETENTION)
+    logger.info(
+        'Reconciled live leaderboard for exam %s: %s sessions, %s differed from the final score',
+        exam_id, reconciled, drifted,
+    )
+    return {'reconciled': reconciled, 'drifted': drifted}
@@ -0,0 +1,405 @@
+import asyncio
+import json
+import random
+import ssl
+import statistics
+import time
+from collections import Counter, defaultdict
+from importlib import import_module
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.contrib.auth import BACKEND_SESSION_KEY, HASH_SESSION_KEY, SESSION_KEY
+from django.contrib.sessions.backends.base import VALID_KEY_CHARS
+from django.db import connection
+from django.urls import reverse
+from django.utils.crypto import get_random_string
+
+from testprep.utils import get_redis_client
+from tests.benchmarks import percentile
+from tests.synthetic import SYNTHETIC_BATCH_SIZE, SYNTHETIC_EXAM_OPEN, create_synthetic_users, \
+    generate_synthetic_exam
+
+PHASE_START = 'start'
+PHASE_STEADY = 'steady'
+PHASE_BURST = 'burst'
+PHASES = (PHASE_START, PHASE_STEADY, PHASE_BURST)
+
+
+class Candidate:
+    def __init__(self, user_id, session_key, csrf_token):
+        self.user_id = user_id
+        self.session_key = session_key
+        self.csrf_token = csrf_token
+        self.exam_user_mapping_hash = None
+        self.questions = []
+        self.start_queue_time = 0
+        self.start_retries = 0
+
+    def get_headers(self):
+        return {
+            'Cookie': f'{settings.SESSION_COOKIE_NAME}={self.session_key}; {settings.CSRF_COOKIE_NAME}={self.csrf_token}',
+            'X-CSRFToken': self.csrf_token,
+        }
+
+
+def create_candidate_sessions(users):
+    # Logs the synthetic users in by writing their sessions directly, the way django.contrib.auth.login
+    # would, so the harness never has to go through a login form.
+    session_store_class = import_module(settings.SESSION_ENGINE).SessionStore
+    database_backed = hasattr(session_store_class, 'get_model_class')
+    backend = settings.AUTHENTICATION_BACKENDS[0]
+    candidates = []
+    sessions = []
+    for user in users:
+        session_store = session_store_class()
+        session_data = {
+            SESSION_KEY: str(user.pk),
+            BACKEND_SESSION_KEY: backend,
+            HASH_SESSION_KEY: user.get_session_auth_hash(),
+        }
+        if database_backed:
+            session_key = get_random_string(32, VALID_KEY_CHARS)
+            sessions.append(session_store_class.get_model_class()(
+                session_key=session_key,
+                session_data=session_store.encode(session_data),
+                expire_date=session_store.get_expiry_date(),
+            ))
+        else:
+            session_store.update(session_data)
+            session_store.create()
+            session_key = session_store.session_key
+        candidates.append(Candidate(user.pk, session_key, get_random_string(32)))
+
+    if sessions:
+        session_store_class.get_model_class().objects.bulk_create(sessions, batch_size=SYNTHETIC_BATCH_SIZE)
+    return candidates
+
+
+def sample_saturation():
+    sample = {}
+    if connection.vendor == 'postgresql':
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT count(*) FILTER (WHERE state = 'active'), "
+                "count(*) FILTER (WHERE wait_event_type = 'Lock'), count(*), "
+                "current_setting('max_connections')::int "
+                "FROM pg_stat_activity WHERE datname = current_database()"
+            )
+            active, waiting_on_locks, total, max_connections = cursor.fetchone()
+        sample.update({
+            'db_active_connections': active - 1,
+            'db_lock_waits': waiting_on_locks,
+            'db_connections': total,
+            'db_connection_usage': round(total / max_connections, 4),
+        })
+
+    redis_info = get_redis_client().info()
+    sample.update({
+        'redis_connected_clients': redis_info.get('connected_clients'),
+        'redis_blocked_clients': redis_info.get('blocked_clients'),
+        'redis_ops_per_sec': redis_info.get('instantaneous_ops_per_sec'),
+        'redis_used_memory': redis_info.get('used_memory'),
+    })
+    return sample
+
+
+class HttpConnection:
+    # A minimal keep-alive HTTP/1.1 client on asyncio streams; the harness only needs JSON
+    # request/response pairs and keeps the dependency list unchanged.
+
+    def __init__(self, host, port, use_ssl):
+        self.host = host
+        self.port = port
+        self.use_ssl = use_ssl
+        self.reader = None
+        self.writer = None
+
+    async def connect(self):
+        self.reader, self.writer = await asyncio.open_connection(
+            self.host, self.port, ssl=ssl.create_default_context() if self.use_ssl else None
+        )
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+    async def request(self, method, path, headers, body=b''):
+        if self.writer is None:
+            await self.connect()
+
+        lines = [f'{method} {path} HTTP/1.1', f'Host: {self.host}:{self.port}', f'Content-Length: {len(body)}']
+        lines.extend(f'{name}: {value}' for name, value in headers.items())
+        self.writer.write(('\r\n'.join(lines) + '\r\n\r\n').encode() + body)
+        await self.writer.drain()
+
+        status_line = await self.reader.readline()
+        if not status_line:
+            raise ConnectionResetError('Connection closed by server')
+        status = int(status_line.split()[1])
+        response_headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b'\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            response_headers[name.strip().lower()] = value.strip()
+
+        if 'content-length' in response_headers:
+            response_body = await self.reader.readexactly(int(response_headers['content-length']))
+        elif response_headers.get('transfer-encoding', '').lower() == 'chunked':
+            chunks = []
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                if not size:
+                    await self.reader.readline()
+                    break
+                chunks.append(await self.reader.readexactly(size))
+                await self.reader.readline()
+            response_body = b''.join(chunks)
+        else:
+            response_body = await self.reader.read()
+            self.close()
+
+        if response_headers.get('connection', '').lower() == 'close':
+            self.close()
+        return status, response_body
+
+
+class PhaseStats:
+    def __init__(self, name):
+        self.name = name
+        self.first_sent_at = None
+        self.last_finished_at = None
+        self.latencies = defaultdict(list)
+        self.statuses = Counter()
+        self.errors = Counter()
+        self.saturation = []
+        self.sampler_errors = Counter()
+        self.queue_times = []
+        self.queue_retries = []
+
+    def record(self, route, sent_at, finished_at, status=None, error=None):
+        self.first_sent_at = min(self.first_sent_at or sent_at, sent_at)
+        self.last_finished_at = max(self.last_finished_at or finished_at, finished_at)
+        self.latencies[route].append((finished_at - sent_at) * 1000)
+        if error is not None:
+            self.errors[error] += 1
+        else:
+            self.statuses[status] += 1
+
+    @staticmethod
+    def summarize_latencies(latencies):
+        return {
+            'requests': len(latencies),
+            'p50_ms': round(percentile(latencies, 0.5), 2),
+            'p90_ms': round(percentile(latencies, 0.9), 2),
+            'p99_ms': round(percentile(latencies, 0.99), 2),
+            'max_ms': round(max(latencies), 2),
+        }
+
+    def record_queue(self, queue_time, retries):
+        self.queue_times.append(queue_time * 1000)
+        self.queue_retries.append(retries)
+
+    def summarize_queue(self):
+        if not self.queue_times:
+            return {'queued': 0}
+        return {
+            'queued': len(self.queue_times),
+            'retries': sum(self.queue_retries),
+            'max_retries': max(self.queue_retries),
+            'p50_ms': round(percentile(self.queue_times, 0.5), 2),
+            'p99_ms': round(percentile(self.queue_times, 0.99), 2),
+            'max_ms': round(max(self.queue_times), 2),
+        }
+
+    def summarize(self):
+        latencies = [latency for route_latencies in self.latencies.values() for latency in route_latencies]
+        if not latencies:
+            return {'requests': 0}
+
+        failed = sum(self.errors.values()) + sum(
+            count for status, count in self.statuses.items() if status >= 500
+        )
+        rejected = sum(count for status, count in self.statuses.items() if 400 <= status < 500)
+        elapsed = max(self.last_finished_at - self.first_sent_at, 1e-9)
+        saturation = {}
+        for key in sorted({key for sample in self.saturation for key in sample}):
+            values = [sample[key] for sample in self.saturation if sample.get(key) is not None]
+            if values:
+                saturation[key] = {'mean': round(statistics.mean(values), 2), 'max': max(values)}
+
+        return {
+            **self.summarize_latencies(latencies),
+            'duration_s': round(elapsed, 2),
+            'throughput_rps': round(len(latencies) / elapsed, 2),
+            'error_rate': round(failed / len(latencies), 4),
+            'rejection_rate': round(rejected / len(latencies), 4),
+            'statuses': {str(status): count for status, count in sorted(self.statuses.items())},
+            'errors': dict(self.errors),
+            'routes': {
+                route: self.summarize_latencies(route_latencies)
+                for route, route_latencies in sorted(self.latencies.items())
+            },
+            'saturation': saturation,
+            'sampler_errors': dict(self.sampler_errors),
+            'queue': self.summarize_queue(),
+        }
+
+
+class LoadTest:
+    def __init__(self, base_url, exam_hash, candidates, start_window, steady_duration, steady_answers,
+                 burst_window, burst_answers, connections, timeout, sample_interval, seed=None):
+        parsed_url = urlsplit(base_url)
+        self.host = parsed_url.hostname
+        self.port = parsed_url.port or (443 if parsed_url.scheme == 'https' else 80)
+        self.use_ssl = parsed_url.scheme == 'https'
+        self.path_prefix = parsed_url.path.rstrip('/')
+        self.exam_hash = exam_hash
+        self.candidates = candidates
+        self.start_window = start_window
+        self.steady_duration = steady_duration
+        self.steady_answers = steady_answers
+        self.burst_window = burst_window
+        self.burst_answers = burst_answers
+        self.connections = connections
+        self.timeout = timeout
+        self.sample_interval = sample_interval
+        self.random = random.Random(seed)
+        self.phases = {phase: PhaseStats(phase) for phase in PHASES}
+        self._pool = None
+        self._started_at = None
+
+    def get_phase_window(self, phase):
+        start_end = self.start_window
+        steady_end = start_end + self.steady_duration
+        return {
+            PHASE_START: (0, start_end),
+            PHASE_STEADY: (start_end, steady_end),
+            PHASE_BURST: (steady_end, steady_end + self.burst_window),
+        }[phase]
+
+    def get_phase_at(self, offset):
+        for phase in PHASES:
+            if offset < self.get_phase_window(phase)[1]:
+                return phase
+        return PHASE_BURST
+
+    async def sleep_until(self, offset):
+        delay = self._started_at + offset - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    async def request(self, phase, route, candidate, method, path, payload=None):
+        body = json.dumps(payload).encode() if payload is not None else b''
+        headers = {**candidate.get_headers(), 'Accept': 'application/json'}
+        if payload is not None:
+            headers['Content-Type'] = 'application/json'
+
+        http_connection = await self._pool.get()
+        sent_at = time.perf_counter()
+        try:
+            status, response_body = await asyncio.wait_for(
+                http_connection.request(method, self.path_prefix + path, headers, body), self.timeout
+            )
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ValueError, IndexError) as error:
+            http_connection.close()
+            self.phases[phase].record(route, sent_at, time.perf_counter(), error=type(error).__name__)
+            return None, None
+        finally:
+            self._pool.put_nowait(http_connection)
+        self.phases[phase].record(route, sent_at, time.perf_counter(), status=status)
+        return status, response_body
+
+    async def submit_answer(self, phase, candidate):
+        if not candidate.questions:
+            return
+        question_hash = self.random.choice(candidate.questions)
+        await self.request(
+            phase, 'answer_submit', candidate, 'PUT',
+            reverse('tests:exam-user-mcq-submit', args=[question_hash]),
+            {'selected_choice': self.random.randint(1, 4)},
+        )
+
+    async def start_exam(self, candidate):
+        # A 202 means the admission queue held the start back; retry after the delay it hands out, as a
+        # browser would, until admitted or the burst window is over.
+        start_path = reverse('tests:exam-user-mapping-create', args=[self.exam_hash])
+        queued_at = time.perf_counter()
+        phase = PHASE_START
+        status, body = await self.request(phase, 'exam_start', candidate, 'POST', start_path)
+        while status == 202:
+            candidate.start_retries += 1
+            await asyncio.sleep(json.loads(body)['retry_after'])
+            offset = time.perf_counter() - self._started_at
+            if offset >= self.get_phase_window(PHASE_BURST)[1]:
+                break
+            phase = self.get_phase_at(offset)
+            status, body = await self.request(phase, 'exam_start_retry', candidate, 'POST', start_path)
+
+        if candidate.start_retries:
+            candidate.start_queue_time = time.perf_counter() - queued_at
+            self.phases[PHASE_START].record_queue(candidate.start_queue_time, candidate.start_retries)
+        return status, body
+
+    async def run_candidate(self, candidate):
+        start_begin, start_end = self.get_phase_window(PHASE_START)
+        await self.sleep_until(self.random.uniform(start_begin, start_end))
+        status, body = await self.start_exam(candidate)
+        if status not in (200, 201):
+            return
+        candidate.exam_user_mapping_hash = json.loads(body)['hash']
+        detail_path = reverse('tests:exam-user-mapping-detail', args=[candidate.exam_user_mapping_hash])
+
+        status, body = await self.request(PHASE_START, 'session_detail', candidate, 'GET', detail_path)
+        if status != 200:
+            return
+        candidate.questions = [
+            row['hash'] for row in json.loads(body)['exam_user_multiple_choice_question_mappings']
+        ]
+
+        for phase, answers in ((PHASE_STEADY, self.steady_answers), (PHASE_BURST, self.burst_answers)):
+            phase_begin, phase_end = self.get_phase_window(phase)
+            for offset in sorted(self.random.uniform(phase_begin, phase_end) for _ in range(answers)):
+                await self.sleep_until(offset)
+                await self.submit_answer(self.get_phase_at(offset), candidate)
+
+        await self.request(PHASE_BURST, 'session_complete', candidate, 'PUT', detail_path)
+
+    async def sample(self, stop):
+        while not stop.is_set():
+            phase = self.get_phase_at(time.perf_counter() - self._started_at)
+            try:
+                self.phases[phase].saturation.append(await asyncio.to_thread(sample_saturation))
+            except Exception as error:
+                self.phases[phase].sampler_errors[type(error).__name__] += 1
+            try:
+                await asyncio.wait_for(stop.wait(), self.sample_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run(self):
+        self._pool = asyncio.Queue()
+        for _ in range(self.connections):
+            self._pool.put_nowait(HttpConnection(self.host, self.port, self.use_ssl))
+        self._started_at = time.perf_counter()
+
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(self.sample(stop))
+        await asyncio.gather(*(self.run_candidate(candidate) for candidate in self.candidates))
+        stop.set()
+        await sampler
+
+        while not self._pool.empty():
+            self._pool.get_nowait().close()
+        return {phase: self.phases[phase].summarize() for phase in PHASES}
+
+
+def prepare_load_test(candidates, questions, topics, seed=None):
+    exam = generate_synthetic_exam(
+        users=0, questions=questions, topics=topics, state=SYNTHETIC_EXAM_OPEN, seed=seed, past_exam_stats=False
+    )
+    users = create_synthetic_users(f'loadtest-{exam["exam_hash"][:8]}', candidates)
+    return exam, create_candidate_sessions(users)
@@ -0,0 +1,67 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from tests.partitions import (
+    archive_answer_partition,
+    attach_answer_partition,
+    convert_answer_table,
+    create_answer_partition,
+    detach_answer_partition,
+    get_answer_partitions,
+    is_answer_table_partitioned,
+)
+
+ACTION_CONVERT = 'convert'
+ACTION_CREATE = 'create'
+ACTION_ATTACH = 'attach'
+ACTION_DETACH = 'detach'
+ACTION_ARCHIVE = 'archive'
+ACTION_STATUS = 'status'
+
+
+class Command(BaseCommand):
+    help = (
+        'Manage the exam partitions of the per-question answer table on PostgreSQL: convert the table '
+        'to the partitioned layout once, then create, attach, detach or archive one partition per exam.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'action', choices=[ACTION_CONVERT, ACTION_CREATE, ACTION_ATTACH, ACTION_DETACH, ACTION_ARCHIVE, ACTION_STATUS]
+        )
+        parser.add_argument('exam_ids', nargs='*', type=int)
+        parser.add_argument('--schema', help='Schema archived partitions are moved to.')
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('Partitioned answer storage needs PostgreSQL.')
+
+        action = options['action']
+        if action == ACTION_CONVERT:
+            if convert_answer_table():
+                self.stdout.write(self.style.SUCCESS('Converted the answer table to partitions by exam.'))
+            else:
+                self.stdout.write('The answer table is already partitioned.')
+            return
+        if not is_answer_table_partitioned():
+            raise CommandError('The answer table is not partitioned yet; run the convert action first.')
+        if action == ACTION_STATUS:
+            for partition in get_answer_partitions():
+                self.stdout.write(
+                    f'{partition["schema"]}.{partition["table"]}: ~{partition["rows"]} rows, '
+                    f'{partition["bytes"] // (1024 * 1024)} MiB, {"attached" if partition["attached"] else "detached"}'
+                )
+            return
+        if not options['exam_ids']:
+            raise CommandError(f'{action} needs at least one exam id.')
+
+        for exam_id in options['exam_ids']:
+            if action == ACTION_CREATE:
+                changed = create_answer_partition(exam_id)
+            elif action == ACTION_ATTACH:
+                changed = attach_answer_partition(exam_id)
+            elif action == ACTION_DETACH:
+                changed = detach_answer_partition(exam_id)
+            else:
+                changed = archive_answer_partition(exam_id, schema=options['schema'])
+            self.stdout.write(f'Exam {exam_id}: {action} {"done" if changed else "skipped, nothing to do"}.')
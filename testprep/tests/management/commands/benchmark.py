@@ -0,0 +1,69 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tests.benchmarks import BENCHMARK_CASES, compare_to_baseline, run_benchmarks
+
+
+class Command(BaseCommand):
+    help = (
+        'Time the exam hot paths against freshly generated synthetic exams and compare the results '
+        'with a stored baseline. Run with --settings=testprep.settings_benchmark.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--topics', type=int, default=3)
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--case', action='append', choices=list(BENCHMARK_CASES), dest='cases',
+                            help='Run only this case; repeat for several.')
+        parser.add_argument('--output', help='Write the JSON results to this file.')
+        parser.add_argument('--baseline', help='Compare against the JSON results stored in this file.')
+        parser.add_argument('--tolerance', type=float, default=0.2,
+                            help='Allowed growth of the median time over the baseline, as a fraction.')
+        parser.add_argument('--save-baseline', action='store_true', help='Overwrite --baseline with these results.')
+
+    def handle(self, *args, **options):
+        if not getattr(settings, 'BENCHMARK_ENABLED', False):
+            raise CommandError(
+                'The benchmark writes synthetic exams to the database; run it with '
+                '--settings=testprep.settings_benchmark.'
+            )
+        if options['save_baseline'] and not options['baseline']:
+            raise CommandError('--save-baseline needs --baseline.')
+
+        results = run_benchmarks(
+            users=options['users'],
+            questions=options['questions'],
+            topics=options['topics'],
+            iterations=options['iterations'],
+            seed=options['seed'],
+            names=options['cases'],
+        )
+        output = json.dumps(results, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        self.stdout.write(output)
+
+        if not options['baseline']:
+            return
+        if options['save_baseline']:
+            with open(options['baseline'], 'w') as baseline_file:
+                baseline_file.write(output)
+            self.stdout.write(self.style.SUCCESS(f'Saved baseline to {options["baseline"]}'))
+            return
+
+        with open(options['baseline']) as baseline_file:
+            baseline = json.load(baseline_file)
+        regressions = compare_to_baseline(results, baseline, options['tolerance'])
+        for regression in regressions:
+            self.stderr.write(
+                f'{regression["case"]}: {regression["metric"]} {regression["baseline"]} -> {regression["current"]}'
+            )
+        if regressions:
+            raise CommandError(f'{len(regressions)} regression(s) against {options["baseline"]}')
+        self.stdout.write(self.style.SUCCESS('No regressions against the baseline.'))
@@ -0,0 +1,60 @@
+import sys
+
+from django.core.management.base import BaseCommand, CommandError
+
+from tests.exports import (
+    EXPORT_FORMAT_CSV,
+    EXPORT_FORMATS,
+    EXPORT_KIND_ANSWERS,
+    EXPORT_KIND_OVERALL,
+    EXPORT_KIND_SUBJECTS,
+    EXPORT_KINDS,
+    get_results_export,
+    stream_results_export,
+)
+from tests.models import Exam, Topic
+
+
+class Command(BaseCommand):
+    help = (
+        'Stream an exam\'s results (overall board, subject standings or answer matrix) as CSV or NDJSON '
+        'through a server-side cursor, so memory stays flat however many sessions the exam has.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('hash_exam')
+        parser.add_argument('--kind', choices=EXPORT_KINDS, default=EXPORT_KIND_OVERALL)
+        parser.add_argument('--format', choices=EXPORT_FORMATS, default=EXPORT_FORMAT_CSV, dest='export_format')
+        parser.add_argument('--subject-hash', help='Only this subject, with --kind subjects.')
+        parser.add_argument('--gzip', action='store_true')
+        parser.add_argument('--chunk-size', type=int, default=None)
+        parser.add_argument('--output', help='Write to this file instead of stdout.')
+
+    def handle(self, *args, **options):
+        exam = Exam.objects.filter(hash=options['hash_exam']).values('id', 'completed').first()
+        if exam is None:
+            raise CommandError(f'Exam {options["hash_exam"]} not found.')
+        if not exam['completed'] and options['kind'] != EXPORT_KIND_ANSWERS:
+            self.stderr.write('The exam leaderboard has not been computed yet; ranks will be missing.')
+
+        topic_id = None
+        if options['subject_hash']:
+            if options['kind'] != EXPORT_KIND_SUBJECTS:
+                raise CommandError('--subject-hash needs --kind subjects.')
+            topic_id = Topic.objects.filter(hash=options['subject_hash']).values_list('id', flat=True).first()
+            if topic_id is None:
+                raise CommandError(f'Subject {options["subject_hash"]} not found.')
+
+        chunks = stream_results_export(
+            get_results_export(exam['id'], options['kind'], topic_id=topic_id, chunk_size=options['chunk_size']),
+            options['export_format'],
+            compress=options['gzip'],
+        )
+        if options['output']:
+            with open(options['output'], 'wb') as output_file:
+                for chunk in chunks:
+                    output_file.write(chunk)
+            return
+        for chunk in chunks:
+            sys.stdout.buffer.write(chunk)
+        sys.stdout.buffer.flush()
@@ -0,0 +1,47 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from tests.enums import ExamType
+from tests.synthetic import SYNTHETIC_EXAM_FINISHED, SYNTHETIC_EXAM_OPEN, generate_synthetic_exam
+
+
+class Command(BaseCommand):
+    help = 'Generate a synthetic exam with users, questions and answers through bulk inserts.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--topics', type=int, default=3)
+        parser.add_argument('--exam-type', type=int, choices=ExamType.values, default=ExamType.CAT)
+        parser.add_argument('--year', type=int, default=None)
+        parser.add_argument('--state', choices=[SYNTHETIC_EXAM_OPEN, SYNTHETIC_EXAM_FINISHED], default=SYNTHETIC_EXAM_OPEN)
+        parser.add_argument('--answer-rate', type=float, default=0.8, help='Share of questions each user answers.')
+        parser.add_argument('--accuracy', type=float, default=0.6, help='Mean share of answers that are correct.')
+        parser.add_argument('--accuracy-spread', type=float, default=0.15, help='Standard deviation of user accuracy.')
+        parser.add_argument('--completed-ratio', type=float, default=0.8,
+                            help='Share of sessions submitted before a finished exam closed.')
+        parser.add_argument('--puzzle-ratio', type=float, default=0.2)
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--no-past-exam-stats', action='store_true')
+        parser.add_argument('--packed-answer-sheets', action='store_true',
+                            help='Store answers as packed sheets on the sessions instead of one row per question.')
+
+    def handle(self, *args, **options):
+        summary = generate_synthetic_exam(
+            users=options['users'],
+            questions=options['questions'],
+            topics=options['topics'],
+            exam_type=options['exam_type'],
+            year=options['year'],
+            state=options['state'],
+            answer_rate=options['answer_rate'],
+            accuracy=options['accuracy'],
+            accuracy_spread=options['accuracy_spread'],
+            completed_ratio=options['completed_ratio'],
+            puzzle_ratio=options['puzzle_ratio'],
+            seed=options['seed'],
+            past_exam_stats=not options['no_past_exam_stats'],
+            packed_answer_sheets=options['packed_answer_sheets'],
+        )
+        self.stdout.write(json.dumps(summary, indent=2))
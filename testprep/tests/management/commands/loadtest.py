@@ -0,0 +1,82 @@
+import asyncio
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tests.loadtest import PHASES, LoadTest, prepare_load_test
+
+
+class Command(BaseCommand):
+    help = (
+        'Drive the exam routes of a running server with many synthetic candidates: a start spike, '
+        'steady answering and an end-of-exam burst. The server must share this database and Redis.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--base-url', default='http://127.0.0.1:8000', help='Root URL of the target server.')
+        parser.add_argument('--candidates', type=int, default=1000)
+        parser.add_argument('--questions', type=int, default=100)
+        parser.add_argument('--topics', type=int, default=3)
+        parser.add_argument('--start-window', type=float, default=60, help='Seconds over which every candidate starts.')
+        parser.add_argument('--steady-duration', type=float, default=120)
+        parser.add_argument('--steady-answers', type=int, default=10, help='Answers per candidate while steady.')
+        parser.add_argument('--burst-window', type=float, default=30, help='Seconds of the end-of-exam burst.')
+        parser.add_argument('--burst-answers', type=int, default=10, help='Answers per candidate in the burst.')
+        parser.add_argument('--connections', type=int, default=200, help='Concurrent HTTP connections.')
+        parser.add_argument('--timeout', type=float, default=30, help='Per-request timeout in seconds.')
+        parser.add_argument('--sample-interval', type=float, default=1, help='Seconds between DB/Redis samples.')
+        parser.add_argument('--seed', type=int, default=None)
+        parser.add_argument('--output', help='Write the JSON report to this file.')
+        parser.add_argument('--force', action='store_true', help='Run even when DEBUG is off.')
+
+    def handle(self, *args, **options):
+        if not settings.DEBUG and not options['force']:
+            raise CommandError(
+                'The load test creates synthetic users, sessions and an exam in this database; '
+                'pass --force to run it with DEBUG off.'
+            )
+
+        exam, candidates = prepare_load_test(
+            options['candidates'], options['questions'], options['topics'], seed=options['seed']
+        )
+        self.stdout.write(f'Prepared exam {exam["exam_hash"]} for {len(candidates)} candidates')
+
+        load_test = LoadTest(
+            base_url=options['base_url'],
+            exam_hash=exam['exam_hash'],
+            candidates=candidates,
+            start_window=options['start_window'],
+            steady_duration=options['steady_duration'],
+            steady_answers=options['steady_answers'],
+            burst_window=options['burst_window'],
+            burst_answers=options['burst_answers'],
+            connections=options['connections'],
+            timeout=options['timeout'],
+            sample_interval=options['sample_interval'],
+            seed=options['seed'],
+        )
+        report = {'exam': exam, 'phases': asyncio.run(load_test.run())}
+
+        for phase in PHASES:
+            summary = report['phases'][phase]
+            if not summary['requests']:
+                self.stdout.write(f'{phase:>8}: no requests')
+                continue
+            self.stdout.write(
+                f'{phase:>8}: {summary["requests"]} requests, {summary["throughput_rps"]} req/s, '
+                f'p50 {summary["p50_ms"]} ms, p99 {summary["p99_ms"]} ms, '
+                f'errors {summary["error_rate"]:.2%}, rejected {summary["rejection_rate"]:.2%}'
+            )
+            if summary['queue']['queued']:
+                self.stdout.write(
+                    f'{"":>8}  {summary["queue"]["queued"]} starts queued, {summary["queue"]["retries"]} retries, '
+                    f'queue p50 {summary["queue"]["p50_ms"]} ms, p99 {summary["queue"]["p99_ms"]} ms'
+                )
+
+        output = json.dumps(report, indent=2)
+        if options['output']:
+            with open(options['output'], 'w') as output_file:
+                output_file.write(output)
+        else:
+            self.stdout.write(output)
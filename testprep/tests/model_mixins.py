@@ -1,5 +1,5 @@
 from django.db import models
-from django.db.models.signals import pre_save
+from django.db.models.signals import class_prepared, pre_save
 from django.dispatch import receiver
 
 from testprep.utils import generate_random_uuid
@@ -19,10 +19,56 @@ class ActiveModelMixin(models.Model):
         abstract = True
 
 
-@receiver(pre_save)
-def handle_models_with_hash_pre_save(sender, instance=None, **kwargs):
-    if not issubclass(sender, HashModelMixin):
-        return
+class TrackedFieldsModelMixin(models.Model):
+    # Remembers the values of `tracked_fields` as loaded from the database and as last saved, so that
+    # post_save receivers can tell what a save changed without fetching the row again. Fields that
+    # were deferred, or instances that were never loaded, have no remembered value and never count
+    # as changed.
+    tracked_fields = ()
+
+    class Meta:
+        abstract = True
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.snapshot_tracked_fields()
+        return instance
+
+    def refresh_from_db(self, *args, **kwargs):
+        super().refresh_from_db(*args, **kwargs)
+        self.snapshot_tracked_fields(kwargs.get('fields'))
+
+    def save_base(self, *args, update_fields=None, **kwargs):
+        # The post_save receivers run inside save_base and still see the values from before the save.
+        super().save_base(*args, update_fields=update_fields, **kwargs)
+        self.snapshot_tracked_fields(update_fields)
 
+    def snapshot_tracked_fields(self, fields=None):
+        snapshot = self.__dict__.setdefault('_tracked_field_values', {})
+        for field_name in self.tracked_fields:
+            if (fields is None or field_name in fields) and field_name in self.__dict__:
+                snapshot[field_name] = self.__dict__[field_name]
+
+    def get_tracked_field_value(self, field_name, default=None):
+        return self.__dict__.get('_tracked_field_values', {}).get(field_name, default)
+
+    def has_tracked_field_changed(self, field_name):
+        snapshot = self.__dict__.get('_tracked_field_values', {})
+        return field_name in snapshot and self.__dict__.get(field_name, snapshot[field_name]) != snapshot[field_name]
+
+
+def handle_models_with_hash_pre_save(sender, instance=None, **kwargs):
     if not instance.id:
         instance.hash = generate_random_uuid()
+
+
+@receiver(class_prepared)
+def connect_hash_pre_save(sender, **kwargs):
+    # Connected per model rather than to every save in the project.
+    if issubclass(sender, HashModelMixin):
+        pre_save.connect(
+            handle_models_with_hash_pre_save,
+            sender=sender,
+            dispatch_uid=f'handle_models_with_hash_pre_save:{sender._meta.label}',
+        )
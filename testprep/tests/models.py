@@ -3,13 +3,15 @@ from datetime import timedelta
 from ckeditor_uploader.fields import RichTextUploadingField
 from django.contrib.auth.models import User
 from django.core.exceptions import ValidationError
-from django.db import models
-from django.db.models.signals import post_save, pre_save
+from django.db import models, transaction
+from django.db.models.signals import post_delete, post_save, pre_delete, pre_save
 from django.dispatch import receiver
+from django.utils import timezone
 
 from testprep.celery import app
 from tests.enums import MultipleChoiceQuestionType, DifficultyType, ExamType
-from tests.model_mixins import HashModelMixin, ActiveModelMixin
+from tests.model_mixins import HashModelMixin, ActiveModelMixin, TrackedFieldsModelMixin
+from tests.signals import exam_user_mappings_completed
 
 class Topic(HashModelMixin, ActiveModelMixin):
     title = models.CharField(max_length=128,unique=True,  db_index=True)
@@ -18,7 +20,7 @@ class Topic(HashModelMixin, ActiveModelMixin):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
-class Exam(HashModelMixin, models.Model):
+class Exam(HashModelMixin, TrackedFieldsModelMixin, models.Model):
     title = models.CharField(max_length=128)
     duration = models.PositiveIntegerField(help_text='Duration in minutes')
     max_marks = models.PositiveIntegerField()
@@ -39,6 +41,12 @@ class Exam(HashModelMixin, models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     complete_exam_celery_task_id = models.CharField(max_length=255, null=True, blank=True)
     completed = models.BooleanField(default=False)
+    # Sessions keep their answers packed on ExamUserMapping instead of one row per question (see
+    # tests.answer_sheets). Slots follow the exam's question order, so its question mappings are locked
+    # once sessions exist (see ExamMultipleChoiceQuestionMapping.changes_answer_sheet_slots).
+    packed_answer_sheets = models.BooleanField(default=False)
+
+    tracked_fields = ('end_timestamp',)
 
     def clean(self):
         errors = {}
@@ -52,43 +60,37 @@ class Exam(HashModelMixin, models.Model):
         if errors:
             raise ValidationError(errors)
 
-@receiver(pre_save, sender=Exam)
-def exam_pre_save(instance, **kwargs):
-    exam = None
-    if instance.id:
-        try:
-            exam = Exam.objects.get(pk=instance.pk)
-        except Exam.DoesNotExist:
-            pass
-    else:
-        exam = None
-    instance.__old_instance = exam
-
-
-@receiver(post_save,sender=Exam)
+@receiver(post_save, sender=Exam)
 def exam_post_save(instance, created, **kwargs):
     from tests.tasks import compute_exam_leaderboard
 
-    old_instance = getattr(instance,  '__old_instance', None)
-    if not old_instance:
-        complete_exam_celery_task = compute_exam_leaderboard.apply_async(
-            (instance.id,),
-            eta=instance.end_timestamp + timedelta(minutes=5)
-        )
-        instance.complete_exam_celery_task_id = complete_exam_celery_task.id
-        instance.save(update_fields=['complete_exam_celery_task_id'])
-    else:
-        if old_instance.end_timestamp != instance.end_timestamp:
-            if old_instance.complete_exam_celery_task_id:
-                app.control.revoke(instance.end_video_session_celery_task_id, terminate=True)
-            complete_exam_celery_task = compute_exam_leaderboard.apply_async(
-                (instance.id,),
-                eta=instance.end_timestamp + timedelta(minutes=5)
-            )
-            instance.complete_exam_celery_task_id = complete_exam_celery_task.id
-            instance.save(update_fields=['complete_exam_celery_task_id'])
+    if not created and not instance.has_tracked_field_changed('end_timestamp'):
+        return
+
+    if not created and instance.complete_exam_celery_task_id:
+        app.control.revoke(instance.complete_exam_celery_task_id, terminate=True)
+    complete_exam_celery_task = compute_exam_leaderboard.apply_async(
+        (instance.id,),
+        eta=instance.end_timestamp + timedelta(minutes=5)
+    )
+    instance.complete_exam_celery_task_id = complete_exam_celery_task.id
+    Exam.objects.filter(pk=instance.pk).update(complete_exam_celery_task_id=complete_exam_celery_task.id)
+
+
+@receiver(post_save, sender=Exam)
+def exam_answer_partition(instance, created, **kwargs):
+    from tests.partitions import create_answer_partition_if_enabled
+
+    if created:
+        create_answer_partition_if_enabled(instance.id)
 
 
+@receiver(post_save, sender=Exam)
+@receiver(post_delete, sender=Exam)
+def exam_changed(instance, **kwargs):
+    from tests.resolvers import exam_resolver
+
+    exam_resolver.invalidate_on_commit([instance.hash])
 
 
 class ExamTopicMapping(models.Model):
@@ -108,6 +110,45 @@ class ExamMultipleChoiceQuestionMapping(models.Model):
     class Meta:
         unique_together = ('multiple_choice_question', 'exam')
 
+    def clean(self):
+        if self.changes_answer_sheet_slots():
+            raise ValidationError(ANSWER_SHEET_SLOTS_LOCKED_MESSAGE)
+
+    def changes_answer_sheet_slots(self):
+        # A packed answer sheet slot is the position of a question in the exam's mappings ordered by id,
+        # so adding, moving or removing one would shift the answers of every later slot.
+        previous = None
+        if self.pk is not None:
+            previous = ExamMultipleChoiceQuestionMapping.objects.filter(pk=self.pk).values_list(
+                'exam_id', 'multiple_choice_question_id'
+            ).first()
+        if previous == (self.exam_id, self.multiple_choice_question_id):
+            return False
+        return has_packed_answer_sheets({self.exam_id} | ({previous[0]} if previous else set()))
+
+
+ANSWER_SHEET_SLOTS_LOCKED_MESSAGE = 'Questions of an exam with packed answer sheets cannot change once sessions exist.'
+
+
+def has_packed_answer_sheets(exam_ids):
+    return ExamUserMapping.objects.filter(exam_id__in=exam_ids, exam__packed_answer_sheets=True).exists()
+
+
+@receiver(pre_save, sender=ExamMultipleChoiceQuestionMapping)
+def exam_multiple_choice_question_mapping_pre_save(instance, raw=False, **kwargs):
+    if not raw and instance.changes_answer_sheet_slots():
+        raise ValidationError(ANSWER_SHEET_SLOTS_LOCKED_MESSAGE)
+
+
+@receiver(pre_delete, sender=ExamMultipleChoiceQuestionMapping)
+def exam_multiple_choice_question_mapping_pre_delete(instance, origin=None, **kwargs):
+    # Deleting the whole exam takes its sessions with it; deleting a question would still shift the slots.
+    origin_model = origin.model if isinstance(origin, models.QuerySet) else type(origin)
+    if issubclass(origin_model, Exam):
+        return
+    if has_packed_answer_sheets([instance.exam_id]):
+        raise ValidationError(ANSWER_SHEET_SLOTS_LOCKED_MESSAGE)
+
 
 class MultipleChoiceQuestion(ActiveModelMixin, models.Model):
     CHOICE_A = 1
@@ -147,18 +188,61 @@ class MultipleChoiceQuestion(ActiveModelMixin, models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
 
 
-class ExamUserMapping(ActiveModelMixin, HashModelMixin, models.Model):
+def invalidate_exam_content_on_commit(exam_ids):
+    from tests.exam_content import invalidate_exam_content
+
+    exam_ids = list(exam_ids)
+    transaction.on_commit(lambda: invalidate_exam_content(exam_ids))
+
+
+@receiver(post_save, sender=MultipleChoiceQuestion)
+@receiver(pre_delete, sender=MultipleChoiceQuestion)
+def multiple_choice_question_changed(instance, **kwargs):
+    invalidate_exam_content_on_commit(
+        ExamMultipleChoiceQuestionMapping.objects.filter(
+            multiple_choice_question_id=instance.id
+        ).values_list('exam_id', flat=True)
+    )
+
+
+@receiver(post_save, sender=Topic)
+def topic_changed(instance, **kwargs):
+    invalidate_exam_content_on_commit(
+        ExamMultipleChoiceQuestionMapping.objects.filter(
+            multiple_choice_question__topic_id=instance.id
+        ).values_list('exam_id', flat=True).distinct()
+    )
+
+
+@receiver(post_save, sender=ExamMultipleChoiceQuestionMapping)
+@receiver(post_delete, sender=ExamMultipleChoiceQuestionMapping)
+def exam_multiple_choice_question_mapping_changed(instance, **kwargs):
+    invalidate_exam_content_on_commit([instance.exam_id])
+
+
+class ExamUserMapping(ActiveModelMixin, HashModelMixin, TrackedFieldsModelMixin, models.Model):
     exam = models.ForeignKey(Exam, on_delete=models.CASCADE)
     user = models.ForeignKey(User, on_delete=models.CASCADE)
-    start_timestamp = models.DateTimeField(auto_now_add=True)
+    start_timestamp = models.DateTimeField(default=timezone.now)
     end_timestamp = models.DateTimeField(null=True, blank=True)
-    total_score = models.PositiveIntegerField(null=True, blank=True)
+    total_score = models.IntegerField(null=True, blank=True)
     overall_percentile = models.DecimalField(null=True, blank=True, max_digits = 5, decimal_places=2)
     overall_rank = models.PositiveIntegerField(null=True, blank=True)
     subject_scores = models.JSONField(default=dict)
     subject_percentiles = models.JSONField(default=dict)
     completed = models.BooleanField(default=False)
     completed_at = models.DateTimeField(null=True, blank=True)
+    state_version = models.PositiveIntegerField(default=0)
+    predicted_rank = models.PositiveIntegerField(null=True, blank=True)
+    predicted_percentile = models.DecimalField(null=True, blank=True, max_digits=5, decimal_places=2)
+    # False for sessions pre-provisioned from an ExamRegistration until the candidate starts the exam.
+    activated = models.BooleanField(default=True)
+    # Only for exams with packed_answer_sheets: the chosen option per question slot (0 when unanswered)
+    # and a bitmap of the attempted slots. Null when the answers are ExamUserMultipleChoiceQuestionMapping rows.
+    answer_sheet = models.BinaryField(null=True, blank=True)
+    answer_attempts = models.BinaryField(null=True, blank=True)
+
+    tracked_fields = ('completed',)
 
     class Meta:
         unique_together = ('exam', 'user')
@@ -169,6 +253,8 @@ class ExamUserMapping(ActiveModelMixin, HashModelMixin, models.Model):
             models.Index(fields=['exam', '-total_score']),
             models.Index(fields=['exam', 'overall_percentile']),
             models.Index(fields=['exam', 'overall_rank']),
+            # Prefix searches (LIKE 'abc%') in the admin; the unique index only serves them under the C collation.
+            models.Index(fields=['hash'], name='eum_hash_prefix_idx', opclasses=['varchar_pattern_ops']),
         ]
 
     def clean(self):
@@ -187,32 +273,65 @@ class ExamUserMapping(ActiveModelMixin, HashModelMixin, models.Model):
             raise ValidationError(errors)
 
 
-@receiver(pre_save, sender=ExamUserMapping)
-def exam_user_mapping_pre_save(instance, **kwargs):
-    exam_user_mapping = None
-    if instance.id:
-        try:
-            exam_user_mapping = ExamUserMapping.objects.get(pk=instance.pk)
-        except ExamUserMapping.DoesNotExist:
-            pass
-    else:
-        exam_user_mapping = None
-    instance.__old_instance = exam_user_mapping
-
-
 @receiver(post_save, sender=ExamUserMapping)
-def exam_user_mapping_post_save(instance=None, **kwargs):
+def exam_user_mapping_post_save(instance, created, **kwargs):
     from tests.utils import update_score_for_exam_user_mapping, create_exam_user_multiple_choice_question_mappings
 
-    old_instance = getattr(instance, '__old_instance', None)
-    if old_instance:
-        if not old_instance.completed and instance.completed:
-            update_score_for_exam_user_mapping(instance)
-    else:
+    if created:
         create_exam_user_multiple_choice_question_mappings(instance)
+    elif instance.completed and instance.has_tracked_field_changed('completed'):
+        update_score_for_exam_user_mapping(instance)
+
+
+@receiver(post_save, sender=ExamUserMapping)
+@receiver(post_delete, sender=ExamUserMapping)
+def exam_user_mapping_changed(instance, **kwargs):
+    from tests.resolvers import exam_user_mapping_resolver
+
+    exam_user_mapping_resolver.invalidate_on_commit([instance.hash])
+
+
+@receiver(exam_user_mappings_completed, sender=ExamUserMapping)
+def exam_user_mappings_bulk_completed(exam_user_mappings, **kwargs):
+    # Sessions force-completed in bulk are scored with the rest of the exam by the leaderboard task.
+    from tests.resolvers import exam_user_mapping_resolver
+
+    exam_user_mapping_resolver.invalidate_on_commit(exam_user_mappings.values())
+
+
+class ExamTopicRanking(models.Model):
+    exam = models.ForeignKey(Exam, related_name='exam_topic_rankings', on_delete=models.CASCADE)
+    topic = models.ForeignKey(Topic, related_name='exam_topic_rankings', on_delete=models.CASCADE)
+    exam_user_mapping = models.ForeignKey(ExamUserMapping, related_name='exam_topic_rankings', on_delete=models.CASCADE)
+    score = models.IntegerField()
+    rank = models.PositiveIntegerField()
+    percentile = models.DecimalField(max_digits=5, decimal_places=2)
+
+    class Meta:
+        unique_together = ('exam_user_mapping', 'topic')
+        indexes = [
+            models.Index(fields=['exam', 'topic', 'rank', 'exam_user_mapping']),
+        ]
+
+
+class ExamRegistration(models.Model):
+    exam = models.ForeignKey(Exam, related_name='exam_registrations', on_delete=models.CASCADE)
+    user = models.ForeignKey(User, related_name='exam_registrations', on_delete=models.CASCADE)
+    created_at = models.DateTimeField(auto_now_add=True)
+    provisioned_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        unique_together = ('exam', 'user')
+        indexes = [
+            models.Index(fields=['exam', 'provisioned_at']),
+        ]
 
 
 class ExamUserMultipleChoiceQuestionMapping(HashModelMixin, models.Model):
+    # Denormalised from exam_user_mapping: the partition key when the table is partitioned by exam
+    # (see tests.partitions), so every query on this table should filter on it.
+    exam = models.ForeignKey(Exam, related_name='exam_user_multiple_choice_question_mappings', on_delete=models.CASCADE,
+                             db_index=False)
     exam_user_mapping = models.ForeignKey(ExamUserMapping,related_name='exam_user_multiple_choice_question_mappings', on_delete=models.CASCADE)
     multiple_choice_question = models.ForeignKey(MultipleChoiceQuestion,related_name='exam_user_multiple_choice_question_mappings', on_delete=models.CASCADE)
     selected_choice = models.PositiveIntegerField(choices=MultipleChoiceQuestion.ANSWER_CHOICES, null=True, blank=True)
@@ -221,33 +340,48 @@ class ExamUserMultipleChoiceQuestionMapping(HashModelMixin, models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     completed_at = models.DateTimeField(null=True, blank=True)
     is_completed = models.BooleanField(default=False)
+    state_version = models.PositiveIntegerField(default=0)
 
     class Meta:
         unique_together = ('exam_user_mapping', 'multiple_choice_question')
         indexes = [
+            # Serves the per-exam queries while the table is not partitioned.
+            models.Index(fields=['exam', 'exam_user_mapping']),
             models.Index(fields=['exam_user_mapping', 'is_correct']),
-            models.Index(fields=['exam_user_mapping', 'is_completed'])
+            models.Index(fields=['exam_user_mapping', 'is_completed']),
+            models.Index(fields=['exam_user_mapping', 'state_version']),
+            models.Index(fields=['hash'], name='eumcqm_hash_prefix_idx', opclasses=['varchar_pattern_ops']),
         ]
 
-    def get_is_correct(self):
+    def get_is_correct(self, answer_key=None):
+        from tests.answer_keys import AnswerKey, get_answer_key, grade_answer
+
         if not self.selected_choice and not self.input_puzzle_answer:
             return None
-        if self.multiple_choice_question.question_type == MultipleChoiceQuestionType.MULTIPLE_CHOICE_QUESTION:
-            return self.selected_choice == self.multiple_choice_question.correct_choice
-        elif self.multiple_choice_question.question_type == MultipleChoiceQuestionType.PUZZLE_QUESTION:
-            return (
-                    (self.input_puzzle_answer or '').strip().lower() == (self.multiple_choice_question.correct_puzzle_answer or '').strip().lower()
-            )
-        return False
+        if answer_key is None:
+            answer_key = get_answer_key(self.exam_id or self.exam_user_mapping.exam_id)
+        entry = answer_key.get(self.multiple_choice_question_id)
+        if entry is None:
+            entry = AnswerKey.entry_for_question(self.multiple_choice_question)
+        return grade_answer(entry, self.selected_choice, self.input_puzzle_answer)
+
+
+@receiver(post_save, sender=ExamUserMultipleChoiceQuestionMapping)
+@receiver(post_delete, sender=ExamUserMultipleChoiceQuestionMapping)
+def exam_user_multiple_choice_question_mapping_changed(instance, **kwargs):
+    from tests.resolvers import exam_user_multiple_choice_question_mapping_resolver
+
+    exam_user_multiple_choice_question_mapping_resolver.invalidate_on_commit([instance.hash])
 
 
 class UserExamTypeProfile(HashModelMixin, models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE)
     exam_type = models.PositiveIntegerField(choices=ExamType.choices, default=ExamType.CAT)
     total_tests_taken = models.PositiveIntegerField(default=0)
+    total_tests_ranked = models.PositiveIntegerField(default=0)
     average_percentile = models.DecimalField(null=True, blank=True, max_digits=5, decimal_places=2)
     average_score = models.DecimalField(null=True, blank=True, max_digits=5, decimal_places=2)
-    highest_score = models.PositiveIntegerField(null=True, blank=True)
+    highest_score = models.IntegerField(null=True, blank=True)
 
     class Meta:
         unique_together = ('user', 'exam_type')
@@ -275,3 +409,20 @@ class PastExamStats(HashModelMixin, models.Model):
     rank_vs_percentile_json = models.JSONField(default=dict)
     rank_vs_score_json = models.JSONField(default=dict)
 
+
+@receiver(post_save, sender=PastExamStats)
+@receiver(post_delete, sender=PastExamStats)
+def past_exam_stats_changed(instance, **kwargs):
+    from tests.predictions import invalidate_past_exam_stats
+    from tests.tasks import predict_exam_results
+
+    exam_type, year = instance.exam_type, instance.year
+
+    def refresh_predictions():
+        invalidate_past_exam_stats(exam_type, year)
+        exam_ids = Exam.objects.filter(exam_type=exam_type, year=year + 1, completed=True).values_list('id', flat=True)
+        for exam_id in exam_ids:
+            predict_exam_results.delay(exam_id)
+
+    transaction.on_commit(refresh_predictions)
+
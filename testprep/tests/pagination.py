@@ -0,0 +1,155 @@
+import base64
+import binascii
+import json
+from collections import OrderedDict
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+from testprep.utils import estimate_queryset_count
+
+COUNT_EXACT = 'exact'
+COUNT_APPROXIMATE = 'approx'
+
+
+def encode_cursor(key, reverse=False):
+    payload = json.dumps({'k': list(key), 'r': int(reverse)}, default=str, separators=(',', ':'))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        return tuple(payload['k']), bool(payload['r'])
+    except (binascii.Error, ValueError, KeyError, TypeError):
+        return None
+
+
+def keyset_filter(ordering, key, reverse=False, inclusive=False):
+    # Rows strictly after `key` in `ordering` (or before it when reverse), written as the expanded
+    # row comparison so each branch can use the (exam, ...) indexes.
+    condition = Q()
+    equal = {}
+    for (field, descending), value in zip(ordering, key):
+        lookup = 'lt' if descending != reverse else 'gt'
+        condition |= Q(**equal, **{f'{field}__{lookup}': value})
+        equal[field] = value
+    if inclusive:
+        condition |= Q(**equal)
+    return condition
+
+
+def order_by_fields(ordering, reverse=False):
+    return [f'-{field}' if descending != reverse else field for field, descending in ordering]
+
+
+class LeaderboardCursorPagination(BasePagination):
+    # The view provides `get_cursor_ordering()`, a tuple of (field, descending) pairs that is unique
+    # per row, and `get_caller_cursor_key(queryset)` for `?around=me`.
+    page_size = 100
+    max_page_size = 500
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    count_query_param = 'count'
+    around_query_param = 'around'
+
+    def get_page_size(self, request):
+        try:
+            page_size = int(request.query_params.get(self.page_size_query_param, self.page_size))
+        except ValueError:
+            return self.page_size
+        return max(1, min(page_size, self.max_page_size))
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.base_url = request.build_absolute_uri()
+        self.ordering = view.get_cursor_ordering()
+        self.page_size = self.get_page_size(request)
+        self.count = self.get_count(queryset, request)
+
+        if request.query_params.get(self.around_query_param) == 'me':
+            return self.paginate_around(queryset, view.get_caller_cursor_key(queryset))
+
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            rows = list(queryset.order_by(*order_by_fields(self.ordering))[:self.page_size + 1])
+            self.has_previous = False
+            self.has_next = len(rows) > self.page_size
+            self.page = rows[:self.page_size]
+            return self.page
+
+        decoded = decode_cursor(cursor)
+        if decoded is None or len(decoded[0]) != len(self.ordering):
+            raise NotFound(detail="Invalid cursor.")
+        key, reverse = decoded
+
+        rows = list(
+            queryset.filter(keyset_filter(self.ordering, key, reverse=reverse))
+            .order_by(*order_by_fields(self.ordering, reverse=reverse))[:self.page_size + 1]
+        )
+        has_more = len(rows) > self.page_size
+        rows = rows[:self.page_size]
+        if reverse:
+            rows.reverse()
+            self.has_previous, self.has_next = has_more, True
+        else:
+            self.has_previous, self.has_next = True, has_more
+        self.page = rows
+        return self.page
+
+    def paginate_around(self, queryset, caller_key):
+        if caller_key is None:
+            raise NotFound(detail="You do not have a position on this leaderboard.")
+
+        preceding = list(
+            queryset.filter(keyset_filter(self.ordering, caller_key, reverse=True))
+            .order_by(*order_by_fields(self.ordering, reverse=True))[:self.page_size // 2]
+        )
+        start_key = self.get_key(preceding[-1]) if preceding else caller_key
+
+        rows = list(
+            queryset.filter(keyset_filter(self.ordering, start_key, inclusive=True))
+            .order_by(*order_by_fields(self.ordering))[:self.page_size + 1]
+        )
+        self.has_previous = len(preceding) == self.page_size // 2 and bool(preceding)
+        self.has_next = len(rows) > self.page_size
+        self.page = rows[:self.page_size]
+        return self.page
+
+    def get_count(self, queryset, request):
+        count = request.query_params.get(self.count_query_param)
+        if count == COUNT_EXACT:
+            return queryset.count()
+        if count == COUNT_APPROXIMATE:
+            return estimate_queryset_count(queryset)
+        return None
+
+    def get_key(self, row):
+        return tuple(getattr(row, field) for field, _ in self.ordering)
+
+    def get_link(self, key, reverse):
+        url = remove_query_param(self.base_url, self.around_query_param)
+        return replace_query_param(url, self.cursor_query_param, encode_cursor(key, reverse=reverse))
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.get_link(self.get_key(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.get_link(self.get_key(self.page[0]), reverse=True)
+
+    def get_paginated_response(self, data):
+        response = OrderedDict([
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+        ])
+        if self.count is not None:
+            response['count'] = self.count
+        response['results'] = data
+        return Response(response)
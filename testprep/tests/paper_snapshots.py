@@ -0,0 +1,134 @@
+import hashlib
+import json
+import pickle
+
+from django.conf import settings
+from rest_framework.fields import DateTimeField
+from rest_framework.renderers import JSONRenderer
+
+from testprep.instrumentation import serializer_data
+from testprep.utils import LRUCache, get_redis_client
+from tests.answer_keys import get_answer_key
+from tests.answer_sheets import get_answer_sheet_rows
+from tests.exam_content import get_exam_content_version
+from tests.models import MultipleChoiceQuestion
+from tests.serializers import (
+    ExamUserMappingStateSerializer,
+    MultipleChoiceQuestionFullSerializer,
+    MultipleChoiceQuestionWithoutAnswerSerializer,
+)
+
+_local_paper_snapshots = LRUCache(maxsize=settings.PAPER_SNAPSHOT_CACHE_SIZE)
+_datetime_field = DateTimeField()
+_json_renderer = JSONRenderer()
+
+OVERLAY_FIELDS = (
+    'hash',
+    'multiple_choice_question',
+    'selected_choice',
+    'input_puzzle_answer',
+    'created_at',
+    'completed_at',
+    'is_completed',
+)
+OVERLAY_FIELDS_WITH_ANSWERS = OVERLAY_FIELDS + ('is_correct',)
+
+
+def _dump(value):
+    return json.dumps(value, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+
+def _get_question_serializer_class(include_answers):
+    return MultipleChoiceQuestionFullSerializer if include_answers else MultipleChoiceQuestionWithoutAnswerSerializer
+
+
+def render_questions(multiple_choice_questions, include_answers, request=None):
+    serializer_class = _get_question_serializer_class(include_answers)
+    return {
+        multiple_choice_question.id: _json_renderer.render(
+            serializer_class(multiple_choice_question, context={'request': request}).data
+        )
+        for multiple_choice_question in multiple_choice_questions
+    }
+
+
+def build_paper_snapshot(exam_id, include_answers, request=None):
+    multiple_choice_questions = MultipleChoiceQuestion.objects.filter(
+        exam_multiple_choice_question_mappings__exam_id=exam_id
+    )
+    return render_questions(multiple_choice_questions, include_answers, request=request)
+
+
+def _get_cache_key(exam_id, version, include_answers, base_uri):
+    variant = 'revealed' if include_answers else 'hidden'
+    base_uri_digest = hashlib.sha1(base_uri.encode()).hexdigest()[:12]
+    return f'paper_snapshot:{exam_id}:{version}:{variant}:{base_uri_digest}'
+
+
+def get_paper_snapshot(exam_id, include_answers, request):
+    # Image fields render as absolute URIs, so snapshots are kept per scheme and host.
+    base_uri = request.build_absolute_uri('/')
+    version = get_exam_content_version(exam_id)
+    cache_key = _get_cache_key(exam_id, version, include_answers, base_uri)
+
+    paper_snapshot = _local_paper_snapshots.get(cache_key)
+    if paper_snapshot is not None:
+        return paper_snapshot
+
+    redis_client = get_redis_client()
+    payload = redis_client.get(cache_key)
+    if payload:
+        paper_snapshot = pickle.loads(payload)
+    else:
+        paper_snapshot = build_paper_snapshot(exam_id, include_answers, request=request)
+        redis_client.set(cache_key, pickle.dumps(paper_snapshot), ex=settings.PAPER_SNAPSHOT_CACHE_TIMEOUT)
+
+    _local_paper_snapshots.set(cache_key, paper_snapshot)
+    return paper_snapshot
+
+
+def render_overlay_row(row, question_payload, fields):
+    parts = []
+    for field in fields:
+        if field == 'multiple_choice_question':
+            value = question_payload
+        elif field in ('created_at', 'completed_at'):
+            value = _dump(_datetime_field.to_representation(row[field]) if row[field] else None)
+        else:
+            value = _dump(row[field])
+        parts.append(b'"' + field.encode() + b'":' + value)
+    return b'{' + b','.join(parts) + b'}'
+
+
+def render_exam_user_mapping_detail(exam_user_mapping, include_answers, request):
+    paper_snapshot = get_paper_snapshot(exam_user_mapping.exam_id, include_answers, request)
+    fields = OVERLAY_FIELDS_WITH_ANSWERS if include_answers else OVERLAY_FIELDS
+
+    if exam_user_mapping.answer_sheet is not None:
+        rows = get_answer_sheet_rows(exam_user_mapping, get_answer_key(exam_user_mapping.exam_id))
+    else:
+        rows = list(
+            exam_user_mapping.exam_user_multiple_choice_question_mappings.filter(
+                exam_id=exam_user_mapping.exam_id
+            ).order_by('id').values(
+                'multiple_choice_question_id', *(field for field in fields if field != 'multiple_choice_question')
+            )
+        )
+    missing_question_ids = {
+        row['multiple_choice_question_id'] for row in rows if row['multiple_choice_question_id'] not in paper_snapshot
+    }
+    if missing_question_ids:
+        paper_snapshot = {
+            **paper_snapshot,
+            **render_questions(
+                MultipleChoiceQuestion.objects.filter(id__in=missing_question_ids), include_answers, request=request
+            ),
+        }
+
+    header = _json_renderer.render(
+        serializer_data(ExamUserMappingStateSerializer(exam_user_mapping, context={'request': request}))
+    )
+    overlay = b','.join(
+        render_overlay_row(row, paper_snapshot[row['multiple_choice_question_id']], fields) for row in rows
+    )
+    return header[:-1] + b',"exam_user_multiple_choice_question_mappings":[' + overlay + b']}'
@@ -0,0 +1,228 @@
+import logging
+
+from django.conf import settings
+from django.db import connection, transaction
+
+from tests.models import Exam, ExamUserMultipleChoiceQuestionMapping
+
+logger = logging.getLogger(__name__)
+
+# ExamUserMultipleChoiceQuestionMapping can be stored as a Postgres table partitioned by LIST (exam_id),
+# one partition per exam plus a default partition for exams that have none yet. Every query on the
+# table filters on exam_id, so the planner prunes to a single partition and only that exam's indexes
+# need to be in memory. Postgres requires the partition key in every unique constraint, so the
+# primary key becomes (id, exam_id) and the uniques on hash and (exam_user_mapping,
+# multiple_choice_question) gain exam_id; ids stay globally unique through a shared sequence.
+
+ANSWER_TABLE = ExamUserMultipleChoiceQuestionMapping._meta.db_table
+
+
+def _quote(name):
+    return connection.ops.quote_name(name)
+
+
+def get_answer_partition_name(exam_id):
+    return f'{ANSWER_TABLE}_exam_{exam_id}'
+
+
+def get_default_answer_partition_name():
+    return f'{ANSWER_TABLE}_default'
+
+
+def _fetch_one(sql, params=()):
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        row = cursor.fetchone()
+    return row[0] if row else None
+
+
+def _execute(*statements):
+    with connection.cursor() as cursor:
+        for statement in statements:
+            cursor.execute(statement)
+
+
+def is_answer_table_partitioned():
+    if connection.vendor != 'postgresql':
+        return False
+    return _fetch_one('SELECT relkind FROM pg_class WHERE oid = to_regclass(%s)', [ANSWER_TABLE]) == 'p'
+
+
+def _get_table_schema(table):
+    # Attached and detached partitions live in the current schema, archived ones in the archive schema.
+    return _fetch_one(
+        'SELECT schemaname FROM pg_tables WHERE tablename = %s ORDER BY schemaname = current_schema() DESC LIMIT 1',
+        [table],
+    )
+
+
+def _is_attached(table):
+    return bool(_fetch_one(
+        'SELECT 1 FROM pg_inherits WHERE inhparent = to_regclass(%s) AND inhrelid = to_regclass(%s)',
+        [ANSWER_TABLE, table],
+    ))
+
+
+def _get_index_statements(table):
+    # The model's own indexes, created on the partitioned parent under the names Django gave them.
+    meta = ExamUserMultipleChoiceQuestionMapping._meta
+    statements = []
+    for index in meta.indexes:
+        if index.fields[0] == 'exam':
+            # Covered by the (exam_id, exam_user_mapping_id, multiple_choice_question_id) unique constraint.
+            continue
+        opclasses = list(index.opclasses) or [''] * len(index.fields)
+        columns = ', '.join(
+            f'{_quote(meta.get_field(field_name.lstrip("-")).column)} {opclass}'.strip()
+            for field_name, opclass in zip(index.fields, opclasses)
+        )
+        statements.append(f'CREATE INDEX {_quote(index.name)} ON {_quote(table)} ({columns})')
+    return statements
+
+
+def _get_foreign_key_statements(table):
+    meta = ExamUserMultipleChoiceQuestionMapping._meta
+    statements = []
+    for field_name in ('exam', 'exam_user_mapping', 'multiple_choice_question'):
+        field = meta.get_field(field_name)
+        statements.append(
+            f'ALTER TABLE {_quote(table)} ADD FOREIGN KEY ({_quote(field.column)}) '
+            f'REFERENCES {_quote(field.related_model._meta.db_table)} (id) DEFERRABLE INITIALLY DEFERRED'
+        )
+    return statements
+
+
+def convert_answer_table():
+    # One-off conversion of the plain table into the partitioned layout: the rows are copied into a
+    # partitioned table with a partition per existing exam and the old table is dropped, all in one
+    # transaction that holds an exclusive lock on the table. Run it in a maintenance window.
+    if connection.vendor != 'postgresql':
+        raise ValueError('Partitioned answer storage needs PostgreSQL.')
+    if is_answer_table_partitioned():
+        return False
+
+    legacy_table = f'{ANSWER_TABLE}_unpartitioned'
+    sequence = f'{ANSWER_TABLE}_partitioned_id_seq'
+    exam_ids = list(Exam.objects.order_by('id').values_list('id', flat=True))
+    with transaction.atomic():
+        _execute(
+            f'LOCK TABLE {_quote(ANSWER_TABLE)} IN ACCESS EXCLUSIVE MODE',
+            f'ALTER TABLE {_quote(ANSWER_TABLE)} RENAME TO {_quote(legacy_table)}',
+            f'CREATE TABLE {_quote(ANSWER_TABLE)} (LIKE {_quote(legacy_table)} INCLUDING DEFAULTS) '
+            f'PARTITION BY LIST (exam_id)',
+            f'CREATE SEQUENCE {_quote(sequence)} OWNED BY {_quote(ANSWER_TABLE)}.id',
+            f"SELECT setval('{sequence}', COALESCE((SELECT max(id) FROM {_quote(legacy_table)}), 0) + 1, false)",
+            f"ALTER TABLE {_quote(ANSWER_TABLE)} ALTER COLUMN id SET DEFAULT nextval('{sequence}')",
+            f'CREATE TABLE {_quote(get_default_answer_partition_name())} PARTITION OF {_quote(ANSWER_TABLE)} DEFAULT',
+        )
+        _execute(*(
+            f'CREATE TABLE {_quote(get_answer_partition_name(exam_id))} PARTITION OF {_quote(ANSWER_TABLE)} '
+            f'FOR VALUES IN ({int(exam_id)})'
+            for exam_id in exam_ids
+        ))
+        # Rows are copied before any index exists, which is far faster than maintaining them row by row.
+        _execute(
+            f'INSERT INTO {_quote(ANSWER_TABLE)} SELECT * FROM {_quote(legacy_table)}',
+            f'DROP TABLE {_quote(legacy_table)}',
+            f'ALTER TABLE {_quote(ANSWER_TABLE)} ADD PRIMARY KEY (id, exam_id)',
+            f'ALTER TABLE {_quote(ANSWER_TABLE)} ADD UNIQUE (exam_id, hash)',
+            f'ALTER TABLE {_quote(ANSWER_TABLE)} ADD UNIQUE (exam_id, exam_user_mapping_id, multiple_choice_question_id)',
+            *_get_index_statements(ANSWER_TABLE),
+            *_get_foreign_key_statements(ANSWER_TABLE),
+        )
+    _execute(f'ANALYZE {_quote(ANSWER_TABLE)}')
+    logger.info('Converted %s into a table partitioned by exam with %s partitions.', ANSWER_TABLE, len(exam_ids))
+    return True
+
+
+def create_answer_partition(exam_id):
+    # Rows the exam already has in the default partition are moved into the new partition, since
+    # Postgres refuses to attach a partition whose values the default partition still holds.
+    partition = get_answer_partition_name(exam_id)
+    if _get_table_schema(partition) is not None:
+        return attach_answer_partition(exam_id)
+
+    default_partition = get_default_answer_partition_name()
+    with transaction.atomic():
+        _execute(
+            f'CREATE TABLE {_quote(partition)} (LIKE {_quote(ANSWER_TABLE)} INCLUDING DEFAULTS)',
+            f'WITH moved AS (DELETE FROM {_quote(default_partition)} WHERE exam_id = {int(exam_id)} RETURNING *) '
+            f'INSERT INTO {_quote(partition)} SELECT * FROM moved',
+            f'ALTER TABLE {_quote(ANSWER_TABLE)} ATTACH PARTITION {_quote(partition)} FOR VALUES IN ({int(exam_id)})',
+        )
+    logger.info('Created answer partition %s.', partition)
+    return True
+
+
+def create_answer_partition_if_enabled(exam_id):
+    if settings.ANSWER_PARTITIONING_ENABLED and is_answer_table_partitioned():
+        return create_answer_partition(exam_id)
+    return False
+
+
+def attach_answer_partition(exam_id):
+    # Re-attaches a detached or archived partition; Postgres builds any index the partition lacks.
+    partition = get_answer_partition_name(exam_id)
+    schema = _get_table_schema(partition)
+    if schema is None:
+        return create_answer_partition(exam_id)
+    if _is_attached(partition):
+        return False
+
+    with transaction.atomic():
+        current_schema = _fetch_one('SELECT current_schema()')
+        if schema != current_schema:
+            _execute(f'ALTER TABLE {_quote(schema)}.{_quote(partition)} SET SCHEMA {_quote(current_schema)}')
+        _execute(
+            f'ALTER TABLE {_quote(ANSWER_TABLE)} ATTACH PARTITION {_quote(partition)} FOR VALUES IN ({int(exam_id)})'
+        )
+    logger.info('Attached answer partition %s.', partition)
+    return True
+
+
+def detach_answer_partition(exam_id):
+    # The exam's answers disappear from the application but stay in a plain table of the same name.
+    # DETACH ... CONCURRENTLY is not an option: Postgres refuses it while a default partition exists.
+    partition = get_answer_partition_name(exam_id)
+    if not _is_attached(partition):
+        return False
+    _execute(f'ALTER TABLE {_quote(ANSWER_TABLE)} DETACH PARTITION {_quote(partition)}')
+    logger.info('Detached answer partition %s.', partition)
+    return True
+
+
+def archive_answer_partition(exam_id, schema=None):
+    schema = schema or settings.ANSWER_PARTITION_ARCHIVE_SCHEMA
+    partition = get_answer_partition_name(exam_id)
+    if _get_table_schema(partition) is None:
+        return False
+    detach_answer_partition(exam_id)
+    with transaction.atomic():
+        _execute(
+            f'CREATE SCHEMA IF NOT EXISTS {_quote(schema)}',
+            f'ALTER TABLE {_quote(partition)} SET SCHEMA {_quote(schema)}',
+        )
+    logger.info('Archived answer partition %s to schema %s.', partition, schema)
+    return True
+
+
+def get_answer_partitions():
+    with connection.cursor() as cursor:
+        cursor.execute(
+            '''
+            SELECT pg_tables.schemaname, pg_tables.tablename, pg_class.reltuples::bigint,
+                   pg_total_relation_size(pg_class.oid), pg_inherits.inhparent IS NOT NULL
+            FROM pg_tables
+            JOIN pg_namespace ON pg_namespace.nspname = pg_tables.schemaname
+            JOIN pg_class ON pg_class.relname = pg_tables.tablename AND pg_class.relnamespace = pg_namespace.oid
+            LEFT JOIN pg_inherits ON pg_inherits.inhrelid = pg_class.oid
+                AND pg_inherits.inhparent = to_regclass(%s)
+            WHERE pg_tables.tablename LIKE %s
+            ORDER BY pg_tables.tablename
+            ''',
+            [ANSWER_TABLE, f'{ANSWER_TABLE}\\_%'],
+        )
+        return [
+            {'schema': schema, 'table': table, 'rows': max(rows, 0), 'bytes': size, 'attached': attached}
+            for schema, table, rows, size, attached in cursor.fetchall()
+        ]
@@ -0,0 +1,134 @@
+import logging
+
+import numpy as np
+from django.conf import settings
+
+from testprep.utils import LRUCache, get_redis_client
+from tests.models import PastExamStats
+
+logger = logging.getLogger(__name__)
+
+_local_predictions = LRUCache(maxsize=settings.PREDICTION_CACHE_SIZE)
+
+
+def _get_version_key(exam_type, year):
+    return f'past_exam_stats_version:{exam_type}:{year}'
+
+
+def get_past_exam_stats_version(exam_type, year):
+    return int(get_redis_client().get(_get_version_key(exam_type, year)) or 0)
+
+
+def invalidate_past_exam_stats(exam_type, year):
+    get_redis_client().incr(_get_version_key(exam_type, year))
+
+
+class PredictionCurve:
+    # A piecewise-linear curve over sorted points, extended past both ends with the slope of the
+    # outermost segment.
+
+    def __init__(self, x_points, y_points):
+        self.x_points = x_points
+        self.y_points = y_points
+        if len(x_points) > 1:
+            self.lower_slope = (y_points[1] - y_points[0]) / (x_points[1] - x_points[0])
+            self.upper_slope = (y_points[-1] - y_points[-2]) / (x_points[-1] - x_points[-2])
+        else:
+            self.lower_slope = self.upper_slope = 0.0
+
+    @classmethod
+    def from_points(cls, pairs, increasing, name=''):
+        points = []
+        for x, y in pairs:
+            try:
+                points.append((float(x), float(y)))
+            except (TypeError, ValueError):
+                continue
+        if not points:
+            return None
+
+        points = np.array(points, dtype=np.float64)
+        x_points, inverse = np.unique(points[:, 0], return_inverse=True)
+        y_points = np.bincount(inverse, weights=points[:, 1]) / np.bincount(inverse)
+
+        monotonic = np.maximum.accumulate(y_points) if increasing else np.minimum.accumulate(y_points)
+        violations = int(np.count_nonzero(monotonic != y_points))
+        if violations:
+            logger.warning('Prediction curve %s is not monotonic at %s points; flattening them', name, violations)
+        return cls(x_points, monotonic)
+
+    def __call__(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        result = np.interp(values, self.x_points, self.y_points)
+        below = values < self.x_points[0]
+        result[below] = self.y_points[0] + self.lower_slope * (values[below] - self.x_points[0])
+        above = values > self.x_points[-1]
+        result[above] = self.y_points[-1] + self.upper_slope * (values[above] - self.x_points[-1])
+        return result
+
+
+class CompiledPrediction:
+    def __init__(self, exam_type, year, percentile_curve, rank_curve, median_rank):
+        self.exam_type = exam_type
+        self.year = year
+        self.percentile_curve = percentile_curve
+        self.rank_curve = rank_curve
+        self.median_rank = median_rank
+
+    def predict_many(self, scores):
+        scores = np.asarray(scores, dtype=np.float64)
+        if self.percentile_curve is None:
+            percentiles = np.zeros(len(scores), dtype=np.float64)
+            ranks = np.full(len(scores), self.median_rank or 0, dtype=np.float64)
+        else:
+            percentiles = np.clip(self.percentile_curve(scores), 0, 100)
+            if self.rank_curve is not None:
+                ranks = self.rank_curve(percentiles)
+            else:
+                ranks = (100 - percentiles) * 100
+            ranks = np.maximum(ranks, 1)
+        return np.round(percentiles, 2), np.round(ranks).astype(np.int64)
+
+    def predict(self, score):
+        percentiles, ranks = self.predict_many([score])
+        return {
+            "predicted_percentile": float(percentiles[0]),
+            "predicted_rank": int(ranks[0]),
+        }
+
+
+def compile_prediction(past_exam_stats):
+    name = f'{past_exam_stats.exam_type}/{past_exam_stats.year}'
+    rank_vs_percentile = past_exam_stats.rank_vs_percentile_json or {}
+    # rank_vs_score_json maps score -> percentile; rank_vs_percentile_json maps rank -> percentile
+    # and is read the other way round, so ranks fall as percentiles rise.
+    percentile_curve = PredictionCurve.from_points(
+        (past_exam_stats.rank_vs_score_json or {}).items(), increasing=True, name=f'{name} score->percentile'
+    )
+    rank_curve = PredictionCurve.from_points(
+        ((percentile, rank) for rank, percentile in rank_vs_percentile.items()),
+        increasing=False,
+        name=f'{name} percentile->rank',
+    )
+
+    median_rank = None
+    ranks = sorted(int(float(rank)) for rank in rank_vs_percentile.keys())
+    if ranks:
+        median_rank = ranks[len(ranks) // 2]
+
+    return CompiledPrediction(past_exam_stats.exam_type, past_exam_stats.year, percentile_curve, rank_curve, median_rank)
+
+
+def get_compiled_prediction(exam_type, year):
+    version = get_past_exam_stats_version(exam_type, year)
+    cache_key = (exam_type, year, version)
+
+    compiled_prediction = _local_predictions.get(cache_key)
+    if compiled_prediction is not None:
+        return compiled_prediction or None
+
+    past_exam_stats = PastExamStats.objects.filter(exam_type=exam_type, year=year).first()
+    compiled_prediction = compile_prediction(past_exam_stats) if past_exam_stats else None
+    # A missing year is cached as False so that exams without history do not query on every call.
+    _local_predictions.set(cache_key, compiled_prediction or False)
+    return compiled_prediction
@@ -0,0 +1,148 @@
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import models, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from testprep.utils import generate_random_uuid
+from tests.models import UserExamTypeProfile, UserTopicPerformanceProfile
+
+PROFILE_BATCH_SIZE = 1000
+
+
+def _case_by_pk(values_by_pk, output_field):
+    return Case(
+        *[When(pk=pk, then=Value(value, output_field=output_field)) for pk, value in values_by_pk.items()],
+        default=Value(0, output_field=output_field),
+        output_field=output_field,
+    )
+
+
+class PerformanceProfileAccumulator:
+    # Collects per-(user, topic) and per-(user, exam_type) deltas and applies them as increments
+    # computed by the database, so concurrent writers never overwrite each other.
+
+    def __init__(self, batch_size=PROFILE_BATCH_SIZE):
+        self.batch_size = batch_size
+        self.topic_deltas = defaultdict(lambda: {'attempted': 0, 'correct': 0})
+        self.exam_type_deltas = defaultdict(lambda: {'tests': 0, 'score_sum': 0, 'highest_score': None})
+        self.percentile_deltas = defaultdict(lambda: {'tests': 0, 'percentile_sum': Decimal(0)})
+
+    def __len__(self):
+        return len(self.topic_deltas) + len(self.exam_type_deltas) + len(self.percentile_deltas)
+
+    def add_session(self, user_id, exam_type, total_score, topic_counts):
+        for topic_id, counts in topic_counts.items():
+            if topic_id is None:
+                continue
+            topic_delta = self.topic_deltas[(user_id, topic_id)]
+            topic_delta['attempted'] += counts['correct'] + counts['incorrect']
+            topic_delta['correct'] += counts['correct']
+
+        exam_type_delta = self.exam_type_deltas[(user_id, exam_type)]
+        exam_type_delta['tests'] += 1
+        exam_type_delta['score_sum'] += total_score
+        if exam_type_delta['highest_score'] is None or total_score > exam_type_delta['highest_score']:
+            exam_type_delta['highest_score'] = total_score
+
+        self._apply_if_full()
+
+    def add_percentile(self, user_id, exam_type, percentile):
+        if percentile is None:
+            return
+        percentile_delta = self.percentile_deltas[(user_id, exam_type)]
+        percentile_delta['tests'] += 1
+        percentile_delta['percentile_sum'] += Decimal(str(percentile))
+
+        self._apply_if_full()
+
+    def _apply_if_full(self):
+        if len(self) >= self.batch_size:
+            self.apply()
+
+    def apply(self):
+        with transaction.atomic():
+            self._apply_topic_deltas()
+            self._apply_exam_type_deltas()
+            self._apply_percentile_deltas()
+
+        self.topic_deltas.clear()
+        self.exam_type_deltas.clear()
+        self.percentile_deltas.clear()
+
+    def _get_profile_ids(self, model, key_field, keys):
+        model.objects.bulk_create(
+            [model(hash=generate_random_uuid(), user_id=user_id, **{key_field: key}) for user_id, key in keys],
+            ignore_conflicts=True,
+        )
+        rows = model.objects.filter(
+            user_id__in={user_id for user_id, _ in keys},
+            **{f'{key_field}__in': {key for _, key in keys}},
+        ).values_list('id', 'user_id', key_field)
+        return {(user_id, key): profile_id for profile_id, user_id, key in rows}
+
+    def _apply_topic_deltas(self):
+        if not self.topic_deltas:
+            return
+        profile_ids = self._get_profile_ids(UserTopicPerformanceProfile, 'topic_id', list(self.topic_deltas))
+        attempted = {}
+        correct = {}
+        for key, delta in self.topic_deltas.items():
+            attempted[profile_ids[key]] = delta['attempted']
+            correct[profile_ids[key]] = delta['correct']
+
+        integer_field = models.IntegerField()
+        UserTopicPerformanceProfile.objects.filter(pk__in=attempted.keys()).update(
+            total_questions_attempted=Coalesce(F('total_questions_attempted'), 0) + _case_by_pk(attempted, integer_field),
+            correct_answers=Coalesce(F('correct_answers'), 0) + _case_by_pk(correct, integer_field),
+        )
+
+    def _apply_exam_type_deltas(self):
+        if not self.exam_type_deltas:
+            return
+        profile_ids = self._get_profile_ids(UserExamTypeProfile, 'exam_type', list(self.exam_type_deltas))
+        tests = {}
+        score_sums = {}
+        highest_scores = {}
+        for key, delta in self.exam_type_deltas.items():
+            tests[profile_ids[key]] = delta['tests']
+            score_sums[profile_ids[key]] = delta['score_sum']
+            highest_scores[profile_ids[key]] = delta['highest_score']
+
+        integer_field = models.IntegerField()
+        decimal_field = UserExamTypeProfile._meta.get_field('average_score')
+        tests_delta = _case_by_pk(tests, integer_field)
+        highest_score = _case_by_pk(highest_scores, integer_field)
+        UserExamTypeProfile.objects.filter(pk__in=tests.keys()).update(
+            total_tests_taken=F('total_tests_taken') + tests_delta,
+            average_score=models.ExpressionWrapper(
+                (Coalesce(F('average_score'), Value(Decimal(0))) * F('total_tests_taken')
+                 + _case_by_pk(score_sums, integer_field))
+                / (F('total_tests_taken') + tests_delta),
+                output_field=decimal_field,
+            ),
+            highest_score=Greatest(Coalesce(F('highest_score'), highest_score), highest_score),
+        )
+
+    def _apply_percentile_deltas(self):
+        if not self.percentile_deltas:
+            return
+        profile_ids = self._get_profile_ids(UserExamTypeProfile, 'exam_type', list(self.percentile_deltas))
+        tests = {}
+        percentile_sums = {}
+        for key, delta in self.percentile_deltas.items():
+            tests[profile_ids[key]] = delta['tests']
+            percentile_sums[profile_ids[key]] = delta['percentile_sum']
+
+        integer_field = models.IntegerField()
+        tests_delta = _case_by_pk(tests, integer_field)
+        UserExamTypeProfile.objects.filter(pk__in=tests.keys()).update(
+            total_tests_ranked=F('total_tests_ranked') + tests_delta,
+            average_percentile=models.ExpressionWrapper(
+                (Coalesce(F('average_percentile'), Value(Decimal(0))) * F('total_tests_ranked')
+                 + _case_by_pk(percentile_sums, models.DecimalField()))
+                / (F('total_tests_ranked') + tests_delta),
+                output_field=UserExamTypeProfile._meta.get_field('average_percentile'),
+            ),
+        )
@@ -0,0 +1,151 @@
+import json
+from collections import namedtuple
+
+from django.conf import settings
+from django.db import models, transaction
+from django.utils.dateparse import parse_datetime
+from django.utils.functional import SimpleLazyObject
+
+from testprep.utils import LRUCache, get_async_redis_client, get_redis_client
+from tests.models import Exam, ExamUserMapping, ExamUserMultipleChoiceQuestionMapping
+
+
+class HashResolver:
+    # Maps a public hash to the handful of columns the views need to authorize and route a request,
+    # through an in-process TTL cache and then Redis. Saves clear both tiers in this process and in
+    # Redis; other processes pick the change up when their local entry expires.
+
+    def __init__(self, name, model, fields):
+        self.name = name
+        self.model = model
+        self.lookups = [lookup for _, lookup in fields]
+        self.ref_class = namedtuple(f'{model.__name__}Ref', [attribute for attribute, _ in fields])
+        self.datetime_attributes = {
+            attribute for attribute, lookup in fields
+            if isinstance(self._get_field(lookup), models.DateTimeField)
+        }
+        self._local_refs = LRUCache(maxsize=settings.RESOLVER_CACHE_SIZE, ttl=settings.RESOLVER_LOCAL_TTL)
+
+    def _get_field(self, lookup):
+        model = self.model
+        *relations, field_name = lookup.split('__')
+        for relation in relations:
+            model = model._meta.get_field(relation).related_model
+        return model._meta.get_field(field_name)
+
+    def _get_cache_key(self, hash):
+        return f'resolver:{self.name}:{hash}'
+
+    def _dump(self, ref):
+        return json.dumps([
+            value.isoformat() if attribute in self.datetime_attributes and value else value
+            for attribute, value in zip(ref._fields, ref)
+        ])
+
+    def _load(self, payload):
+        values = json.loads(payload)
+        if len(values) != len(self.ref_class._fields):
+            # Written before the resolver's fields changed; read through to the database instead.
+            return None
+        return self.ref_class(*(
+            parse_datetime(value) if attribute in self.datetime_attributes and value else value
+            for attribute, value in zip(self.ref_class._fields, values)
+        ))
+
+    def resolve(self, hash):
+        if not hash:
+            return None
+
+        ref = self._local_refs.get(hash)
+        if ref is not None:
+            return ref
+
+        redis_client = get_redis_client()
+        payload = redis_client.get(self._get_cache_key(hash))
+        ref = self._load(payload) if payload else None
+        if ref is None:
+            row = self.model.objects.filter(hash=hash).values_list(*self.lookups).first()
+            if row is None:
+                return None
+            ref = self.ref_class(*row)
+            redis_client.set(self._get_cache_key(hash), self._dump(ref), ex=settings.RESOLVER_CACHE_TIMEOUT)
+
+        self._local_refs.set(hash, ref)
+        return ref
+
+    async def aresolve(self, hash):
+        if not hash:
+            return None
+
+        ref = self._local_refs.get(hash)
+        if ref is not None:
+            return ref
+
+        redis_client = get_async_redis_client()
+        payload = await redis_client.get(self._get_cache_key(hash))
+        ref = self._load(payload) if payload else None
+        if ref is None:
+            row = await self.model.objects.filter(hash=hash).values_list(*self.lookups).afirst()
+            if row is None:
+                return None
+            ref = self.ref_class(*row)
+            await redis_client.set(self._get_cache_key(hash), self._dump(ref), ex=settings.RESOLVER_CACHE_TIMEOUT)
+
+        self._local_refs.set(hash, ref)
+        return ref
+
+    def invalidate(self, hashes):
+        hashes = [hash for hash in hashes if hash]
+        if not hashes:
+            return
+        for hash in hashes:
+            self._local_refs.delete(hash)
+        get_redis_client().delete(*(self._get_cache_key(hash) for hash in hashes))
+
+    def invalidate_on_commit(self, hashes):
+        hashes = list(hashes)
+        transaction.on_commit(lambda: self.invalidate(hashes))
+
+
+exam_resolver = HashResolver('exam', Exam, [
+    ('id', 'id'),
+    ('hash', 'hash'),
+    ('title', 'title'),
+    ('exam_type', 'exam_type'),
+    ('year', 'year'),
+    ('duration', 'duration'),
+    ('start_timestamp', 'start_timestamp'),
+    ('end_timestamp', 'end_timestamp'),
+    ('completed', 'completed'),
+])
+
+exam_user_mapping_resolver = HashResolver('exam_user_mapping', ExamUserMapping, [
+    ('id', 'id'),
+    ('hash', 'hash'),
+    ('exam_id', 'exam_id'),
+    ('user_id', 'user_id'),
+    ('end_timestamp', 'end_timestamp'),
+    ('completed', 'completed'),
+    ('activated', 'activated'),
+])
+
+exam_user_multiple_choice_question_mapping_resolver = HashResolver(
+    'exam_user_multiple_choice_question_mapping',
+    ExamUserMultipleChoiceQuestionMapping,
+    [
+        ('id', 'id'),
+        ('hash', 'hash'),
+        ('exam_user_mapping_id', 'exam_user_mapping_id'),
+        ('exam_user_mapping_hash', 'exam_user_mapping__hash'),
+        ('multiple_choice_question_id', 'multiple_choice_question_id'),
+        ('input_puzzle_answer', 'input_puzzle_answer'),
+        ('exam_id', 'exam_id'),
+    ],
+)
+
+
+def lazy_instance(model, ref):
+    # The full row is only fetched if a view actually touches it.
+    if ref is None:
+        return None
+    return SimpleLazyObject(lambda: model.objects.get(id=ref.id))
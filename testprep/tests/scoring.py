@@ -0,0 +1,157 @@
+from collections import defaultdict
+from itertools import islice
+
+from django.db.models import Count, Q
+
+from tests.answer_keys import get_answer_key, grade_answer
+from tests.enums import ExamType, MultipleChoiceQuestionType
+from tests.models import Exam, ExamUserMapping, ExamUserMultipleChoiceQuestionMapping, Topic
+
+SCORING_BATCH_SIZE = 5000
+
+
+def calculate_scores(exam_type, topic_counts, topic_titles):
+    correct_answer_multiplier = ExamType.get_marks_per_correct(exam_type)
+    incorrect_answer_multiplier = ExamType.get_negative_marks_per_wrong(exam_type)
+
+    total_score = 0
+    subject_scores = {}
+    for topic_id, counts in topic_counts.items():
+        score = counts['correct'] * correct_answer_multiplier - counts['incorrect'] * incorrect_answer_multiplier
+        total_score += score
+        if topic_id is not None:
+            subject_scores[topic_titles[topic_id]] = score
+    return total_score, subject_scores
+
+
+def add_missing_topic_titles(topic_titles, topic_counts):
+    missing_topic_ids = [
+        topic_id for topic_id in topic_counts if topic_id is not None and topic_id not in topic_titles
+    ]
+    if missing_topic_ids:
+        topic_titles.update(Topic.objects.filter(id__in=missing_topic_ids).values_list('id', 'title'))
+
+
+def regrade_answers(exam_id, exam_user_multiple_choice_question_mappings, answer_key):
+    # is_correct is stored when an answer is submitted; corrections to the answer key made since then
+    # are applied here so the aggregate below grades like update_score_for_exam_user_mapping does.
+    # Only rows whose stored grade differs are written, so this is two UPDATEs that usually match nothing.
+    question_ids_by_correct_choice = defaultdict(list)
+    puzzle_question_ids = []
+    for multiple_choice_question_id, entry in answer_key.questions.items():
+        if entry.question_type == MultipleChoiceQuestionType.MULTIPLE_CHOICE_QUESTION:
+            question_ids_by_correct_choice[entry.correct_choice].append(multiple_choice_question_id)
+        elif entry.question_type == MultipleChoiceQuestionType.PUZZLE_QUESTION:
+            puzzle_question_ids.append(multiple_choice_question_id)
+
+    correct = Q(pk__in=[])
+    incorrect = Q(pk__in=[])
+    for correct_choice, question_ids in question_ids_by_correct_choice.items():
+        if correct_choice is None:
+            incorrect |= Q(multiple_choice_question_id__in=question_ids)
+            continue
+        correct |= Q(multiple_choice_question_id__in=question_ids, selected_choice=correct_choice)
+        incorrect |= Q(multiple_choice_question_id__in=question_ids) & ~Q(selected_choice=correct_choice)
+    answered_multiple_choice_question_mappings = exam_user_multiple_choice_question_mappings.filter(
+        selected_choice__isnull=False,
+    )
+    regraded = answered_multiple_choice_question_mappings.filter(correct).exclude(is_correct=True).update(
+        is_correct=True
+    )
+    regraded += answered_multiple_choice_question_mappings.filter(incorrect).exclude(is_correct=False).update(
+        is_correct=False
+    )
+
+    # Puzzle answers are normalised in Python, so they are graded row by row.
+    if puzzle_question_ids:
+        changed = []
+        puzzle_answers = exam_user_multiple_choice_question_mappings.filter(
+            multiple_choice_question_id__in=puzzle_question_ids,
+        ).values_list('id', 'multiple_choice_question_id', 'selected_choice', 'input_puzzle_answer', 'is_correct')
+        for exam_user_multiple_choice_question_mapping_id, multiple_choice_question_id, selected_choice, \
+                input_puzzle_answer, is_correct in puzzle_answers.iterator(chunk_size=SCORING_BATCH_SIZE):
+            graded = grade_answer(answer_key.get(multiple_choice_question_id), selected_choice, input_puzzle_answer)
+            if graded != is_correct:
+                changed.append(ExamUserMultipleChoiceQuestionMapping(
+                    id=exam_user_multiple_choice_question_mapping_id, is_correct=graded
+                ))
+        ExamUserMultipleChoiceQuestionMapping.objects.filter(exam_id=exam_id).bulk_update(
+            changed, ['is_correct'], batch_size=SCORING_BATCH_SIZE
+        )
+        regraded += len(changed)
+    return regraded
+
+
+def score_exam(exam_id, exam_user_mapping_ids=None, on_scored=None, batch_size=SCORING_BATCH_SIZE, id_range=None):
+    exam = Exam.objects.only('id', 'exam_type').get(id=exam_id)
+    answer_key = get_answer_key(exam_id)
+    topic_titles = dict(answer_key.topic_titles)
+
+    exam_user_mappings = ExamUserMapping.objects.filter(exam_id=exam_id, completed=True)
+    exam_user_multiple_choice_question_mappings = ExamUserMultipleChoiceQuestionMapping.objects.filter(
+        exam_id=exam_id,
+        exam_user_mapping__completed=True,
+        is_completed=True,
+    )
+    if exam_user_mapping_ids is not None:
+        exam_user_mappings = exam_user_mappings.filter(id__in=exam_user_mapping_ids)
+        exam_user_multiple_choice_question_mappings = exam_user_multiple_choice_question_mappings.filter(
+            exam_user_mapping_id__in=exam_user_mapping_ids
+        )
+    if id_range is not None:
+        exam_user_mappings = exam_user_mappings.filter(id__range=id_range)
+        exam_user_multiple_choice_question_mappings = exam_user_multiple_choice_question_mappings.filter(
+            exam_user_mapping_id__gte=id_range[0],
+            exam_user_mapping_id__lte=id_range[1],
+        )
+
+    regrade_answers(exam_id, exam_user_multiple_choice_question_mappings, answer_key)
+
+    topic_count_rows = exam_user_multiple_choice_question_mappings.values_list(
+        'exam_user_mapping_id', 'multiple_choice_question__topic_id'
+    ).annotate(
+        correct=Count('id', filter=Q(is_correct=True)),
+        incorrect=Count('id', filter=Q(is_correct=False)),
+    ).order_by('exam_user_mapping_id').iterator(chunk_size=batch_size)
+    pending_row = next(topic_count_rows, None)
+
+    scored = 0
+    sessions = exam_user_mappings.order_by('id').values_list(
+        'id', 'user_id', 'answer_sheet', 'answer_attempts'
+    ).iterator(chunk_size=batch_size)
+    for session_batch in iter(lambda: list(islice(sessions, batch_size)), []):
+        # Packed answer sheets of the batch are graded together in one NumPy pass.
+        packed_sessions = [session for session in session_batch if session[2] is not None]
+        packed_topic_counts = {}
+        if packed_sessions:
+            packed_topic_counts = dict(zip(
+                (exam_user_mapping_id for exam_user_mapping_id, _, _, _ in packed_sessions),
+                answer_key.answer_sheet_grader.get_topic_counts(
+                    [answer_sheet for _, _, answer_sheet, _ in packed_sessions],
+                    [answer_attempts for _, _, _, answer_attempts in packed_sessions],
+                ),
+            ))
+
+        scored_exam_user_mappings = []
+        for exam_user_mapping_id, user_id, _, _ in session_batch:
+            topic_counts = packed_topic_counts.get(exam_user_mapping_id, {})
+            while pending_row is not None and pending_row[0] <= exam_user_mapping_id:
+                if pending_row[0] == exam_user_mapping_id:
+                    _, topic_id, correct, incorrect = pending_row
+                    topic_counts[topic_id] = {'correct': correct, 'incorrect': incorrect}
+                pending_row = next(topic_count_rows, None)
+
+            add_missing_topic_titles(topic_titles, topic_counts)
+            total_score, subject_scores = calculate_scores(exam.exam_type, topic_counts, topic_titles)
+            scored_exam_user_mappings.append(ExamUserMapping(
+                id=exam_user_mapping_id,
+                total_score=total_score,
+                subject_scores=subject_scores,
+            ))
+            if on_scored:
+                on_scored(exam_user_mapping_id, user_id, total_score, topic_counts)
+
+        ExamUserMapping.objects.bulk_update(scored_exam_user_mappings, ['total_score', 'subject_scores'])
+        scored += len(scored_exam_user_mappings)
+
+    return scored
@@ -73,9 +73,9 @@ class ExamUserMappingFullSerializer(serializers.ModelSerializer):
         )
 
     def get_exam_user_multiple_choice_question_mappings(self, obj):
-        exam_user_multiple_choice_question_mappings = obj.exam_user_multiple_choice_question_mappings.select_related(
-            'multiple_choice_question'
-        ).all()
+        exam_user_multiple_choice_question_mappings = obj.exam_user_multiple_choice_question_mappings.filter(
+            exam_id=obj.exam_id
+        ).select_related('multiple_choice_question')
         include_answers = self.context.get(
             'include_answers',bool(obj.completed)
         )
@@ -87,6 +87,16 @@ class ExamUserMappingFullSerializer(serializers.ModelSerializer):
         )
         return serializer.data
 
+class ExamUserMappingStateSerializer(ExamUserMappingFullSerializer):
+
+    class Meta:
+        model = ExamUserMapping
+        fields = (
+            'user', 'exam','hash', 'start_timestamp', 'end_timestamp', 'total_score', 'overall_percentile','overall_rank',
+            'subject_scores','subject_percentiles','completed', 'state_version',
+        )
+
+
 class ExamUserMappingMinimumSerializer(ExamUserMappingFullSerializer):
 
     class Meta:
@@ -110,12 +120,16 @@ class ExamLeaderboardSerializer(ExamUserMappingFullSerializer):
         topic = self.context.get("topic")
         if not topic:
             return None
+        if hasattr(obj, 'topic_score'):
+            return obj.topic_score
         return obj.subject_scores.get(topic.title, None)
 
     def get_subject_percentile(self, obj):
         topic = self.context.get("topic")
         if not topic:
             return None
+        if hasattr(obj, 'topic_percentile'):
+            return float(obj.topic_percentile)
         return obj.subject_percentiles.get(topic.title, None)
 
     def get_subject_rank(self, obj):
@@ -0,0 +1,75 @@
+from django.db.models import F, OuterRef, Subquery
+
+from tests.answer_keys import get_answer_key
+from tests.answer_sheets import get_answer_sheet_rows
+from tests.exam_content import aget_exam_content_version, get_exam_content_version
+from tests.models import ExamUserMapping, ExamUserMultipleChoiceQuestionMapping
+from tests.paper_snapshots import OVERLAY_FIELDS, OVERLAY_FIELDS_WITH_ANSWERS, render_overlay_row
+
+
+def bump_session_state_versions(exam_user_mapping_ids, exam_user_multiple_choice_question_mapping_ids=(),
+                                exam_id=None):
+    # Must run in the same transaction as the change it records, so that readers never see
+    # a new version without the rows that carry it.
+    ExamUserMapping.objects.filter(id__in=exam_user_mapping_ids).update(state_version=F('state_version') + 1)
+    if exam_user_multiple_choice_question_mapping_ids:
+        ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam_id=exam_id,
+            id__in=exam_user_multiple_choice_question_mapping_ids,
+        ).update(
+            state_version=Subquery(
+                ExamUserMapping.objects.filter(id=OuterRef('exam_user_mapping_id')).values('state_version')[:1]
+            )
+        )
+
+
+def bump_exam_state_versions(exam_id):
+    ExamUserMapping.objects.filter(exam_id=exam_id).update(state_version=F('state_version') + 1)
+
+
+def build_session_etag(exam_user_mapping, content_version, since=None):
+    # A ?since delta is a different representation from the full body, so it gets its own tag.
+    etag = f'{exam_user_mapping.hash}-{exam_user_mapping.state_version}-{content_version}'
+    if since is not None:
+        etag = f'{etag}-s{since}'
+    return f'"{etag}"'
+
+
+def get_session_etag(exam_user_mapping, since=None):
+    return build_session_etag(exam_user_mapping, get_exam_content_version(exam_user_mapping.exam_id), since)
+
+
+async def aget_session_etag(exam_user_mapping, since=None):
+    return build_session_etag(exam_user_mapping, await aget_exam_content_version(exam_user_mapping.exam_id), since)
+
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == '*':
+        return True
+    return etag in (candidate.strip() for candidate in if_none_match.split(','))
+
+
+def render_session_changes(exam_user_mapping, since, include_answers):
+    fields = [
+        field for field in (OVERLAY_FIELDS_WITH_ANSWERS if include_answers else OVERLAY_FIELDS)
+        if field != 'multiple_choice_question'
+    ]
+    if exam_user_mapping.answer_sheet is not None:
+        # Slots carry no versions of their own: a packed session sends its whole sheet once anything changed.
+        rows = []
+        if exam_user_mapping.state_version > since:
+            rows = get_answer_sheet_rows(exam_user_mapping, get_answer_key(exam_user_mapping.exam_id))
+    else:
+        rows = exam_user_mapping.exam_user_multiple_choice_question_mappings.filter(
+            exam_id=exam_user_mapping.exam_id, state_version__gt=since
+        ).order_by('id').values(*fields)
+
+    changes = b','.join(render_overlay_row(row, None, fields) for row in rows)
+    header = (
+        b'{"hash":"' + exam_user_mapping.hash.encode() + b'"'
+        + b',"state_version":' + str(exam_user_mapping.state_version).encode()
+        + b',"completed":' + (b'true' if exam_user_mapping.completed else b'false')
+    )
+    return header + b',"exam_user_multiple_choice_question_mappings":[' + changes + b']}'
@@ -0,0 +1,10 @@
+from django.dispatch import Signal
+
+# Bulk writes (QuerySet.update, bulk_create) skip the model save signals, so the code doing them sends
+# these batch hooks once per batch instead.
+
+# sender=ExamUserMapping, exam_id, exam_user_mappings: {id: hash} of the sessions marked completed.
+exam_user_mappings_completed = Signal()
+
+# sender=ExamUserMultipleChoiceQuestionMapping, instances: the rows just bulk-created.
+exam_user_multiple_choice_question_mappings_created = Signal()
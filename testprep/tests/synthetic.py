@@ -0,0 +1,243 @@
+import math
+import time
+from datetime import timedelta
+
+import numpy as np
+from django.contrib.auth.models import User
+from django.db import transaction
+from django.utils import timezone
+
+from testprep.utils import generate_random_uuid
+from tests.enums import ExamType, MultipleChoiceQuestionType
+from tests.models import Exam, ExamMultipleChoiceQuestionMapping, ExamTopicMapping, ExamUserMapping, \
+    ExamUserMultipleChoiceQuestionMapping, MultipleChoiceQuestion, PastExamStats, Topic
+from tests.partitions import create_answer_partition_if_enabled
+
+SYNTHETIC_BATCH_SIZE = 2000
+
+SYNTHETIC_EXAM_OPEN = 'open'
+SYNTHETIC_EXAM_FINISHED = 'finished'
+
+
+def get_synthetic_topics(topics):
+    return [
+        Topic.objects.get_or_create(title=f'Synthetic topic {index + 1}')[0]
+        for index in range(topics)
+    ]
+
+
+def create_synthetic_questions(exam, topics, questions, puzzle_ratio, rng):
+    is_puzzle = rng.random(questions) < puzzle_ratio
+    correct_choices = rng.integers(1, 5, size=questions)
+    multiple_choice_questions = MultipleChoiceQuestion.objects.bulk_create(
+        [
+            MultipleChoiceQuestion(
+                hash=generate_random_uuid()[:15],
+                question_text=f'Synthetic question {index + 1}',
+                question_type=(
+                    MultipleChoiceQuestionType.PUZZLE_QUESTION if is_puzzle[index]
+                    else MultipleChoiceQuestionType.MULTIPLE_CHOICE_QUESTION
+                ),
+                choice_A_text='A',
+                choice_B_text='B',
+                choice_C_text='C',
+                choice_D_text='D',
+                correct_choice=None if is_puzzle[index] else int(correct_choices[index]),
+                correct_puzzle_answer=str(index + 1) if is_puzzle[index] else None,
+                topic=topics[index % len(topics)],
+            )
+            for index in range(questions)
+        ],
+        batch_size=SYNTHETIC_BATCH_SIZE,
+    )
+    ExamMultipleChoiceQuestionMapping.objects.bulk_create(
+        [
+            ExamMultipleChoiceQuestionMapping(exam=exam, multiple_choice_question=multiple_choice_question)
+            for multiple_choice_question in multiple_choice_questions
+        ],
+        batch_size=SYNTHETIC_BATCH_SIZE,
+    )
+    return multiple_choice_questions
+
+
+def create_synthetic_users(prefix, users):
+    return User.objects.bulk_create(
+        [User(username=f'{prefix}-{index + 1}', password='!') for index in range(users)],
+        batch_size=SYNTHETIC_BATCH_SIZE,
+    )
+
+
+def build_synthetic_answers(exam_user_mapping, multiple_choice_questions, ability, answer_rate, rng, now):
+    answered = rng.random(len(multiple_choice_questions)) < answer_rate
+    correct = rng.random(len(multiple_choice_questions)) < ability
+    rows = []
+    for index, multiple_choice_question in enumerate(multiple_choice_questions):
+        row = ExamUserMultipleChoiceQuestionMapping(
+            hash=generate_random_uuid(),
+            exam_id=exam_user_mapping.exam_id,
+            exam_user_mapping_id=exam_user_mapping.id,
+            multiple_choice_question_id=multiple_choice_question.id,
+        )
+        if answered[index]:
+            is_correct = bool(correct[index])
+            if multiple_choice_question.question_type == MultipleChoiceQuestionType.PUZZLE_QUESTION:
+                row.input_puzzle_answer = multiple_choice_question.correct_puzzle_answer if is_correct else '0'
+            else:
+                row.selected_choice = (
+                    multiple_choice_question.correct_choice if is_correct
+                    else multiple_choice_question.correct_choice % 4 + 1
+                )
+            row.is_correct = is_correct
+            row.is_completed = True
+            row.completed_at = now
+        rows.append(row)
+    return rows
+
+
+def build_synthetic_answer_sheet(multiple_choice_questions, ability, answer_rate, rng):
+    # Packed sheets record choices only, so puzzle questions are left unanswered.
+    answered = rng.random(len(multiple_choice_questions)) < answer_rate
+    correct = rng.random(len(multiple_choice_questions)) < ability
+    answered &= np.array([
+        multiple_choice_question.question_type != MultipleChoiceQuestionType.PUZZLE_QUESTION
+        for multiple_choice_question in multiple_choice_questions
+    ], dtype=bool)
+    correct_choices = np.array([
+        multiple_choice_question.correct_choice or 1 for multiple_choice_question in multiple_choice_questions
+    ])
+    choices = np.where(answered, np.where(correct, correct_choices, correct_choices % 4 + 1), 0)
+    return choices.astype(np.uint8).tobytes(), np.packbits(answered, bitorder='little').tobytes()
+
+
+def create_synthetic_past_exam_stats(exam_type, year, max_marks, candidates=100000):
+    # Scores are spread normally around a third of the maximum; percentiles follow the normal CDF.
+    if PastExamStats.objects.filter(exam_type=exam_type, year=year).exists():
+        return None
+
+    mean = max_marks / 3
+    deviation = max(max_marks / 6, 1)
+    rank_vs_score = {}
+    rank_vs_percentile = {}
+    for score in range(-max_marks // 10, max_marks + 1, max(max_marks // 100, 1)):
+        percentile = round(50 * (1 + math.erf((score - mean) / (deviation * math.sqrt(2)))), 2)
+        rank_vs_score[str(score)] = percentile
+        rank = max(int(round((100 - percentile) / 100 * candidates)), 1)
+        rank_vs_percentile.setdefault(str(rank), percentile)
+
+    return PastExamStats.objects.create(
+        exam_type=exam_type,
+        year=year,
+        rank_vs_score_json=rank_vs_score,
+        rank_vs_percentile_json=rank_vs_percentile,
+    )
+
+
+def generate_synthetic_exam(
+    users=1000,
+    questions=100,
+    topics=3,
+    exam_type=ExamType.CAT,
+    year=None,
+    state=SYNTHETIC_EXAM_OPEN,
+    answer_rate=0.8,
+    accuracy=0.6,
+    accuracy_spread=0.15,
+    completed_ratio=0.8,
+    puzzle_ratio=0.2,
+    seed=None,
+    past_exam_stats=True,
+    packed_answer_sheets=False,
+):
+    # Builds an exam with `users` sessions and their answer rows through bulk inserts only, so no
+    # save signals run: nothing is scheduled on Celery and the caches are left alone.
+    started_at = time.perf_counter()
+    rng = np.random.default_rng(seed)
+    now = timezone.now()
+    year = year or now.year
+    duration = 60 * 3
+    if state == SYNTHETIC_EXAM_FINISHED:
+        start_timestamp = now - timedelta(minutes=duration + 30)
+        end_timestamp = now - timedelta(minutes=10)
+    else:
+        start_timestamp = now - timedelta(minutes=10)
+        end_timestamp = now + timedelta(minutes=duration + 30)
+
+    with transaction.atomic():
+        exam_topics = get_synthetic_topics(topics)
+        exam_hash = generate_random_uuid()
+        exam, = Exam.objects.bulk_create([
+            Exam(
+                hash=exam_hash,
+                title=f'Synthetic exam {exam_hash[:8]}',
+                duration=duration,
+                max_marks=questions * ExamType.get_marks_per_correct(exam_type),
+                year=year,
+                exam_type=exam_type,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+                packed_answer_sheets=packed_answer_sheets,
+            )
+        ])
+        # bulk_create skips the post_save hook that gives new exams their answer partition.
+        create_answer_partition_if_enabled(exam.id)
+        ExamTopicMapping.objects.bulk_create([ExamTopicMapping(exam=exam, topic=topic) for topic in exam_topics])
+        multiple_choice_questions = create_synthetic_questions(exam, exam_topics, questions, puzzle_ratio, rng)
+        exam_users = create_synthetic_users(f'synthetic-{exam_hash[:8]}', users)
+
+        abilities = np.clip(rng.normal(accuracy, accuracy_spread, size=users), 0, 1)
+        completed = rng.random(users) < completed_ratio if state == SYNTHETIC_EXAM_FINISHED else np.zeros(users, bool)
+        answers = 0
+        sessions_per_batch = max(SYNTHETIC_BATCH_SIZE // max(questions, 1), 1)
+        for batch_start in range(0, users, sessions_per_batch):
+            batch_end = min(batch_start + sessions_per_batch, users)
+            if packed_answer_sheets:
+                exam_user_mappings = []
+                for index in range(batch_start, batch_end):
+                    answer_sheet, answer_attempts = build_synthetic_answer_sheet(
+                        multiple_choice_questions, abilities[index], answer_rate, rng
+                    )
+                    exam_user_mappings.append(ExamUserMapping(
+                        hash=generate_random_uuid(),
+                        exam=exam,
+                        user=exam_users[index],
+                        end_timestamp=end_timestamp,
+                        completed=bool(completed[index]),
+                        completed_at=end_timestamp if completed[index] else None,
+                        answer_sheet=answer_sheet,
+                        answer_attempts=answer_attempts,
+                    ))
+                ExamUserMapping.objects.bulk_create(exam_user_mappings)
+                continue
+
+            exam_user_mappings = ExamUserMapping.objects.bulk_create([
+                ExamUserMapping(
+                    hash=generate_random_uuid(),
+                    exam=exam,
+                    user=exam_users[index],
+                    end_timestamp=end_timestamp,
+                    completed=bool(completed[index]),
+                    completed_at=end_timestamp if completed[index] else None,
+                )
+                for index in range(batch_start, batch_end)
+            ])
+            rows = []
+            for index, exam_user_mapping in zip(range(batch_start, batch_end), exam_user_mappings):
+                rows.extend(build_synthetic_answers(
+                    exam_user_mapping, multiple_choice_questions, abilities[index], answer_rate, rng, now
+                ))
+            ExamUserMultipleChoiceQuestionMapping.objects.bulk_create(rows, batch_size=SYNTHETIC_BATCH_SIZE)
+            answers += len(rows)
+
+    if past_exam_stats:
+        create_synthetic_past_exam_stats(exam_type, year - 1, exam.max_marks)
+
+    return {
+        'exam_id': exam.id,
+        'exam_hash': exam.hash,
+        'state': state,
+        'users': users,
+        'questions': questions,
+        'topics': topics,
+        'answers': answers,
+        'duration_ms': round((time.perf_counter() - started_at) * 1000, 2),
+    }
@@ -1,73 +1,276 @@
+import logging
+from bisect import bisect_right
 from collections import defaultdict
+from datetime import timedelta
+from itertools import islice
 
-import redis
+from celery import chord
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 
 from testprep.celery import app
-from tests.models import Exam, ExamUserMapping
+from testprep.utils import generate_random_uuid
+from tests.answer_buffer import AnswerBufferBusy, drain_answer_buffer, flush_answer_buffer, get_answer_buffer, \
+    get_answer_buffer_lag, record_answer_buffer_lag
+from tests.answer_keys import get_answer_key
+from tests.leaderboard import build_rank_table, merge_score_histograms, rank_exam, split_score_bands
+from tests.leaderboard_pipeline import (
+    LEADERBOARD_STATE_DONE,
+    LEADERBOARD_STATE_FAILED,
+    LEADERBOARD_STATE_FINALIZING,
+    LEADERBOARD_STATE_WRITING,
+    build_partition_histograms,
+    complete_exam_leaderboard,
+    force_complete_exam_user_mappings,
+    get_leaderboard_lock,
+    get_partition_ranges,
+    increment_leaderboard_progress,
+    release_leaderboard_lock,
+    start_leaderboard_progress,
+    update_leaderboard_progress,
+    write_score_band,
+)
+from tests.live_leaderboard import reconcile_live_leaderboard
+from tests.models import Exam, ExamTopicRanking, ExamUserMapping
+from tests.predictions import get_compiled_prediction
+from tests.profiles import PerformanceProfileAccumulator
+from tests.scoring import score_exam
+from tests.utils import provision_exam_registrations
 
-@app.task(name="compute_exam_leaderboard")
-def compute_exam_leaderboard(exam_id):
-    lock_id = f''
-    redis_cache = redis.StrictRedis()
-    lock = redis_cache.lock(lock_id, blocking_timeout=0, timeout=60)
+logger = logging.getLogger(__name__)
 
-    if not lock.acquire():
+PREDICTION_BATCH_SIZE = 5000
+
+@app.task(name="compute_exam_leaderboard", bind=True, max_retries=None)
+def compute_exam_leaderboard(self, exam_id):
+    lock = get_leaderboard_lock(exam_id)
+    lock_token = generate_random_uuid()
+    if not lock.acquire(token=lock_token):
         return False
 
+    distributed = False
     try:
-        exam = Exam.objects.get(id=exam_id)
-    except Exam.DoesNotExist:
-        return False
+        try:
+            exam = Exam.objects.get(id=exam_id)
+        except Exam.DoesNotExist:
+            return False
+
+        try:
+            drain_answer_buffer(exam.id)
+        except AnswerBufferBusy as exc:
+            # This is the only run the exam gets, so a busy buffer must not lose its leaderboard.
+            raise self.retry(exc=exc, countdown=settings.ANSWER_BUFFER_FLUSH_INTERVAL)
+
+        distributed_min_sessions = settings.LEADERBOARD_DISTRIBUTED_MIN_SESSIONS
+        if distributed_min_sessions is not None and \
+           ExamUserMapping.objects.filter(exam_id=exam.id).count() >= distributed_min_sessions:
+            # The pipeline's last task releases the lock.
+            distributed = dispatch_distributed_exam_leaderboard(exam, lock_token)
+            return True
+
+        start_leaderboard_progress(exam.id, 1)
+        try:
+            with transaction.atomic():
+                incomplete_exam_user_mapping_ids = force_complete_exam_user_mappings(exam)
+                performance_profile_accumulator = PerformanceProfileAccumulator()
+
+                def add_incomplete_exam_user_mapping_session(exam_user_mapping_id, user_id, total_score,
+                                                             topic_counts):
+                    if exam_user_mapping_id in incomplete_exam_user_mapping_ids:
+                        performance_profile_accumulator.add_session(user_id, exam.exam_type, total_score, topic_counts)
+
+                score_exam(exam.id, on_scored=add_incomplete_exam_user_mapping_session)
+                rank_exam(exam.id)
+                complete_exam_leaderboard(exam, performance_profile_accumulator)
+
+            publish_exam_leaderboard(exam.id)
+        except Exception:
+            # As abort_exam_leaderboard does for the distributed pipeline.
+            logger.exception('Leaderboard computation for exam %s failed.', exam.id)
+            update_leaderboard_progress(exam.id, state=LEADERBOARD_STATE_FAILED)
+            raise
+    finally:
+        if not distributed:
+            lock.release()
+
 
+def publish_exam_leaderboard(exam_id):
+    answer_buffer = get_answer_buffer()
+    if answer_buffer:
+        answer_buffer.forget(exam_id)
+
+    reconcile_live_leaderboard(exam_id, get_answer_key(exam_id).topic_titles)
+    predict_exam_results.delay(exam_id)
+    update_leaderboard_progress(exam_id, state=LEADERBOARD_STATE_DONE)
+
+
+def dispatch_distributed_exam_leaderboard(exam, lock_token):
+    # Scores id ranges in parallel, merges their score histograms into rank tables, then writes
+    # ranks back in parallel score bands. Each stage is a chord, so the stages run in sequence.
     with transaction.atomic():
-        incomplete_exam_user_mappings = ExamUserMapping.objects.filter(
-            exam_id=exam_id, completed=False
-        )
-        for exam_user_mapping in incomplete_exam_user_mappings:
-            exam_user_mapping.completed = True
-            exam_user_mapping.completed_at = exam.end_timestamp
-            exam_user_mapping.save(update_fields=['completed', 'completed_at'])
-
-        exam_user_mappings = (
-            ExamUserMapping.objects.filter(exam_id=exam.id)
-            .exclude(total_score__isnull=True)
-            .order_by("-total_score", "completed_at")
-            .values("id", "total_score")
+        incomplete_exam_user_mapping_ids = sorted(force_complete_exam_user_mappings(exam))
+
+    partition_ranges = get_partition_ranges(exam.id, settings.LEADERBOARD_PARTITION_SIZE)
+    start_leaderboard_progress(exam.id, len(partition_ranges))
+    partition_starts = [first_id for first_id, _ in partition_ranges]
+    partition_incomplete_ids = [[] for _ in partition_ranges]
+    for exam_user_mapping_id in incomplete_exam_user_mapping_ids:
+        partition_incomplete_ids[bisect_right(partition_starts, exam_user_mapping_id) - 1].append(exam_user_mapping_id)
+
+    chord(
+        score_exam_leaderboard_partition.s(exam.id, first_id, last_id, incomplete_ids)
+        for (first_id, last_id), incomplete_ids in zip(partition_ranges, partition_incomplete_ids)
+    )(
+        rank_exam_leaderboard_partitions.s(exam.id, lock_token).on_error(
+            abort_exam_leaderboard.si(exam.id, lock_token)
         )
-        total_users = len(exam_user_mappings)
-        now = timezone.now()
+    )
+    return True
+
+
+@app.task(name="score_exam_leaderboard_partition")
+def score_exam_leaderboard_partition(exam_id, first_id, last_id, incomplete_exam_user_mapping_ids):
+    exam = Exam.objects.only('id', 'exam_type').get(id=exam_id)
+    incomplete_exam_user_mapping_ids = set(incomplete_exam_user_mapping_ids)
+    performance_profile_accumulator = PerformanceProfileAccumulator()
+
+    def add_incomplete_exam_user_mapping_session(exam_user_mapping_id, user_id, total_score, topic_counts):
+        if exam_user_mapping_id in incomplete_exam_user_mapping_ids:
+            performance_profile_accumulator.add_session(user_id, exam.exam_type, total_score, topic_counts)
+
+    with transaction.atomic():
+        score_exam(exam.id, on_scored=add_incomplete_exam_user_mapping_session, id_range=(first_id, last_id))
+        performance_profile_accumulator.apply()
+
+    histograms = build_partition_histograms(exam.id, first_id, last_id)
+    increment_leaderboard_progress(exam.id, 'partitions_scored')
+    return histograms
+
 
-        for rank, exam_user_mapping in enumerate(exam_user_mappings, start=1):
-            exam_user_mapping.overall_rank = rank
-            exam_user_mapping.overall_percentile = round(100 * (1 - ((rank - 1) / total_users)), 2)
+@app.task(name="rank_exam_leaderboard_partitions")
+def rank_exam_leaderboard_partitions(partition_histograms, exam_id, lock_token):
+    overall_histogram = merge_score_histograms(histograms['total_scores'] for histograms in partition_histograms)
+    subject_histograms = defaultdict(list)
+    for histograms in partition_histograms:
+        for subject, histogram in histograms['subject_scores'].items():
+            subject_histograms[subject].append(histogram)
 
+    overall_rank_table = build_rank_table(overall_histogram)
+    subject_rank_tables = {
+        subject: build_rank_table(merge_score_histograms(histograms))
+        for subject, histograms in subject_histograms.items()
+    }
+    score_bands = split_score_bands(overall_histogram, settings.LEADERBOARD_WRITER_BAND_SIZE)
 
-        subject_scores_map = defaultdict(list)
-        for exam_user_mapping in exam_user_mappings:
-            for subject, score in exam_user_mapping.subject_scores.items():
-                subject_scores_map[subject].append(score)
+    # Subject standings are rebuilt from scratch, as in write_topic_rankings.
+    ExamTopicRanking.objects.filter(exam_id=exam_id).delete()
+    update_leaderboard_progress(exam_id, state=LEADERBOARD_STATE_WRITING, bands=len(score_bands))
+    chord(
+        write_exam_leaderboard_band.s(exam_id, highest_score, lowest_score, overall_rank_table, subject_rank_tables)
+        for highest_score, lowest_score in score_bands
+    )(
+        finalize_exam_leaderboard.si(exam_id, lock_token).on_error(abort_exam_leaderboard.si(exam_id, lock_token))
+    )
+    return len(score_bands)
 
-        for subject in subject_scores_map:
-            subject_scores_map[subject].sort(reverse=True)
 
+@app.task(name="write_exam_leaderboard_band")
+def write_exam_leaderboard_band(exam_id, highest_score, lowest_score, overall_rank_table, subject_rank_tables):
+    with transaction.atomic():
+        written = write_score_band(exam_id, highest_score, lowest_score, overall_rank_table, subject_rank_tables)
+    increment_leaderboard_progress(exam_id, 'bands_written')
+    return written
 
-        for exam_user_mapping in exam_user_mappings:
-            subject_percentiles = {}
-            for subject, score in exam_user_mapping.subject_scores.items():
-                scores = subject_scores_map[subject]
-                rank = scores.index(score) + 1
-                percentile = round(100 * (1 - ((rank - 1) / len(scores))), 2)
-                subject_percentiles[subject] = percentile
 
-            exam_user_mapping.subject_percentiles = subject_percentiles
+@app.task(name="finalize_exam_leaderboard")
+def finalize_exam_leaderboard(exam_id, lock_token):
+    try:
+        exam = Exam.objects.get(id=exam_id)
+        update_leaderboard_progress(exam.id, state=LEADERBOARD_STATE_FINALIZING)
+        with transaction.atomic():
+            complete_exam_leaderboard(exam, PerformanceProfileAccumulator())
+        publish_exam_leaderboard(exam.id)
+    finally:
+        release_leaderboard_lock(exam_id, lock_token)
 
+
+@app.task(name="abort_exam_leaderboard")
+def abort_exam_leaderboard(exam_id, lock_token):
+    logger.error('Distributed leaderboard computation for exam %s failed.', exam_id)
+    update_leaderboard_progress(exam_id, state=LEADERBOARD_STATE_FAILED)
+    release_leaderboard_lock(exam_id, lock_token)
+
+
+@app.task(name="predict_exam_results")
+def predict_exam_results(exam_id):
+    try:
+        exam = Exam.objects.only('id', 'exam_type', 'year').get(id=exam_id)
+    except Exam.DoesNotExist:
+        return 0
+
+    compiled_prediction = get_compiled_prediction(exam.exam_type, exam.year - 1)
+    if compiled_prediction is None:
+        return 0
+
+    predicted = 0
+    exam_user_mappings = ExamUserMapping.objects.filter(exam_id=exam.id, completed=True).values_list(
+        'id', 'total_score'
+    ).iterator(chunk_size=PREDICTION_BATCH_SIZE)
+    while True:
+        rows = list(islice(exam_user_mappings, PREDICTION_BATCH_SIZE))
+        if not rows:
+            return predicted
+        predicted_percentiles, predicted_ranks = compiled_prediction.predict_many(
+            [total_score or 0 for _, total_score in rows]
+        )
         ExamUserMapping.objects.bulk_update(
-            exam_user_mappings,
-            ["overall_rank", "overall_percentile", "subject_percentiles"],
-            batch_size=5000,
+            [
+                ExamUserMapping(
+                    id=exam_user_mapping_id,
+                    predicted_percentile=float(predicted_percentile),
+                    predicted_rank=int(predicted_rank),
+                )
+                for (exam_user_mapping_id, _), predicted_percentile, predicted_rank in zip(
+                    rows, predicted_percentiles, predicted_ranks
+                )
+            ],
+            ['predicted_percentile', 'predicted_rank'],
         )
+        predicted += len(rows)
+
+
+@app.task(name="provision_registered_exam_sessions")
+def provision_registered_exam_sessions(exam_id):
+    return provision_exam_registrations(exam_id)
+
+
+@app.task(name="provision_upcoming_exams")
+def provision_upcoming_exams():
+    # Runs off-peak and provisions every exam starting within the lead time that still has
+    # registrations without a session.
+    now = timezone.now()
+    exam_ids = Exam.objects.filter(
+        completed=False,
+        start_timestamp__gt=now,
+        start_timestamp__lte=now + timedelta(seconds=settings.EXAM_PROVISIONING_LEAD_TIME),
+        exam_registrations__provisioned_at__isnull=True,
+    ).values_list('id', flat=True).distinct()
+
+    provisioned = 0
+    for exam_id in exam_ids:
+        provisioned += provision_exam_registrations(exam_id)
+    return provisioned
+
+
+@app.task(name="flush_answer_buffers")
+def flush_answer_buffers():
+    answer_buffer = get_answer_buffer()
+    if answer_buffer is None:
+        return 0
 
-        exam.completed = True
-        exam.save(update_fields=["completed",])
+    flushed = 0
+    for exam_id in answer_buffer.exam_ids():
+        flushed += flush_answer_buffer(exam_id, answer_buffer=answer_buffer)
+    record_answer_buffer_lag(get_answer_buffer_lag(answer_buffer))
+    return flushed
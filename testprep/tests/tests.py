@@ -1,3 +1,1260 @@
+from datetime import datetime, timedelta, timezone as dt_timezone
+from unittest import mock
+
+import numpy as np
+from asgiref.sync import async_to_sync
+from django.apps import apps
+from django.conf import settings
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db.models.signals import pre_save
+from django.db import transaction
+from django.db import connection
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from celery.exceptions import Retry
+from django.test import override_settings
+
+from testprep.utils import generate_random_uuid, get_redis_client
+from tests.admission import LocalAdmissionController, RedisAdmissionController, get_requested_at
+from tests.answer_buffer import LocalAnswerBuffer, answer_buffer_oldest_age, answer_buffer_pending, buffer_answer, \
+    flush_answer_buffer, is_submitted_before_close
+from tests.answer_keys import get_answer_key
+from tests.answer_sheets import build_empty_answer_sheet, set_answer_slot
+from tests.exam_content import invalidate_exam_content
+from tests.leaderboard import ExamScoreArrays, build_rank_table, merge_score_histograms, rank_exam, \
+    rank_exam_scores, split_score_bands
+from tests.leaderboard_pipeline import LEADERBOARD_STATE_DONE, LEADERBOARD_STATE_FAILED, \
+    build_partition_histograms, force_complete_exam_user_mappings, get_leaderboard_lock, get_leaderboard_progress, \
+    write_score_band
+from tests.live_leaderboard import LocalLiveLeaderboard, RedisLiveLeaderboard
+from tests.model_mixins import HashModelMixin
+from tests.models import Exam, ExamMultipleChoiceQuestionMapping, ExamRegistration, ExamTopicMapping, \
+    ExamTopicRanking, ExamUserMapping, ExamUserMultipleChoiceQuestionMapping, MultipleChoiceQuestion, Topic
+from tests.resolvers import exam_resolver, exam_user_mapping_resolver, \
+    exam_user_multiple_choice_question_mapping_resolver
+from tests.scoring import score_exam
+from tests.tasks import compute_exam_leaderboard, flush_answer_buffers
+from tests.utils import complete_exam_user_mapping, create_walk_in_exam_user_mapping, get_session_window, \
+    get_started_user_ids, provision_exam_registrations, register_exam_candidates, update_score_for_exam_user_mapping
+
+COMPLETED_AT = datetime(2026, 1, 10, 12, 0, tzinfo=dt_timezone.utc)
+
+
+class ExamTestCase(TestCase):
+    def setUp(self):
+        # Saving an exam schedules its leaderboard task; tests run the pieces they need directly.
+        patcher = mock.patch(
+            'tests.tasks.compute_exam_leaderboard.apply_async', return_value=mock.Mock(id='compute-exam-leaderboard')
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @staticmethod
+    def create_exam(**kwargs):
+        now = timezone.now()
+        fields = {
+            'title': 'Mock CAT',
+            'duration': 60,
+            'max_marks': 100,
+            'year': 2026,
+            'start_timestamp': now - timedelta(hours=3),
+            'end_timestamp': now - timedelta(hours=1),
+        }
+        fields.update(kwargs)
+        return Exam.objects.create(**fields)
+
+    @staticmethod
+    def create_users(count, prefix='candidate'):
+        return [User.objects.create(username=f'{prefix}{index}') for index in range(count)]
+
+    @staticmethod
+    def add_questions(exam, questions):
+        # questions: (topic title, correct choice) per question, in exam order.
+        multiple_choice_questions = []
+        for topic_title, correct_choice in questions:
+            topic, _ = Topic.objects.get_or_create(title=topic_title)
+            ExamTopicMapping.objects.get_or_create(exam=exam, topic=topic)
+            multiple_choice_question = MultipleChoiceQuestion.objects.create(topic=topic, correct_choice=correct_choice)
+            ExamMultipleChoiceQuestionMapping.objects.create(
+                exam=exam, multiple_choice_question=multiple_choice_question
+            )
+            multiple_choice_questions.append(multiple_choice_question)
+        # The content version is otherwise bumped on commit, which a TestCase never reaches.
+        invalidate_exam_content([exam.id])
+        return multiple_choice_questions
+
+    def create_answered_session(self, exam, user, selected_choices):
+        # selected_choices: {MultipleChoiceQuestion: choice}. The session is completed without
+        # going through its post_save scoring, so each test picks the scoring path it exercises.
+        exam_user_mapping = ExamUserMapping.objects.create(exam=exam, user=user, end_timestamp=exam.end_timestamp)
+        if exam.packed_answer_sheets:
+            answer_sheet, answer_attempts = self.build_answer_sheet(exam, selected_choices)
+            ExamUserMapping.objects.filter(pk=exam_user_mapping.pk).update(
+                answer_sheet=answer_sheet, answer_attempts=answer_attempts
+            )
+            selected_choices = {}
+        for multiple_choice_question, selected_choice in selected_choices.items():
+            exam_user_multiple_choice_question_mapping = ExamUserMultipleChoiceQuestionMapping.objects.get(
+                exam=exam, exam_user_mapping=exam_user_mapping, multiple_choice_question=multiple_choice_question
+            )
+            exam_user_multiple_choice_question_mapping.selected_choice = selected_choice
+            exam_user_multiple_choice_question_mapping.is_completed = True
+            exam_user_multiple_choice_question_mapping.is_correct = \
+                exam_user_multiple_choice_question_mapping.get_is_correct()
+            exam_user_multiple_choice_question_mapping.save()
+        ExamUserMapping.objects.filter(pk=exam_user_mapping.pk).update(completed=True, completed_at=COMPLETED_AT)
+        return exam_user_mapping
+
+    @staticmethod
+    def build_answer_sheet(exam, selected_choices, slots=None):
+        question_ids = get_answer_key(exam.id).question_ids
+        answer_sheet, answer_attempts = build_empty_answer_sheet(len(question_ids) if slots is None else slots)
+        for multiple_choice_question, selected_choice in selected_choices.items():
+            answer_sheet, answer_attempts = set_answer_slot(
+                answer_sheet, answer_attempts, question_ids.index(multiple_choice_question.id), selected_choice
+            )
+        return answer_sheet, answer_attempts
+
+    @staticmethod
+    def get_scores(exam_user_mappings):
+        scored = ExamUserMapping.objects.in_bulk([exam_user_mapping.id for exam_user_mapping in exam_user_mappings])
+        return [
+            (scored[exam_user_mapping.id].total_score, scored[exam_user_mapping.id].subject_scores)
+            for exam_user_mapping in exam_user_mappings
+        ]
+
+    def create_scored_sessions(self, exam, sessions):
+        # sessions: (total_score, minutes after COMPLETED_AT, subject_scores) per candidate, bypassing
+        # the session signals like the leaderboard pipeline's inputs do.
+        users = self.create_users(len(sessions))
+        return ExamUserMapping.objects.bulk_create([
+            ExamUserMapping(
+                hash=generate_random_uuid(),
+                exam=exam,
+                user=user,
+                total_score=total_score,
+                subject_scores=subject_scores,
+                completed=True,
+                completed_at=COMPLETED_AT + timedelta(minutes=minutes) if minutes is not None else None,
+            )
+            for user, (total_score, minutes, subject_scores) in zip(users, sessions)
+        ])
+
+
+class RankExamScoresTests(TestCase):
+    @staticmethod
+    def build_arrays(sessions):
+        arrays = ExamScoreArrays(len(sessions))
+        for exam_user_mapping_id, total_score, minutes, subject_scores in sessions:
+            completed_at = COMPLETED_AT + timedelta(minutes=minutes) if minutes is not None else None
+            arrays.append(exam_user_mapping_id, total_score, completed_at, subject_scores)
+        return arrays.trim()
+
+    def test_overall_ties_are_ordered_by_completion_time_then_id(self):
+        arrays = self.build_arrays([
+            (1, 10, 0, {}),
+            (2, 20, 5, {}),
+            (3, 20, 1, {}),
+            (4, 5, 0, {}),
+            (5, 20, 1, {}),
+            (6, 20, None, {}),
+        ])
+
+        overall_ranks, overall_percentiles, _, _ = rank_exam_scores(arrays)
+
+        # Among the 20s: 3 and 5 finished first (3 has the lower id), then 2, then 6 with no completion time.
+        self.assertEqual(overall_ranks.tolist(), [5, 3, 1, 6, 2, 4])
+        self.assertEqual(overall_percentiles.tolist(), [33.33, 66.67, 100.0, 16.67, 83.33, 50.0])
+
+    def test_subject_ties_share_a_competition_rank(self):
+        arrays = self.build_arrays([
+            (1, 10, 0, {'Quant': 5, 'Verbal': 5}),
+            (2, 16, 1, {'Quant': 8, 'Verbal': 8}),
+            (3, 8, 2, {'Quant': 8}),
+            (4, 2, 3, {'Quant': 2, 'Verbal': None}),
+        ])
+
+        _, _, subject_ranks, subject_percentiles = rank_exam_scores(arrays)
+
+        self.assertEqual(subject_ranks['Quant'].tolist(), [3, 1, 1, 4])
+        self.assertEqual(subject_percentiles['Quant'].tolist(), [50.0, 100.0, 100.0, 25.0])
+        # Sessions without a Verbal score are left out of its ranking and its percentile denominator.
+        np.testing.assert_array_equal(subject_ranks['Verbal'], [2, 1, np.nan, np.nan])
+        np.testing.assert_array_equal(subject_percentiles['Verbal'], [50.0, 100.0, np.nan, np.nan])
+
+    def test_empty_exam(self):
+        overall_ranks, overall_percentiles, subject_ranks, _ = rank_exam_scores(ExamScoreArrays(0).trim())
+
+        self.assertEqual(len(overall_ranks), 0)
+        self.assertEqual(len(overall_percentiles), 0)
+        self.assertEqual(subject_ranks, {})
+
+
+class ScoreBandRankingTests(ExamTestCase):
+    # The distributed leaderboard writes ranks band by band; they must match the single-pass ranking.
+
+    def setUp(self):
+        super().setUp()
+        Topic.objects.create(title='Quant')
+        Topic.objects.create(title='Verbal')
+        self.exam = self.create_exam()
+        self.exam_user_mappings = self.create_scored_sessions(self.exam, [
+            (20, 5, {'Quant': 15, 'Verbal': 5}),
+            (20, 1, {'Quant': 10, 'Verbal': 10}),
+            (14, 0, {'Quant': 10, 'Verbal': 4}),
+            (20, 1, {'Quant': 15}),
+            (-2, 2, {'Quant': -1, 'Verbal': -1}),
+            (14, None, {'Quant': 4, 'Verbal': 10}),
+            (0, 3, {}),
+        ])
+
+    def get_standings(self):
+        sessions = ExamUserMapping.objects.filter(exam=self.exam).order_by('id').values_list(
+            'overall_rank', 'overall_percentile', 'subject_percentiles'
+        )
+        topic_rankings = ExamTopicRanking.objects.filter(exam=self.exam).order_by(
+            'topic__title', 'exam_user_mapping_id'
+        ).values_list('topic__title', 'exam_user_mapping_id', 'score', 'rank', 'percentile')
+        return [(rank, float(percentile), percentiles) for rank, percentile, percentiles in sessions], \
+            list(topic_rankings)
+
+    def rank_in_bands(self, band_size):
+        ids = [exam_user_mapping.id for exam_user_mapping in self.exam_user_mappings]
+        histograms = build_partition_histograms(self.exam.id, min(ids), max(ids))
+        overall_histogram = merge_score_histograms([histograms['total_scores']])
+        subject_rank_tables = {
+            subject: build_rank_table(merge_score_histograms([histogram]))
+            for subject, histogram in histograms['subject_scores'].items()
+        }
+        ExamTopicRanking.objects.filter(exam=self.exam).delete()
+        for highest_score, lowest_score in split_score_bands(overall_histogram, band_size):
+            write_score_band(
+                self.exam.id, highest_score, lowest_score, build_rank_table(overall_histogram), subject_rank_tables
+            )
+
+    def test_single_pass_ranking(self):
+        rank_exam(self.exam.id)
+
+        standings, topic_rankings = self.get_standings()
+        self.assertEqual([rank for rank, _, _ in standings], [3, 1, 4, 2, 7, 5, 6])
+        self.assertEqual(
+            [percentile for _, percentile, _ in standings], [71.43, 100.0, 57.14, 85.71, 14.29, 42.86, 28.57]
+        )
+        self.assertEqual(standings[2][2], {'Quant': 66.67, 'Verbal': 40.0})
+        self.assertEqual(
+            [rank for title, _, _, rank, _ in topic_rankings if title == 'Verbal'], [3, 1, 4, 5, 1]
+        )
+
+    def test_score_bands_match_single_pass_ranking(self):
+        rank_exam(self.exam.id)
+        expected = self.get_standings()
+        ExamUserMapping.objects.filter(exam=self.exam).update(
+            overall_rank=None, overall_percentile=None, subject_percentiles={}
+        )
+
+        for band_size in (1, 2, 100):
+            with self.subTest(band_size=band_size):
+                self.rank_in_bands(band_size)
+                self.assertEqual(self.get_standings(), expected)
+
+
+class ExamScoringTests(ExamTestCase):
+    # score_exam aggregates a whole exam in SQL; update_score_for_exam_user_mapping grades one session
+    # in Python. Both must give the same scores, with CAT's +5 / -1 marking.
+
+    def setUp(self):
+        super().setUp()
+        self.exam = self.create_exam()
+        self.quant_1, self.quant_2, self.verbal = self.add_questions(
+            self.exam, [('Quant', 1), ('Quant', 2), ('Verbal', 3)]
+        )
+        first, second, third = self.create_users(3)
+        self.exam_user_mappings = [
+            self.create_answered_session(self.exam, first, {self.quant_1: 1, self.quant_2: 3, self.verbal: 3}),
+            self.create_answered_session(self.exam, second, {self.quant_1: 2, self.verbal: 1}),
+            self.create_answered_session(self.exam, third, {}),
+        ]
+
+    def score_each_session(self):
+        ExamUserMapping.objects.filter(exam=self.exam).update(total_score=None, subject_scores={})
+        for exam_user_mapping in self.exam_user_mappings:
+            update_score_for_exam_user_mapping(ExamUserMapping.objects.get(pk=exam_user_mapping.pk))
+        return self.get_scores(self.exam_user_mappings)
+
+    def test_score_exam_applies_negative_marking(self):
+        self.assertEqual(score_exam(self.exam.id), 3)
+
+        self.assertEqual(self.get_scores(self.exam_user_mappings), [
+            (9, {'Quant': 4, 'Verbal': 5}),
+            (-2, {'Quant': -1, 'Verbal': -1}),
+            (0, {}),
+        ])
+
+    def test_score_exam_matches_per_session_scoring(self):
+        score_exam(self.exam.id)
+        exam_scores = self.get_scores(self.exam_user_mappings)
+
+        self.assertEqual(self.score_each_session(), exam_scores)
+
+    def test_score_exam_only_scores_completed_sessions(self):
+        ExamUserMapping.objects.filter(pk=self.exam_user_mappings[1].pk).update(completed=False)
+
+        self.assertEqual(score_exam(self.exam.id), 2)
+        self.assertIsNone(self.get_scores(self.exam_user_mappings)[1][0])
+
+    def test_corrected_answer_key_is_applied_to_earlier_answers(self):
+        self.quant_2.correct_choice = 3
+        with self.captureOnCommitCallbacks(execute=True):
+            self.quant_2.save()
+
+        score_exam(self.exam.id)
+
+        self.assertEqual(self.get_scores(self.exam_user_mappings), [
+            (15, {'Quant': 10, 'Verbal': 5}),
+            (-2, {'Quant': -1, 'Verbal': -1}),
+            (0, {}),
+        ])
+        self.assertTrue(
+            ExamUserMultipleChoiceQuestionMapping.objects.get(
+                exam=self.exam, exam_user_mapping=self.exam_user_mappings[0], multiple_choice_question=self.quant_2
+            ).is_correct
+        )
+        self.assertEqual(self.score_each_session(), self.get_scores(self.exam_user_mappings))
+
+
+class LeaderboardPaginationTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exam = self.create_exam(completed=True)
+        self.exam_user_mappings = self.create_scored_sessions(self.exam, [
+            (score, minute, {}) for minute, score in enumerate([30, 25, 25, 20, 15, 10, 5])
+        ])
+        rank_exam(self.exam.id)
+        self.client = APIClient()
+        self.url = reverse('tests:exam-leaderboard', args=[self.exam.hash])
+
+    def get_page(self, url=None, user=None, **params):
+        self.client.force_authenticate(user or self.exam_user_mappings[0].user)
+        response = self.client.get(url or self.url, {'limit': 3, **params} if url is None else None)
+        self.assertEqual(response.status_code, 200)
+        return [row['overall_rank'] for row in response.data['results']], response.data
+
+    def test_first_page(self):
+        ranks, data = self.get_page()
+
+        self.assertEqual(ranks, [1, 2, 3])
+        self.assertIsNone(data['previous'])
+        self.assertIsNotNone(data['next'])
+        self.assertNotIn('count', data)
+
+    def test_next_and_previous_links_walk_the_leaderboard(self):
+        _, first = self.get_page()
+        ranks, second = self.get_page(first['next'])
+        self.assertEqual(ranks, [4, 5, 6])
+        ranks, last = self.get_page(second['next'])
+        self.assertEqual(ranks, [7])
+        self.assertIsNone(last['next'])
+
+        ranks, back = self.get_page(last['previous'])
+        self.assertEqual(ranks, [4, 5, 6])
+        ranks, top = self.get_page(back['previous'])
+        self.assertEqual(ranks, [1, 2, 3])
+        self.assertIsNone(top['previous'])
+        self.assertIsNotNone(top['next'])
+
+    def test_page_ending_on_the_last_row_has_no_next_link(self):
+        ranks, data = self.get_page(limit=7)
+
+        self.assertEqual(ranks, [1, 2, 3, 4, 5, 6, 7])
+        self.assertIsNone(data['next'])
+        self.assertIsNone(data['previous'])
+
+    def test_around_me_at_the_top(self):
+        ranks, data = self.get_page(around='me', user=self.exam_user_mappings[0].user)
+
+        self.assertEqual(ranks, [1, 2, 3])
+        self.assertIsNone(data['previous'])
+        self.assertIsNotNone(data['next'])
+
+    def test_around_me_in_the_middle(self):
+        ranks, data = self.get_page(around='me', user=self.exam_user_mappings[3].user)
+
+        self.assertEqual(ranks, [3, 4, 5])
+        self.assertEqual(self.get_page(data['previous'])[0], [1, 2])
+        self.assertEqual(self.get_page(data['next'])[0], [6, 7])
+
+    def test_around_me_at_the_bottom(self):
+        ranks, data = self.get_page(around='me', user=self.exam_user_mappings[6].user)
+
+        self.assertEqual(ranks, [6, 7])
+        self.assertIsNone(data['next'])
+        self.assertEqual(self.get_page(data['previous'])[0], [3, 4, 5])
+
+    def test_around_me_without_a_position(self):
+        self.client.force_authenticate(self.create_users(1, prefix='spectator')[0])
+
+        response = self.client.get(self.url, {'around': 'me'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_invalid_cursor(self):
+        self.client.force_authenticate(self.exam_user_mappings[0].user)
+
+        response = self.client.get(self.url, {'cursor': 'not-a-cursor'})
+
+        self.assertEqual(response.status_code, 404)
+
+    def test_exact_count(self):
+        _, data = self.get_page(count='exact')
+
+        self.assertEqual(data['count'], 7)
+
+
+class AnswerSheetGraderTests(ExamTestCase):
+    # Packed answer sheets must grade exactly like the same answers stored one row per question.
+
+    def setUp(self):
+        super().setUp()
+        self.exam = self.create_exam()
+        self.questions = self.add_questions(
+            self.exam, [('Quant', 1), ('Quant', 2), ('Verbal', 3), ('Verbal', 4), ('Logic', 1)]
+        )
+        quant_1, quant_2, verbal_1, verbal_2, logic = self.questions
+        self.answers = [
+            {quant_1: 1, quant_2: 2, verbal_1: 3, verbal_2: 4, logic: 1},
+            {quant_1: 2, quant_2: 1, verbal_1: 1, verbal_2: 1, logic: 2},
+            {quant_1: 1, verbal_2: 2},
+            {logic: 1},
+            {},
+        ]
+
+    def get_row_topic_counts(self, selected_choices):
+        answer_key = get_answer_key(self.exam.id)
+        topic_counts = {}
+        for multiple_choice_question, selected_choice in selected_choices.items():
+            counts = topic_counts.setdefault(multiple_choice_question.topic_id, {'correct': 0, 'incorrect': 0})
+            if answer_key.grade(multiple_choice_question.id, selected_choice, None):
+                counts['correct'] += 1
+            else:
+                counts['incorrect'] += 1
+        return topic_counts
+
+    def test_topic_counts_match_row_grading(self):
+        answer_sheets = [self.build_answer_sheet(self.exam, selected_choices) for selected_choices in self.answers]
+
+        topic_counts = get_answer_key(self.exam.id).answer_sheet_grader.get_topic_counts(
+            [answer_sheet for answer_sheet, _ in answer_sheets],
+            [answer_attempts for _, answer_attempts in answer_sheets],
+        )
+
+        self.assertEqual(
+            topic_counts, [self.get_row_topic_counts(selected_choices) for selected_choices in self.answers]
+        )
+
+    def test_slots_missing_from_a_shorter_sheet_are_unanswered(self):
+        quant_1, quant_2 = self.questions[:2]
+        answer_sheet, answer_attempts = self.build_answer_sheet(self.exam, {quant_1: 1, quant_2: 1}, slots=2)
+
+        topic_counts, = get_answer_key(self.exam.id).answer_sheet_grader.get_topic_counts(
+            [answer_sheet], [answer_attempts]
+        )
+
+        self.assertEqual(topic_counts, {quant_1.topic_id: {'correct': 1, 'incorrect': 1}})
+
+    def test_packed_and_row_sessions_score_the_same(self):
+        packed_exam = self.create_exam(packed_answer_sheets=True)
+        for multiple_choice_question in self.questions:
+            ExamTopicMapping.objects.get_or_create(exam=packed_exam, topic=multiple_choice_question.topic)
+            ExamMultipleChoiceQuestionMapping.objects.create(
+                exam=packed_exam, multiple_choice_question=multiple_choice_question
+            )
+        invalidate_exam_content([packed_exam.id])
+        users = self.create_users(len(self.answers))
+        row_exam_user_mappings = [
+            self.create_answered_session(self.exam, user, selected_choices)
+            for user, selected_choices in zip(users, self.answers)
+        ]
+        packed_exam_user_mappings = [
+            self.create_answered_session(packed_exam, user, selected_choices)
+            for user, selected_choices in zip(users, self.answers)
+        ]
+
+        score_exam(self.exam.id)
+        score_exam(packed_exam.id)
+        self.assertEqual(self.get_scores(packed_exam_user_mappings), self.get_scores(row_exam_user_mappings))
+        self.assertEqual(self.get_scores(packed_exam_user_mappings)[0], (25, {'Quant': 10, 'Verbal': 10, 'Logic': 5}))
+
+        for exam_user_mapping in packed_exam_user_mappings:
+            update_score_for_exam_user_mapping(ExamUserMapping.objects.get(pk=exam_user_mapping.pk))
+        self.assertEqual(self.get_scores(packed_exam_user_mappings), self.get_scores(row_exam_user_mappings))
+
+
+@override_settings(ANSWER_BUFFER_BACKEND='local')
+class AnswerBufferTests(ExamTestCase):
+    # Submits return before the answer is written, so nothing accepted may be lost or reordered.
+
+    def setUp(self):
+        super().setUp()
+        self.answer_buffer = LocalAnswerBuffer()
+        patcher = mock.patch('tests.answer_buffer._local_answer_buffer', self.answer_buffer)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.exam = self.create_exam()
+        self.questions = self.add_questions(self.exam, [('Quant', 1), ('Verbal', 2)])
+        self.exam_user_mappings = [
+            ExamUserMapping.objects.create(exam=self.exam, user=user, end_timestamp=self.exam.end_timestamp)
+            for user in self.create_users(2)
+        ]
+
+    def get_row(self, exam_user_mapping, multiple_choice_question):
+        return ExamUserMultipleChoiceQuestionMapping.objects.get(
+            exam=self.exam, exam_user_mapping=exam_user_mapping, multiple_choice_question=multiple_choice_question
+        )
+
+    def buffer(self, exam_user_mapping, multiple_choice_question, selected_choice, submitted_at=COMPLETED_AT):
+        return buffer_answer(
+            self.answer_buffer, self.exam.id, exam_user_mapping.id,
+            self.get_row(exam_user_mapping, multiple_choice_question).id, selected_choice, submitted_at,
+        )
+
+    def test_flush_writes_only_the_latest_answer(self):
+        exam_user_mapping = self.exam_user_mappings[0]
+        quant = self.questions[0]
+        self.buffer(exam_user_mapping, quant, 1, COMPLETED_AT)
+        self.buffer(exam_user_mapping, quant, 3, COMPLETED_AT + timedelta(seconds=5))
+        self.assertIsNone(self.get_row(exam_user_mapping, quant).selected_choice)
+
+        self.assertEqual(flush_answer_buffer(self.exam.id, answer_buffer=self.answer_buffer), 2)
+
+        row = self.get_row(exam_user_mapping, quant)
+        self.assertEqual((row.selected_choice, row.is_completed, row.is_correct), (3, True, False))
+        self.assertEqual(row.completed_at, COMPLETED_AT + timedelta(seconds=5))
+        self.assertEqual(self.answer_buffer.read(self.exam.id, 10), [])
+
+    def test_completion_writes_the_sessions_buffered_answers(self):
+        completing, other = self.exam_user_mappings
+        quant, verbal = self.questions
+        self.buffer(completing, quant, 1)
+        self.buffer(completing, verbal, 2)
+        self.buffer(other, quant, 1)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            complete_exam_user_mapping(completing)
+
+        self.assertEqual(
+            [self.get_row(completing, question).selected_choice for question in self.questions], [1, 2]
+        )
+        self.assertEqual(self.answer_buffer.read_session(self.exam.id, completing.id), [])
+        self.assertIsNone(self.get_row(other, quant).selected_choice)
+        self.assertEqual(len(self.answer_buffer.read_session(self.exam.id, other.id)), 1)
+
+    def test_flush_after_completion_drops_only_answers_submitted_after_close(self):
+        exam_user_mapping = self.exam_user_mappings[0]
+        quant, verbal = self.questions
+        self.buffer(exam_user_mapping, quant, 1, COMPLETED_AT - timedelta(seconds=1))
+        self.buffer(exam_user_mapping, verbal, 2, COMPLETED_AT + timedelta(seconds=1))
+        ExamUserMapping.objects.filter(pk=exam_user_mapping.pk).update(completed=True, completed_at=COMPLETED_AT)
+
+        flush_answer_buffer(self.exam.id, answer_buffer=self.answer_buffer)
+
+        self.assertEqual(self.get_row(exam_user_mapping, quant).selected_choice, 1)
+        self.assertIsNone(self.get_row(exam_user_mapping, verbal).selected_choice)
+
+    def test_is_submitted_before_close(self):
+        entry = {'submitted_at': COMPLETED_AT.timestamp()}
+        later = COMPLETED_AT + timedelta(seconds=1)
+        earlier = COMPLETED_AT - timedelta(seconds=1)
+
+        self.assertTrue(is_submitted_before_close(entry, False, earlier, earlier))
+        self.assertTrue(is_submitted_before_close(entry, True, COMPLETED_AT, None))
+        self.assertFalse(is_submitted_before_close(entry, True, earlier, later))
+        self.assertTrue(is_submitted_before_close(entry, True, None, later))
+        self.assertFalse(is_submitted_before_close(entry, True, None, earlier))
+        self.assertTrue(is_submitted_before_close(entry, True, None, None))
+
+    def test_flush_records_lag_per_exam(self):
+        self.buffer(self.exam_user_mappings[0], self.questions[0], 1)
+        with mock.patch('tests.tasks.flush_answer_buffer', return_value=0):
+            flush_answer_buffers()
+
+        self.assertIn(f'testprep_answer_buffer_pending{{exam_id="{self.exam.id}"}} 1', answer_buffer_pending.render())
+        self.assertTrue(any(
+            line.startswith(f'testprep_answer_buffer_oldest_age_seconds{{exam_id="{self.exam.id}"}} ')
+            for line in answer_buffer_oldest_age.render()
+        ))
+
+        flush_answer_buffers()
+        self.assertIn(f'testprep_answer_buffer_pending{{exam_id="{self.exam.id}"}} 0', answer_buffer_pending.render())
+
+    @override_settings(ANSWER_BUFFER_DRAIN_TIMEOUT=0, ANSWER_BUFFER_FLUSH_INTERVAL=7)
+    def test_leaderboard_retries_while_the_buffer_is_busy(self):
+        flush_lock = self.answer_buffer.lock(self.exam.id)
+        flush_lock.acquire()
+        self.addCleanup(flush_lock.release)
+
+        with mock.patch.object(compute_exam_leaderboard, 'retry', side_effect=Retry()) as retry:
+            with self.assertRaises(Retry):
+                compute_exam_leaderboard(self.exam.id)
+
+        self.assertEqual(retry.call_args.kwargs['countdown'], 7)
+        leaderboard_lock = get_leaderboard_lock(self.exam.id)
+        self.assertTrue(leaderboard_lock.acquire())
+        leaderboard_lock.release()
+
+
+class ComputeExamLeaderboardTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exam = self.create_exam()
+        quant = self.add_questions(self.exam, [('Quant', 1)])[0]
+        self.create_answered_session(self.exam, self.create_users(1)[0], {quant: 1})
+
+    def assert_lock_released(self):
+        leaderboard_lock = get_leaderboard_lock(self.exam.id)
+        self.assertTrue(leaderboard_lock.acquire())
+        leaderboard_lock.release()
+
+    def test_progress_is_done_after_a_single_worker_run(self):
+        with mock.patch('tests.tasks.predict_exam_results.delay'):
+            compute_exam_leaderboard(self.exam.id)
+
+        self.assertEqual(get_leaderboard_progress(self.exam.id)['state'], LEADERBOARD_STATE_DONE)
+        self.assert_lock_released()
+
+    def test_progress_is_failed_when_a_single_worker_run_raises(self):
+        with mock.patch('tests.tasks.rank_exam', side_effect=RuntimeError):
+            with self.assertRaises(RuntimeError):
+                compute_exam_leaderboard(self.exam.id)
+
+        self.assertEqual(get_leaderboard_progress(self.exam.id)['state'], LEADERBOARD_STATE_FAILED)
+        self.assert_lock_released()
+
+
+class PackedAnswerSheetSlotTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.exam = self.create_exam(packed_answer_sheets=True)
+        self.questions = self.add_questions(self.exam, [('Quant', 1), ('Verbal', 2)])
+        self.extra_question = MultipleChoiceQuestion.objects.create(topic=self.questions[0].topic, correct_choice=3)
+
+    def get_mapping(self, multiple_choice_question):
+        return ExamMultipleChoiceQuestionMapping.objects.get(
+            exam=self.exam, multiple_choice_question=multiple_choice_question
+        )
+
+    def test_question_mappings_change_freely_before_any_session(self):
+        mapping = ExamMultipleChoiceQuestionMapping(exam=self.exam, multiple_choice_question=self.extra_question)
+        mapping.full_clean()
+        mapping.save()
+        self.get_mapping(self.questions[0]).delete()
+
+        self.assertEqual(get_answer_key(self.exam.id).question_ids, [self.questions[1].id, self.extra_question.id])
+
+    def test_question_mappings_are_locked_once_sessions_exist(self):
+        self.create_answered_session(self.exam, self.create_users(1)[0], {self.questions[1]: 2})
+        mapping = ExamMultipleChoiceQuestionMapping(exam=self.exam, multiple_choice_question=self.extra_question)
+
+        with self.assertRaises(ValidationError), transaction.atomic():
+            mapping.full_clean()
+        with self.assertRaises(ValidationError), transaction.atomic():
+            mapping.save()
+        moved_mapping = self.get_mapping(self.questions[0])
+        moved_mapping.multiple_choice_question = self.extra_question
+        with self.assertRaises(ValidationError), transaction.atomic():
+            moved_mapping.save()
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.get_mapping(self.questions[0]).delete()
+        with self.assertRaises(ValidationError), transaction.atomic():
+            self.questions[0].delete()
+
+        unchanged_mapping = self.get_mapping(self.questions[0])
+        unchanged_mapping.full_clean()
+        unchanged_mapping.save()
+        self.assertEqual(get_answer_key(self.exam.id).question_ids, [question.id for question in self.questions])
+
+    def test_row_exams_and_exam_deletion_are_not_locked(self):
+        row_exam = self.create_exam()
+        row_question, = self.add_questions(row_exam, [('Quant', 1)])
+        self.create_answered_session(row_exam, self.create_users(1, prefix='row')[0], {row_question: 1})
+        ExamMultipleChoiceQuestionMapping.objects.create(exam=row_exam, multiple_choice_question=self.extra_question)
+        self.create_answered_session(self.exam, self.create_users(1, prefix='packed')[0], {})
+
+        self.exam.delete()
+
+        self.assertFalse(ExamMultipleChoiceQuestionMapping.objects.filter(exam_id=self.exam.id).exists())
+
+
+class HashResolverTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        resolvers = (exam_resolver, exam_user_mapping_resolver, exam_user_multiple_choice_question_mapping_resolver)
+        for resolver in resolvers:
+            resolver._local_refs.clear()
+        now = timezone.now()
+        self.exam = self.create_exam(start_timestamp=now - timedelta(hours=1), end_timestamp=now + timedelta(hours=2))
+        self.question, = self.add_questions(self.exam, [('Quant', 1)])
+        self.user, = self.create_users(1)
+        self.exam_user_mapping = ExamUserMapping.objects.create(
+            exam=self.exam, user=self.user, end_timestamp=now + timedelta(hours=1)
+        )
+
+    def test_resolve_falls_through_local_then_redis_then_database(self):
+        with self.assertNumQueries(1):
+            ref = exam_user_mapping_resolver.resolve(self.exam_user_mapping.hash)
+        self.assertEqual((ref.id, ref.exam_id, ref.completed), (self.exam_user_mapping.id, self.exam.id, False))
+        self.assertEqual(ref.end_timestamp, self.exam_user_mapping.end_timestamp)
+
+        with self.assertNumQueries(0):
+            self.assertEqual(exam_user_mapping_resolver.resolve(self.exam_user_mapping.hash), ref)
+        exam_user_mapping_resolver._local_refs.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(exam_user_mapping_resolver.resolve(self.exam_user_mapping.hash), ref)
+
+        with self.assertNumQueries(1):
+            self.assertIsNone(exam_user_mapping_resolver.resolve('missing'))
+        self.assertIsNone(exam_user_mapping_resolver.resolve(None))
+
+    def test_old_shape_payloads_are_misses(self):
+        get_redis_client().set(exam_resolver._get_cache_key(self.exam.hash), '[1, "stale"]')
+
+        with self.assertNumQueries(1):
+            ref = exam_resolver.resolve(self.exam.hash)
+
+        self.assertEqual((ref.id, ref.title), (self.exam.id, self.exam.title))
+        exam_resolver._local_refs.clear()
+        with self.assertNumQueries(0):
+            self.assertEqual(exam_resolver.resolve(self.exam.hash), ref)
+
+    def test_save_and_delete_invalidate_on_commit(self):
+        exam_resolver.resolve(self.exam.hash)
+        self.exam.title = 'Mock XAT'
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exam.save()
+        self.assertEqual(exam_resolver.resolve(self.exam.hash).title, 'Mock XAT')
+
+        exam_user_mapping_hash = self.exam_user_mapping.hash
+        exam_user_mapping_resolver.resolve(exam_user_mapping_hash)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.exam_user_mapping.delete()
+        self.assertIsNone(exam_user_mapping_resolver.resolve(exam_user_mapping_hash))
+
+    def test_bulk_force_complete_invalidates_on_commit(self):
+        self.assertFalse(exam_user_mapping_resolver.resolve(self.exam_user_mapping.hash).completed)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            force_complete_exam_user_mappings(self.exam)
+
+        self.assertTrue(exam_user_mapping_resolver.resolve(self.exam_user_mapping.hash).completed)
+
+    @override_settings(ANSWER_BUFFER_BACKEND='local')
+    def test_warm_submit_runs_no_queries(self):
+        patcher = mock.patch('tests.answer_buffer._local_answer_buffer', LocalAnswerBuffer())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        client = APIClient()
+        client.force_authenticate(self.user)
+        row = ExamUserMultipleChoiceQuestionMapping.objects.get(exam_user_mapping=self.exam_user_mapping)
+        url = reverse('tests:exam-user-mcq-submit', args=[row.hash])
+
+        self.assertEqual(client.put(url, {'selected_choice': 1}, format='json').status_code, 200)
+        with self.assertNumQueries(0):
+            response = client.put(url, {'selected_choice': 2}, format='json')
+
+        self.assertEqual(response.status_code, 200)
+
+
+@override_settings(ADMISSION_CONTROL_BACKEND='local', ADMISSION_RATE=1, ADMISSION_BURST=1)
+class ExamStartAdmissionTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        self.admission_controller = LocalAdmissionController()
+        patcher = mock.patch('tests.admission._local_admission_controller', self.admission_controller)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        now = timezone.now()
+        self.exam = self.create_exam(start_timestamp=now - timedelta(hours=1), end_timestamp=now + timedelta(hours=2))
+        self.add_questions(self.exam, [('Quant', 1)])
+        self.url = reverse('tests:exam-user-mapping-create', args=[self.exam.hash])
+
+    def start(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client.post(self.url)
+
+    def test_queued_retries_run_no_queries(self):
+        first, second = self.create_users(2)
+        self.assertEqual(self.start(first).status_code, 201)
+        self.assertEqual(self.start(second).status_code, 202)
+
+        with self.assertNumQueries(0):
+            response = self.start(second)
+
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual((response.data['position'], response['Retry-After']), (1, '1'))
+
+    def test_started_candidates_do_not_take_a_slot(self):
+        first, second, third = self.create_users(3)
+        self.assertEqual(self.start(first).status_code, 201)
+        self.assertEqual(self.start(second).data['position'], 1)
+
+        response = self.start(first)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.start(third).data['position'], 2)
+        self.assertEqual(ExamUserMapping.objects.filter(exam=self.exam).count(), 1)
+
+
+@override_settings(ADMISSION_RATE=2, ADMISSION_BURST=3)
+class AdmissionControllerTests(TestCase):
+    # Two admissions a second after a burst of three; both controllers must agree.
+    now = 1000.0
+
+    def get_controllers(self):
+        return [LocalAdmissionController(), RedisAdmissionController(get_redis_client())]
+
+    def admit_all(self, admission_controller, exam_id, user_ids, now):
+        return [admission_controller.admit(exam_id, user_id, now=now) for user_id in user_ids]
+
+    def test_burst_is_admitted_then_queued_in_arrival_order(self):
+        for admission_controller in self.get_controllers():
+            with self.subTest(type(admission_controller).__name__):
+                admissions = self.admit_all(admission_controller, generate_random_uuid(), range(7), self.now)
+
+                self.assertEqual(
+                    [(admission.admitted, admission.position, admission.retry_after) for admission in admissions],
+                    [(True, 0, 0)] * 3 + [(False, 1, 1), (False, 2, 1), (False, 3, 2), (False, 4, 2)],
+                )
+                self.assertEqual([admission.admit_at for admission in admissions[3:]], [1000.5, 1001.0, 1001.5, 1002.0])
+
+    def test_asking_again_keeps_the_reservation(self):
+        for admission_controller in self.get_controllers():
+            with self.subTest(type(admission_controller).__name__):
+                exam_id = generate_random_uuid()
+                self.admit_all(admission_controller, exam_id, range(5), self.now)
+
+                early = admission_controller.admit(exam_id, 4, now=self.now + 0.5)
+                late_arrival = admission_controller.admit(exam_id, 5, now=self.now + 0.5)
+                admitted = admission_controller.admit(exam_id, 4, now=self.now + 1.5)
+
+                self.assertEqual((early.admitted, early.admit_at, early.requested_at), (False, 1001.0, self.now))
+                self.assertEqual(early.position, 1)
+                self.assertEqual(late_arrival.admit_at, 1001.5)
+                self.assertEqual(
+                    (admitted.admitted, admitted.admit_at, admitted.requested_at), (True, 1001.0, self.now)
+                )
+                self.assertFalse(admission_controller.admit(exam_id, 6, now=self.now + 1.5).admitted)
+
+    def test_bucket_refills_and_exams_are_independent(self):
+        for admission_controller in self.get_controllers():
+            with self.subTest(type(admission_controller).__name__):
+                exam_id = generate_random_uuid()
+                self.admit_all(admission_controller, exam_id, range(3), self.now)
+
+                self.assertTrue(admission_controller.admit(generate_random_uuid(), 0, now=self.now).admitted)
+                self.assertFalse(admission_controller.admit(exam_id, 3, now=self.now).admitted)
+                self.assertTrue(all(
+                    admission.admitted
+                    for admission in self.admit_all(admission_controller, exam_id, range(10, 13), self.now + 10)
+                ))
+
+    def test_session_window_absorbs_queue_time(self):
+        admission_controller = LocalAdmissionController()
+        exam_id = generate_random_uuid()
+        self.admit_all(admission_controller, exam_id, range(3), self.now)
+        admission_controller.admit(exam_id, 3, now=self.now)
+        admission = admission_controller.admit(exam_id, 3, now=self.now + 40)
+        requested_at = get_requested_at(admission)
+        admitted_at = requested_at + timedelta(seconds=40)
+
+        start_timestamp, end_timestamp = get_session_window(60, now=admitted_at, requested_at=requested_at)
+
+        self.assertEqual(start_timestamp, requested_at + timedelta(minutes=1))
+        self.assertEqual(end_timestamp, start_timestamp + timedelta(minutes=60, seconds=30))
+        start_timestamp, _ = get_session_window(60, now=requested_at + timedelta(minutes=5), requested_at=requested_at)
+        self.assertEqual(start_timestamp, requested_at + timedelta(minutes=5))
+        self.assertEqual(get_session_window(60, now=admitted_at)[0], admitted_at + timedelta(minutes=1))
+
+
+class ProvisioningTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.exam = self.create_exam(start_timestamp=now - timedelta(hours=1), end_timestamp=now + timedelta(hours=2))
+        self.questions = self.add_questions(self.exam, [('Quant', 1), ('Verbal', 2)])
+        self.registered, self.walk_in = self.create_users(2)
+        register_exam_candidates(self.exam.id, [self.registered.id, self.walk_in.id])
+
+    def start(self, user):
+        client = APIClient()
+        client.force_authenticate(user)
+        return client, client.post(reverse('tests:exam-user-mapping-create', args=[self.exam.hash]))
+
+    def get_rows(self, user):
+        return ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam=self.exam, exam_user_mapping__user=user
+        ).order_by('multiple_choice_question_id')
+
+    def test_provision_then_start_then_submit(self):
+        self.assertEqual(self.start(self.walk_in)[1].status_code, 201)
+
+        self.assertEqual(provision_exam_registrations(self.exam.id), 1)
+
+        self.assertFalse(ExamRegistration.objects.filter(exam=self.exam, provisioned_at__isnull=True).exists())
+        exam_user_mapping = ExamUserMapping.objects.get(exam=self.exam, user=self.registered)
+        self.assertFalse(exam_user_mapping.activated)
+        self.assertEqual(self.get_rows(self.registered).count(), 2)
+        self.assertEqual(self.get_rows(self.walk_in).count(), 2)
+
+        client, response = self.start(self.registered)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(ExamUserMapping.objects.filter(exam=self.exam).count(), 2)
+        exam_user_mapping.refresh_from_db()
+        self.assertTrue(exam_user_mapping.activated)
+        self.assertEqual(self.start(self.registered)[1].status_code, 200)
+
+        row = self.get_rows(self.registered).first()
+        response = client.put(
+            reverse('tests:exam-user-mcq-submit', args=[row.hash]), {'selected_choice': 1}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        row.refresh_from_db()
+        self.assertEqual((row.selected_choice, row.is_correct), (1, True))
+
+    def test_provisioning_retries_a_batch_when_a_candidate_walks_in(self):
+        walk_ins = []
+
+        def walk_in_after_check(exam_id, user_ids):
+            if not walk_ins:
+                walk_ins.append(create_walk_in_exam_user_mapping(self.exam.id, self.walk_in, self.exam.duration))
+                return set()
+            return get_started_user_ids(exam_id, user_ids)
+
+        with mock.patch('tests.utils.get_started_user_ids', side_effect=walk_in_after_check):
+            self.assertEqual(provision_exam_registrations(self.exam.id), 1)
+
+        exam_user_mapping = ExamUserMapping.objects.get(exam=self.exam, user=self.walk_in)
+        self.assertEqual(exam_user_mapping, walk_ins[0][0])
+        self.assertTrue(exam_user_mapping.activated)
+        self.assertFalse(ExamUserMapping.objects.get(exam=self.exam, user=self.registered).activated)
+
+    def test_walk_in_falls_back_to_the_provisioned_session(self):
+        provision_exam_registrations(self.exam.id)
+        provisioned = ExamUserMapping.objects.get(exam=self.exam, user=self.walk_in)
+
+        exam_user_mapping, created = create_walk_in_exam_user_mapping(self.exam.id, self.walk_in, self.exam.duration)
+
+        self.assertEqual((exam_user_mapping, created), (provisioned, False))
+        self.assertEqual(self.get_rows(self.walk_in).count(), 2)
+
+
+class LiveLeaderboardTests(TestCase):
+    def get_live_leaderboards(self):
+        return [LocalLiveLeaderboard(), RedisLiveLeaderboard(get_redis_client())]
+
+    def test_position_ranks_ties_and_negative_scores(self):
+        for live_leaderboard in self.get_live_leaderboards():
+            with self.subTest(type(live_leaderboard).__name__):
+                exam_id = generate_random_uuid()
+                for exam_user_mapping_id in range(1, 6):
+                    live_leaderboard.register(exam_id, exam_user_mapping_id)
+                for exam_user_mapping_id, points in ((1, 3), (2, 3), (3, -1), (4, 2)):
+                    live_leaderboard.record_answer(exam_id, exam_user_mapping_id, 100, None, points)
+
+                positions = [
+                    live_leaderboard.position(exam_id, exam_user_mapping_id) for exam_user_mapping_id in range(1, 6)
+                ]
+
+                self.assertEqual(
+                    [(position['score'], position['rank'], position['total']) for position in positions],
+                    [(3.0, 1, 5), (3.0, 1, 5), (-1.0, 5, 5), (2.0, 3, 5), (0.0, 4, 5)],
+                )
+                self.assertEqual(positions[2]['percentile'], 20.0)
+                self.assertIsNone(live_leaderboard.position(exam_id, 6))
+
+    def test_changed_answers_move_the_score_by_the_difference(self):
+        for live_leaderboard in self.get_live_leaderboards():
+            with self.subTest(type(live_leaderboard).__name__):
+                exam_id = generate_random_uuid()
+                live_leaderboard.register(exam_id, 1, [7])
+
+                live_leaderboard.record_answer(exam_id, 1, 100, 7, 3)
+                live_leaderboard.record_answer(exam_id, 1, 100, 7, -1)
+                live_leaderboard.record_answer(exam_id, 1, 101, 7, 3)
+
+                self.assertEqual(live_leaderboard.position(exam_id, 1)['score'], 2.0)
+                self.assertEqual(live_leaderboard.position(exam_id, 1, 7)['score'], 2.0)
+
+    def test_answers_after_final_scores_are_ignored(self):
+        for live_leaderboard in self.get_live_leaderboards():
+            with self.subTest(type(live_leaderboard).__name__):
+                exam_id = generate_random_uuid()
+                live_leaderboard.register(exam_id, 1, [7])
+                live_leaderboard.record_answer(exam_id, 1, 100, 7, 3)
+
+                live_leaderboard.set_scores(exam_id, 1, 10, {7: 10})
+                self.assertEqual(live_leaderboard.record_answer(exam_id, 1, 101, 7, 3), 0)
+
+                self.assertEqual(live_leaderboard.position(exam_id, 1)['score'], 10.0)
+                self.assertEqual(live_leaderboard.position(exam_id, 1, 7)['score'], 10.0)
+
+    @override_settings(LIVE_LEADERBOARD_RETENTION=600)
+    def test_redis_answers_expire(self):
+        live_leaderboard = RedisLiveLeaderboard(get_redis_client())
+        exam_id = generate_random_uuid()
+        answers_key = live_leaderboard.get_answers_key(exam_id, 1)
+
+        live_leaderboard.record_answer(exam_id, 1, 100, None, 3)
+        self.assertTrue(0 < get_redis_client().ttl(answers_key) <= 600)
+        live_leaderboard.set_scores(exam_id, 1, 3, {})
+        self.assertTrue(0 < get_redis_client().ttl(answers_key) <= 600)
+
+
+class SessionStateTests(ExamTestCase):
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.exam = self.create_exam(start_timestamp=now - timedelta(hours=1), end_timestamp=now + timedelta(hours=2))
+        self.questions = self.add_questions(self.exam, [('Quant', 1), ('Quant', 2), ('Verbal', 3)])
+        user, = self.create_users(1)
+        self.client = APIClient()
+        self.client.force_authenticate(user)
+        response = self.client.post(reverse('tests:exam-user-mapping-create', args=[self.exam.hash]))
+        self.exam_user_mapping = ExamUserMapping.objects.get(hash=response.data['hash'])
+        self.url = reverse('tests:exam-user-mapping-detail', args=[self.exam_user_mapping.hash])
+        self.rows = list(ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam_user_mapping=self.exam_user_mapping
+        ).order_by('id'))
+
+    def submit(self, row, selected_choice):
+        response = self.client.put(
+            reverse('tests:exam-user-mcq-submit', args=[row.hash]), {'selected_choice': selected_choice}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+
+    def test_unchanged_session_is_not_modified_without_question_queries(self):
+        etag = self.client.get(self.url)['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url, HTTP_IF_NONE_MATCH=etag)
+
+        self.assertEqual((response.status_code, response['ETag']), (304, etag))
+        question_tables = (
+            ExamUserMultipleChoiceQuestionMapping._meta.db_table, MultipleChoiceQuestion._meta.db_table
+        )
+        self.assertFalse([
+            query['sql'] for query in queries.captured_queries
+            if any(f'"{table}"' in query['sql'] for table in question_tables)
+        ])
+
+        self.submit(self.rows[0], 1)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+    def test_since_returns_only_changed_rows(self):
+        state_version = self.client.get(self.url).json()['state_version']
+        self.submit(self.rows[1], 2)
+
+        response = self.client.get(self.url, {'since': state_version})
+
+        changes = response.json()
+        self.assertEqual(changes['state_version'], state_version + 1)
+        self.assertEqual(
+            [row['hash'] for row in changes['exam_user_multiple_choice_question_mappings']], [self.rows[1].hash]
+        )
+        unchanged = self.client.get(self.url, {'since': changes['state_version']}).json()
+        self.assertEqual(unchanged['exam_user_multiple_choice_question_mappings'], [])
+        self.assertEqual(self.client.get(self.url, {'since': 'x'}).status_code, 400)
+
+    def test_full_and_delta_responses_have_different_etags(self):
+        full_etag = self.client.get(self.url)['ETag']
+        delta_response = self.client.get(self.url, {'since': 0})
+
+        self.assertNotEqual(delta_response['ETag'], full_etag)
+        self.assertEqual(self.client.get(self.url, {'since': 0}, HTTP_IF_NONE_MATCH=full_etag).status_code, 200)
+        self.assertEqual(self.client.get(self.url, HTTP_IF_NONE_MATCH=delta_response['ETag']).status_code, 200)
+        self.assertEqual(
+            self.client.get(self.url, {'since': 0}, HTTP_IF_NONE_MATCH=delta_response['ETag']).status_code, 304
+        )
+        self.assertNotEqual(self.client.get(self.url, {'since': 1})['ETag'], delta_response['ETag'])
+
+
+class TrackedFieldsModelMixinTests(ExamTestCase):
+    # The tracked fields drive scoring on completion and leaderboard scheduling on exam changes.
+
+    def setUp(self):
+        super().setUp()
+        self.exam = self.create_exam()
+        self.add_questions(self.exam, [('Quant', 1)])
+        user, = self.create_users(1)
+        self.exam_user_mapping = ExamUserMapping.objects.create(
+            exam=self.exam, user=user, end_timestamp=self.exam.end_timestamp
+        )
+        patcher = mock.patch('tests.utils.update_score_for_exam_user_mapping')
+        self.update_score = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_completing_a_loaded_session_scores_it_once(self):
+        exam_user_mapping = ExamUserMapping.objects.get(pk=self.exam_user_mapping.pk)
+        exam_user_mapping.completed = True
+        exam_user_mapping.save()
+        exam_user_mapping.save()
+        exam_user_mapping.total_score = 5
+        exam_user_mapping.save(update_fields=['total_score'])
+
+        self.update_score.assert_called_once_with(exam_user_mapping)
+        self.assertFalse(exam_user_mapping.has_tracked_field_changed('completed'))
+        self.assertTrue(exam_user_mapping.get_tracked_field_value('completed'))
+
+    def test_the_created_instance_tracks_its_saved_values(self):
+        self.exam_user_mapping.completed = True
+        self.exam_user_mapping.save()
+
+        self.update_score.assert_called_once_with(self.exam_user_mapping)
+
+    def test_deferred_and_never_loaded_fields_do_not_count_as_changed(self):
+        deferred = ExamUserMapping.objects.only('id', 'exam_id', 'user_id').get(pk=self.exam_user_mapping.pk)
+        deferred.completed = True
+        deferred.save(update_fields=['completed'])
+        never_loaded = ExamUserMapping(pk=self.exam_user_mapping.pk, completed=True)
+        never_loaded.save(update_fields=['completed'])
+
+        self.update_score.assert_not_called()
+        self.assertFalse(deferred.has_tracked_field_changed('completed'))
+        self.assertFalse(never_loaded.has_tracked_field_changed('completed'))
+
+    def test_refresh_from_db_updates_only_the_refreshed_fields(self):
+        exam_user_mapping = ExamUserMapping.objects.get(pk=self.exam_user_mapping.pk)
+        ExamUserMapping.objects.filter(pk=exam_user_mapping.pk).update(completed=True)
+
+        exam_user_mapping.refresh_from_db(fields=['total_score'])
+        self.assertFalse(exam_user_mapping.get_tracked_field_value('completed'))
+        exam_user_mapping.refresh_from_db(fields=['completed'])
+
+        self.assertTrue(exam_user_mapping.get_tracked_field_value('completed'))
+        exam_user_mapping.save()
+        self.update_score.assert_not_called()
+
+    def test_only_end_timestamp_changes_reschedule_the_leaderboard(self):
+        compute_exam_leaderboard.apply_async.reset_mock()
+        exam = Exam.objects.get(pk=self.exam.pk)
+        exam.title = 'Mock XAT'
+        exam.save()
+        compute_exam_leaderboard.apply_async.assert_not_called()
+
+        exam.end_timestamp += timedelta(minutes=30)
+        exam.save()
+
+        compute_exam_leaderboard.apply_async.assert_called_once_with(
+            (exam.id,), eta=exam.end_timestamp + timedelta(minutes=5)
+        )
+
+    def test_hash_pre_save_is_connected_per_hash_model(self):
+        dispatch_uids = {lookup_key[0] for lookup_key, _, _ in pre_save.receivers}
+        for model in apps.get_models():
+            with self.subTest(model._meta.label):
+                self.assertEqual(
+                    f'handle_models_with_hash_pre_save:{model._meta.label}' in dispatch_uids,
+                    issubclass(model, HashModelMixin),
+                )
+
+        topic = Topic.objects.create(title='Logic')
+        topic_hash = topic.hash
+        topic.save()
+        self.assertTrue(topic_hash)
+        self.assertEqual(Topic.objects.get(pk=topic.pk).hash, topic_hash)
+
+
+class AsyncSessionViewTests(ExamTestCase):
+    # The ASGI app serves the session endpoints from tests.async_views; each request is sent to both
+    # the DRF view and its async counterpart, which must answer the same way.
+
+    def setUp(self):
+        super().setUp()
+        now = timezone.now()
+        self.exam = self.create_exam(start_timestamp=now - timedelta(hours=1), end_timestamp=now + timedelta(hours=2))
+        self.add_questions(self.exam, [('Quant', 1), ('Quant', 2), ('Verbal', 3)])
+        self.started, self.registered = self.create_users(2)
+        register_exam_candidates(self.exam.id, [self.registered.id])
+        provision_exam_registrations(self.exam.id)
+        self.client = APIClient()
+        self.client.force_authenticate(self.started)
+        response = self.client.post(reverse('tests:exam-user-mapping-create', args=[self.exam.hash]))
+        self.exam_user_mapping = ExamUserMapping.objects.get(hash=response.data['hash'])
+        self.url = reverse('tests:exam-user-mapping-detail', args=[self.exam_user_mapping.hash])
+        self.rows = self.get_rows(self.exam_user_mapping)
+
+    @staticmethod
+    def get_rows(exam_user_mapping):
+        return list(ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam_user_mapping=exam_user_mapping
+        ).order_by('id'))
+
+    @override_settings(ROOT_URLCONF=settings.ASGI_ROOT_URLCONF)
+    def request_async(self, method, path, **kwargs):
+        return async_to_sync(getattr(self.async_client, method))(path, **kwargs)
+
+    def request_both(self, method, path, data=None, **kwargs):
+        if method == 'put':
+            kwargs['content_type'] = 'application/json'
+        sync_response = getattr(self.client, method)(path, data, **kwargs)
+        async_response = self.request_async(method, path, data=data, **kwargs)
+        self.assertEqual(async_response.status_code, sync_response.status_code)
+        self.assertEqual(async_response.get('ETag'), sync_response.get('ETag'))
+        if sync_response.content:
+            self.assertEqual(async_response.json(), sync_response.json())
+        return sync_response
+
+    def submit_url(self, row):
+        return reverse('tests:exam-user-mcq-submit', args=[row.hash])
+
+    def test_detail_not_modified_and_since_match(self):
+        etag = self.request_both('get', self.url)['ETag']
+        self.assertEqual(self.request_both('get', self.url, headers={'If-None-Match': etag}).status_code, 304)
+        self.assertEqual(self.request_both('get', self.url, {'since': 0}).status_code, 200)
+        self.assertEqual(self.request_both('get', self.url, {'since': 'x'}).status_code, 400)
+        self.assertEqual(
+            self.request_both('get', reverse('tests:exam-user-mapping-detail', args=['missing'])).status_code, 404
+        )
+
+    def test_submit_and_completion_match(self):
+        response = self.request_both('put', self.submit_url(self.rows[0]), {'selected_choice': 1})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.request_both('put', self.submit_url(self.rows[1]), {}).status_code, 400)
+        self.assertEqual(
+            self.request_both(
+                'put', reverse('tests:exam-user-mcq-submit', args=['missing']), {'selected_choice': 1}
+            ).status_code,
+            400,
+        )
+        self.rows[0].refresh_from_db()
+        self.assertEqual(self.rows[0].selected_choice, 1)
+        self.request_both('get', self.url, {'since': 0})
+
+        response = self.request_async('put', self.url)
+        self.assertEqual((response.status_code, response.json()['message']), (200, 'Exam marked as completed.'))
+        self.exam_user_mapping.refresh_from_db()
+        self.assertTrue(self.exam_user_mapping.completed)
+        self.assertEqual(self.request_both('put', self.url).status_code, 400)
+        response = self.request_both('put', self.submit_url(self.rows[1]), {'selected_choice': 2})
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.request_both('get', self.url).status_code, 200)
+
+    def test_not_activated_and_expired_sessions_match(self):
+        exam_user_mapping = ExamUserMapping.objects.get(exam=self.exam, user=self.registered)
+        self.assertFalse(exam_user_mapping.activated)
+        row = self.get_rows(exam_user_mapping)[0]
+        url = reverse('tests:exam-user-mapping-detail', args=[exam_user_mapping.hash])
+        self.assertEqual(self.request_both('get', url).json(), {'message': 'Exam not started yet.'})
+        self.assertEqual(self.request_both('put', url).status_code, 400)
+        self.assertEqual(self.request_both('put', self.submit_url(row), {'selected_choice': 1}).status_code, 400)
 
-# Create your tests here.
+        with mock.patch('django.utils.timezone.now', return_value=self.exam.end_timestamp + timedelta(minutes=1)):
+            response = self.request_both('put', self.submit_url(self.rows[0]), {'selected_choice': 1})
+        self.assertEqual(response.status_code, 400)
+        self.rows[0].refresh_from_db()
+        self.assertIsNone(self.rows[0].selected_choice)
@@ -2,8 +2,13 @@ from django.urls import path
 
 from .views import (
     ExamLeaderboardView,
+    ExamLiveLeaderboardView,
+    ExamRegistrationView,
+    ExamResultPredictView,
+    ExamResultsExportView,
     ExamUserMappingCreateView,
     ExamUserMappingDetailView,
+    ExamUserMappingLiveRankView,
     ExamUserMultipleChoiceQuestionMappingSubmitView,
 )
 
@@ -15,6 +20,11 @@ urlpatterns = [
           ExamUserMappingCreateView.as_view(),
           name="exam-user-mapping-create",
       ),
+      path(
+          "exams/<str:hash_exam>/register/",
+          ExamRegistrationView.as_view(),
+          name="exam-registration",
+      ),
       path(
           "exam-user-mappings/<str:hash_exam_user_mapping>/",
           ExamUserMappingDetailView.as_view(),
@@ -30,5 +40,25 @@ urlpatterns = [
           ExamLeaderboardView.as_view(),
           name="exam-leaderboard",
       ),
+      path(
+          "exams/<str:hash_exam>/leaderboard/live/",
+          ExamLiveLeaderboardView.as_view(),
+          name="exam-live-leaderboard",
+      ),
+      path(
+          "exams/<str:hash_exam>/export/",
+          ExamResultsExportView.as_view(),
+          name="exam-results-export",
+      ),
+      path(
+          "exam-user-mappings/<str:hash_exam_user_mapping>/live-rank/",
+          ExamUserMappingLiveRankView.as_view(),
+          name="exam-user-mapping-live-rank",
+      ),
+      path(
+          "exam-user-mappings/<str:hash_exam_user_mapping>/predict/",
+          ExamResultPredictView.as_view(),
+          name="exam-result-predict",
+      ),
   ]
 
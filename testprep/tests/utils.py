@@ -1,173 +1,361 @@
+import logging
 from collections import defaultdict
+from datetime import timedelta
+from functools import partial
+
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from testprep.utils import QueryStats, generate_random_uuid
+from tests.answer_buffer import apply_session_answer_buffer, get_answer_buffer
+from tests.answer_keys import get_answer_key
+from tests.answer_sheets import build_empty_answer_sheet
+from tests.live_leaderboard import publish_live_session_scores, register_live_session
+from tests.predictions import compile_prediction
+from tests.profiles import PerformanceProfileAccumulator
+from tests.resolvers import exam_user_mapping_resolver
+from tests.scoring import add_missing_topic_titles, calculate_scores
+from tests.session_state import bump_session_state_versions
+from tests.signals import exam_user_multiple_choice_question_mappings_created
+from tests.models import Exam, ExamRegistration, ExamUserMapping, ExamUserMultipleChoiceQuestionMapping
 
-from numpy import interp
-from cacheops import cached_as
-from django.db import transaction
-from django.db.models import FloatField, F, Window
-from django.db.models.fields.json import KeyTextTransform
-from django.db.models.functions import Cast, Rank
+from tests.models import UserExamTypeProfile, UserTopicPerformanceProfile
 
-from tests.enums import ExamType
-from tests.models import ExamUserMapping, ExamUserMultipleChoiceQuestionMapping, Topic
+logger = logging.getLogger(__name__)
 
-from tests.models import UserExamTypeProfile, UserTopicPerformanceProfile
+PROVISIONING_BATCH_SIZE = 1000
 
 
 def update_score_for_exam_user_mapping(exam_user_mapping: ExamUserMapping):
     exam = exam_user_mapping.exam
-    exam_user_multiple_choice_question_mappings = ExamUserMultipleChoiceQuestionMapping.objects.filter(
-        exam_user_mapping=exam_user_mapping,
-        completed=True
-    ).select_related('multiple_choice_question__topic')
-
-    correct_answer_multiplier = ExamType.get_marks_per_correct(exam.exam_type)
-    incorrect_answer_multiplier = ExamType.get_negative_marks_per_wrong(exam.exam_type)
-
-    score_dict = defaultdict(lambda: {'correct': 0, 'incorrect': 0})
-    total_score = 0
-    for exam_user_multiple_choice_question_mapping in exam_user_multiple_choice_question_mappings:
-        topic = exam_user_multiple_choice_question_mapping.multiple_choice_question.topic
-        correct = exam_user_multiple_choice_question_mapping.get_is_correct()
-        if correct is True:
-            score_dict[topic.title]['correct']  += 1
-            total_score += correct_answer_multiplier
-        elif correct is False:
-            score_dict[topic.title]['incorrect']  += 1
-            total_score -= incorrect_answer_multiplier
-
-    subject_scores = {}
-    for topic_title in score_dict:
-        correct_count = score_dict[topic_title].get('correct', 0)
-        incorrect_count = score_dict[topic_title].get('incorrect', 0)
-        score = correct_count * correct_answer_multiplier - incorrect_count * incorrect_answer_multiplier
-        subject_scores[topic_title] = score
-
-        topic = Topic.objects.get(title=topic_title)
-        user_topic_performance_profile, _ = UserTopicPerformanceProfile.objects.get_or_create(
-            user=exam_user_mapping.user,
-            topic=topic
+    answer_key = get_answer_key(exam.id)
+
+    if exam_user_mapping.answer_sheet is not None:
+        topic_counts, = answer_key.answer_sheet_grader.get_topic_counts(
+            [exam_user_mapping.answer_sheet], [exam_user_mapping.answer_attempts]
         )
-        user_topic_performance_profile.total_questions_attempted = correct_count + incorrect_count + (user_topic_performance_profile.total_questions_attempted or 0)
-        user_topic_performance_profile.correct_answers = correct_count + (user_topic_performance_profile.correct_answers or 0)
-        user_topic_performance_profile.save(update_fields=['total_questions_attempted', 'correct_answers'])
+    else:
+        exam_user_multiple_choice_question_mappings = ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam_id=exam.id,
+            exam_user_mapping=exam_user_mapping,
+            is_completed=True
+        ).only('id', 'exam_user_mapping_id', 'multiple_choice_question_id', 'selected_choice', 'input_puzzle_answer')
+
+        topic_counts = defaultdict(lambda: {'correct': 0, 'incorrect': 0})
+        for exam_user_multiple_choice_question_mapping in exam_user_multiple_choice_question_mappings:
+            topic_id = answer_key.get_topic_id(exam_user_multiple_choice_question_mapping.multiple_choice_question_id)
+            correct = exam_user_multiple_choice_question_mapping.get_is_correct(answer_key=answer_key)
+            if correct is True:
+                topic_counts[topic_id]['correct'] += 1
+            elif correct is False:
+                topic_counts[topic_id]['incorrect'] += 1
+
+    topic_titles = dict(answer_key.topic_titles)
+    add_missing_topic_titles(topic_titles, topic_counts)
+    total_score, subject_scores = calculate_scores(exam.exam_type, topic_counts, topic_titles)
+    exam_user_mapping.total_score = total_score
+    exam_user_mapping.subject_scores = subject_scores
+    ExamUserMapping.objects.filter(pk=exam_user_mapping.pk).update(
+        total_score=total_score,
+        subject_scores=subject_scores,
+    )
+    publish_live_session_scores(exam.id, exam_user_mapping.id, total_score, subject_scores, topic_titles)
 
+    performance_profile_accumulator = PerformanceProfileAccumulator()
+    performance_profile_accumulator.add_session(exam_user_mapping.user_id, exam.exam_type, total_score, topic_counts)
+    performance_profile_accumulator.apply()
 
-    user_exam_type_profile, _ = UserExamTypeProfile.objects.get_or_create(
-        user=exam_user_mapping.user,
-        exam_type=exam.exam_type
-    )
-    user_exam_type_profile.total_tests_taken = (user_exam_type_profile.total_tests_taken or 0) + 1
-    previous_average_score = user_exam_type_profile.average_score or 0
-    user_exam_type_profile.average_score = (
-        (previous_average_score * (user_exam_type_profile.total_tests_taken - 1)) + total_score
-    ) / user_exam_type_profile.total_tests_taken
-    if user_exam_type_profile.highest_score is None or total_score > user_exam_type_profile.highest_score:
-        user_exam_type_profile.highest_score = total_score
-    user_exam_type_profile.save(update_fields=['total_tests_taken', 'average_score', 'highest_score'])
 
+def create_exam_user_multiple_choice_question_mappings(exam_user_mapping: ExamUserMapping):
+    with QueryStats() as provisioning_stats:
+        exam = exam_user_mapping.exam
 
+        multiple_choice_question_ids = exam.exam_multiple_choice_question_mappings.values_list(
+            'multiple_choice_question_id', flat=True
+        )
+        topic_ids = exam.exam_topic_mapping.values_list('topic_id', flat=True)
 
+        with transaction.atomic():
+            if exam.packed_answer_sheets:
+                exam_user_mapping.answer_sheet, exam_user_mapping.answer_attempts = build_empty_answer_sheet(
+                    len(get_answer_key(exam.id).question_ids)
+                )
+                ExamUserMapping.objects.filter(pk=exam_user_mapping.pk).update(
+                    answer_sheet=exam_user_mapping.answer_sheet,
+                    answer_attempts=exam_user_mapping.answer_attempts,
+                )
+                exam_user_multiple_choice_question_mappings = []
+            else:
+                exam_user_multiple_choice_question_mappings = ExamUserMultipleChoiceQuestionMapping.objects.bulk_create(
+                    [
+                        ExamUserMultipleChoiceQuestionMapping(
+                            hash=generate_random_uuid(),
+                            exam_id=exam.id,
+                            exam_user_mapping=exam_user_mapping,
+                            multiple_choice_question_id=multiple_choice_question_id,
+                        )
+                        for multiple_choice_question_id in multiple_choice_question_ids
+                    ],
+                    batch_size=PROVISIONING_BATCH_SIZE,
+                )
 
-def create_exam_user_multiple_choice_question_mappings(exam_user_mapping: ExamUserMapping):
-    exam = exam_user_mapping.exam
+            UserExamTypeProfile.objects.bulk_create(
+                [
+                    UserExamTypeProfile(
+                        hash=generate_random_uuid(),
+                        user_id=exam_user_mapping.user_id,
+                        exam_type=exam.exam_type,
+                    )
+                ],
+                ignore_conflicts=True,
+            )
 
-    multiple_choice_question_ids = exam.exam_multiple_choice_question_mappings.values_list('multiple_choice_question_id', flat=True)
-    exam_user_multiple_choice_question_mappings = []
+            UserTopicPerformanceProfile.objects.bulk_create(
+                [
+                    UserTopicPerformanceProfile(
+                        hash=generate_random_uuid(),
+                        user_id=exam_user_mapping.user_id,
+                        topic_id=topic_id,
+                    )
+                    for topic_id in topic_ids
+                ],
+                ignore_conflicts=True,
+                batch_size=PROVISIONING_BATCH_SIZE,
+            )
 
-    with transaction.atomic():
-        for multiple_choice_question_id in multiple_choice_question_ids:
-            exam_user_multiple_choice_question_mapping = ExamUserMultipleChoiceQuestionMapping.objects.create(
-                exam_user_mapping=exam_user_mapping,
-                multiple_choice_question_id=multiple_choice_question_id
+            register_live_session(exam.id, exam_user_mapping.id, topic_ids)
+            exam_user_multiple_choice_question_mappings_created.send(
+                sender=ExamUserMultipleChoiceQuestionMapping, instances=exam_user_multiple_choice_question_mappings,
             )
-            exam_user_multiple_choice_question_mappings.append(exam_user_multiple_choice_question_mapping)
 
-    UserExamTypeProfile.objects.get_or_create(
-        user=exam_user_mapping.user,
-        exam_type=exam.exam_type
+    exam_user_mapping.provisioning_stats = provisioning_stats.as_dict()
+    logger.info(
+        'Provisioned exam user mapping %s: %s',
+        exam_user_mapping.id,
+        exam_user_mapping.provisioning_stats,
     )
+    return exam_user_mapping.provisioning_stats
 
-    topic_ids = exam.exam_topic_mappings.values_list('topic_id', flat=True)
-    for topic_id in topic_ids:
-        UserTopicPerformanceProfile.objects.get_or_create(
-            user=exam_user_mapping.user,
-            topic_id=topic_id
-        )
 
+def get_session_window(duration, now=None, requested_at=None):
+    # The minute of grace counts from the first start request, so time spent queued for admission
+    # is taken out of it rather than added on top.
+    now = now or timezone.now()
+    start_timestamp = max((requested_at or now) + timedelta(minutes=1), now)
+    end_timestamp = start_timestamp + timedelta(minutes=duration) + timedelta(seconds=30)
+    return start_timestamp, end_timestamp
 
 
-def get_subject_leaderboard_queryset(exam_id: int, topic_title: str):
-
-    @cached_as(ExamUserMapping.objects.filter(exam_id=exam_id))
-    def _get_subject_leaderboard_queryset(exam_id: int, topic_title: str):
-        return (
-            ExamUserMapping.objects.filter(exam_id=exam_id)
-            .exclude(subject_percentiles__isnull=True)
-            .annotate(
-                subj_percentile=Cast(
-                    KeyTextTransform(topic_title, F("subject_percentiles")),
-                    FloatField(),
-                )
-            )
-            .annotate(
-                rank=Window(
-                    expression=Rank(),
-                    order_by=F("subj_percentile").desc(),
-                )
-            )
-            .select_related("user")
-            .order_by("subj_rank")
-        )
+def register_exam_candidates(exam_id, user_ids):
+    ExamRegistration.objects.bulk_create(
+        [ExamRegistration(exam_id=exam_id, user_id=user_id) for user_id in user_ids],
+        ignore_conflicts=True,
+        batch_size=PROVISIONING_BATCH_SIZE,
+    )
 
-    return _get_subject_leaderboard_queryset(exam_id, topic_title)
 
+def get_started_user_ids(exam_id, user_ids):
+    return set(
+        ExamUserMapping.objects.filter(exam_id=exam_id, user_id__in=user_ids).values_list('user_id', flat=True)
+    )
 
-def _interpolate(x, x_points, y_points):
 
-    if not x_points or not y_points:
-        return None
+def create_provisioned_exam_user_mappings(exam_id, user_ids, answer_sheet, answer_attempts):
+    # A candidate can walk in between reading the started sessions and the insert, which then hits the
+    # unique (exam, user) constraint; the batch is retried without them.
+    started_user_ids = get_started_user_ids(exam_id, user_ids)
+    while True:
+        try:
+            with transaction.atomic():
+                return ExamUserMapping.objects.bulk_create([
+                    ExamUserMapping(
+                        hash=generate_random_uuid(),
+                        exam_id=exam_id,
+                        user_id=user_id,
+                        activated=False,
+                        answer_sheet=answer_sheet,
+                        answer_attempts=answer_attempts,
+                    )
+                    for user_id in user_ids
+                    if user_id not in started_user_ids
+                ])
+        except IntegrityError:
+            rechecked_user_ids = get_started_user_ids(exam_id, user_ids)
+            if rechecked_user_ids <= started_user_ids:
+                raise
+            started_user_ids = rechecked_user_ids
+
+
+def create_walk_in_exam_user_mapping(exam_id, user, duration, requested_at=None):
+    # Returns the session and whether it was created here. Provisioning may have created the session
+    # since the caller looked, in which case that one is returned to be started instead.
+    start_timestamp, end_timestamp = get_session_window(duration, requested_at=requested_at)
+    try:
+        with transaction.atomic():
+            exam_user_mapping = ExamUserMapping.objects.create(
+                exam_id=exam_id,
+                user=user,
+                start_timestamp=start_timestamp,
+                end_timestamp=end_timestamp,
+            )
+    except IntegrityError:
+        exam_user_mapping = ExamUserMapping.objects.filter(exam_id=exam_id, user=user).first()
+        if exam_user_mapping is None:
+            raise
+        return exam_user_mapping, False
+    return exam_user_mapping, True
+
+
+def provision_exam_registrations(exam_id, batch_size=PROVISIONING_BATCH_SIZE):
+    # Creates the sessions and question rows of registered candidates ahead of the exam. The sessions
+    # stay inactive until the candidate starts; candidates who already walked in are only marked.
+    with QueryStats() as provisioning_stats:
+        exam = Exam.objects.only('id', 'exam_type', 'packed_answer_sheets').get(id=exam_id)
+        multiple_choice_question_ids = list(
+            exam.exam_multiple_choice_question_mappings.values_list('multiple_choice_question_id', flat=True)
+        )
+        answer_sheet = answer_attempts = None
+        if exam.packed_answer_sheets:
+            answer_sheet, answer_attempts = build_empty_answer_sheet(len(get_answer_key(exam.id).question_ids))
+        topic_ids = list(exam.exam_topic_mapping.values_list('topic_id', flat=True))
+
+        provisioned = 0
+        while True:
+            with transaction.atomic():
+                registrations = list(
+                    ExamRegistration.objects.select_for_update(skip_locked=True)
+                    .filter(exam_id=exam.id, provisioned_at__isnull=True)
+                    .order_by('id')
+                    .values_list('id', 'user_id')[:batch_size]
+                )
+                if not registrations:
+                    break
 
-    x_points = list(map(float, x_points))
-    y_points = list(map(float, y_points))
-    x_points, y_points = zip(*sorted(zip(x_points, y_points)))
+                user_ids = [user_id for _, user_id in registrations]
+                exam_user_mappings = create_provisioned_exam_user_mappings(
+                    exam.id, user_ids, answer_sheet, answer_attempts
+                )
+                exam_user_multiple_choice_question_mappings = []
+                if not exam.packed_answer_sheets:
+                    exam_user_multiple_choice_question_mappings = ExamUserMultipleChoiceQuestionMapping.objects.bulk_create(
+                        [
+                            ExamUserMultipleChoiceQuestionMapping(
+                                hash=generate_random_uuid(),
+                                exam_id=exam.id,
+                                exam_user_mapping=exam_user_mapping,
+                                multiple_choice_question_id=multiple_choice_question_id,
+                            )
+                            for exam_user_mapping in exam_user_mappings
+                            for multiple_choice_question_id in multiple_choice_question_ids
+                        ],
+                        batch_size=PROVISIONING_BATCH_SIZE,
+                    )
+                UserExamTypeProfile.objects.bulk_create(
+                    [
+                        UserExamTypeProfile(hash=generate_random_uuid(), user_id=user_id, exam_type=exam.exam_type)
+                        for user_id in user_ids
+                    ],
+                    ignore_conflicts=True,
+                    batch_size=PROVISIONING_BATCH_SIZE,
+                )
+                UserTopicPerformanceProfile.objects.bulk_create(
+                    [
+                        UserTopicPerformanceProfile(hash=generate_random_uuid(), user_id=user_id, topic_id=topic_id)
+                        for user_id in user_ids
+                        for topic_id in topic_ids
+                    ],
+                    ignore_conflicts=True,
+                    batch_size=PROVISIONING_BATCH_SIZE,
+                )
+                ExamRegistration.objects.filter(
+                    id__in=[registration_id for registration_id, _ in registrations]
+                ).update(provisioned_at=timezone.now())
+                exam_user_multiple_choice_question_mappings_created.send(
+                    sender=ExamUserMultipleChoiceQuestionMapping, instances=exam_user_multiple_choice_question_mappings,
+                )
+            provisioned += len(exam_user_mappings)
 
-    if x <= x_points[0]:
-        slope = (y_points[1] - y_points[0]) / (x_points[1] - x_points[0])
-        return y_points[0] + slope * (x - x_points[0])
-    elif x >= x_points[-1]:
-        slope = (y_points[-1] - y_points[-2]) / (x_points[-1] - x_points[-2])
-        return y_points[-1] + slope * (x - x_points[-1])
-    else:
-        return float(interp(x, x_points, y_points))
+    logger.info('Provisioned %s registered sessions for exam %s: %s', provisioned, exam_id, provisioning_stats.as_dict())
+    return provisioned
 
 
-def predict_rank_from_score_and_percentile(score , past_stats):
+def activate_exam_user_mapping(exam_user_mapping, duration, requested_at=None):
+    # Starting a pre-provisioned session only sets its window; the rows already exist.
+    start_timestamp, end_timestamp = get_session_window(duration, requested_at=requested_at)
+    with transaction.atomic():
+        activated = ExamUserMapping.objects.filter(id=exam_user_mapping.id, activated=False).update(
+            activated=True,
+            start_timestamp=start_timestamp,
+            end_timestamp=end_timestamp,
+        )
+        if activated:
+            bump_session_state_versions([exam_user_mapping.id])
+            register_live_session(
+                exam_user_mapping.exam_id, exam_user_mapping.id, get_answer_key(exam_user_mapping.exam_id).topic_titles
+            )
+            exam_user_mapping_resolver.invalidate_on_commit([exam_user_mapping.hash])
+    exam_user_mapping.refresh_from_db()
+    return bool(activated)
 
-    score_map = past_stats.rank_vs_score_json or {}
-    rank_map = past_stats.rank_vs_percentile_json or {}
 
-    if score_map:
-        score_points = list(score_map.keys())
-        percentile_points = list(score_map.values())
-        predicted_percentile = _interpolate(score, score_points, percentile_points)
-    else:
-        predicted_percentile = None
+def save_submitted_answer(exam_id, exam_user_multiple_choice_question_mapping_id, exam_user_mapping_id,
+                          selected_choice, is_correct, now):
+    with transaction.atomic():
+        # The resolved session may be a few seconds stale, so the write itself re-checks that the
+        # session is still open.
+        updated = ExamUserMultipleChoiceQuestionMapping.objects.filter(
+            exam_id=exam_id,
+            id=exam_user_multiple_choice_question_mapping_id,
+            exam_user_mapping__completed=False,
+            exam_user_mapping__end_timestamp__gt=now,
+        ).update(
+            selected_choice=selected_choice,
+            is_completed=True,
+            completed_at=now,
+            is_correct=is_correct,
+        )
+        if updated:
+            bump_session_state_versions(
+                [exam_user_mapping_id], [exam_user_multiple_choice_question_mapping_id], exam_id=exam_id
+            )
+    return bool(updated)
 
 
-    predicted_rank = None
-    if predicted_percentile and rank_map:
-        rank_points = list(rank_map.keys())
-        rank_percentiles = list(rank_map.values())
-        predicted_rank = _interpolate(predicted_percentile, rank_percentiles[::-1], rank_points[::-1])
+def complete_exam_user_mapping(exam_user_mapping):
+    # Only this session's buffered answers are written, in the completing transaction; the exam-wide
+    # flush keeps running alongside and never drops answers submitted before completed_at.
+    answer_buffer = get_answer_buffer()
 
-    if predicted_rank is None and predicted_percentile:
-        predicted_rank = int(max(1, (100 - predicted_percentile) * 100))
+    with transaction.atomic():
+        apply_session_answer_buffer(exam_user_mapping, answer_buffer)
+        exam_user_mapping.refresh_from_db()
+        exam_user_mapping.completed = True
+        exam_user_mapping.completed_at = timezone.now()
+        exam_user_mapping.save(update_fields=['completed', 'completed_at'])
+        bump_session_state_versions([exam_user_mapping.id])
+        if answer_buffer is not None:
+            transaction.on_commit(partial(
+                answer_buffer.forget_session, exam_user_mapping.exam_id, exam_user_mapping.id
+            ))
+
+
+def get_subject_leaderboard_queryset(exam_id: int, topic_id: int):
+    return (
+        ExamUserMapping.objects.filter(
+            exam_id=exam_id,
+            exam_topic_rankings__exam_id=exam_id,
+            exam_topic_rankings__topic_id=topic_id,
+        )
+        .annotate(
+            rank=F("exam_topic_rankings__rank"),
+            topic_score=F("exam_topic_rankings__score"),
+            topic_percentile=F("exam_topic_rankings__percentile"),
+        )
+        .select_related("user", "exam")
+        .order_by("rank", "id")
+    )
 
-    if predicted_percentile is None and rank_map:
-        rank_points = sorted(map(int, rank_map.keys()))
-        predicted_rank = rank_points[len(rank_points) // 2]
 
-    return {
-        "predicted_percentile": round(predicted_percentile or 0.0, 2),
-        "predicted_rank": int(round(predicted_rank or 0))
-    }
\ No newline at end of file
+def predict_rank_from_score_and_percentile(score, past_stats):
+    return compile_prediction(past_stats).predict(score)
@@ -1,88 +1,139 @@
-from datetime import timedelta
-
-from django.core.exceptions import ValidationError, PermissionDenied
-from django.db import transaction
+from django.conf import settings
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
 from django.utils import timezone
-from rest_framework.exceptions import NotFound
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.generics import ListAPIView
-from rest_framework.pagination import LimitOffsetPagination
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.views import APIView
 
+from testprep.instrumentation import InstrumentedListMixin, serializer_data
+
+from tests.admission import admit_exam_start, get_requested_at, mark_exam_started
+from tests.answer_buffer import buffer_answer, buffer_answer_slot, get_answer_buffer
+from tests.answer_keys import get_answer_key
+from tests.answer_sheets import AnswerSlotRef, is_answer_slot_hash, parse_slot_choice, resolve_answer_slot, \
+    save_answer_slot
+from tests.exports import (
+    EXPORT_CONTENT_TYPES,
+    EXPORT_FORMAT_CSV,
+    EXPORT_FORMATS,
+    EXPORT_KIND_OVERALL,
+    EXPORT_KIND_SUBJECTS,
+    EXPORT_KINDS,
+    AsyncChunkIterator,
+    get_export_filename,
+    get_results_export,
+    stream_results_export,
+)
+from tests.live_leaderboard import get_live_leaderboard, record_live_answer
 from tests.models import Exam, ExamUserMapping, ExamUserMultipleChoiceQuestionMapping, Topic
-from tests.serializers import ExamUserMappingFullSerializer, ExamUserMappingMinimumSerializer, \
-    ExamLeaderboardSerializer
-from tests.utils import get_subject_leaderboard_queryset
-
-from tests.models import PastExamStats
-from tests.utils import predict_rank_from_score_and_percentile
+from tests.pagination import LeaderboardCursorPagination
+from tests.paper_snapshots import render_exam_user_mapping_detail
+from tests.predictions import get_compiled_prediction
+from tests.resolvers import (
+    exam_resolver,
+    exam_user_mapping_resolver,
+    exam_user_multiple_choice_question_mapping_resolver,
+    lazy_instance,
+)
+from tests.session_state import etag_matches, get_session_etag, render_session_changes
+from tests.serializers import ExamUserMappingMinimumSerializer, ExamLeaderboardSerializer
+from tests.utils import activate_exam_user_mapping, complete_exam_user_mapping, create_walk_in_exam_user_mapping, \
+    get_subject_leaderboard_queryset, register_exam_candidates, save_submitted_answer
 
 
 class ExamBaseView(APIView):
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
-        exam_hash = kwargs.get('hash_exam')
-        try:
-            exam = Exam.objects.get(hash=exam_hash)
-        except Exam.DoesNotExist:
-            exam = None
-
-        request.exam = exam
+        exam_ref = exam_resolver.resolve(kwargs.get('hash_exam'))
+        request.exam_ref = exam_ref
+        request.exam = lazy_instance(Exam, exam_ref)
 
 
 class ExamUserMappingBaseView(APIView):
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
-        exam_user_mapping_hash = kwargs.get('hash_exam_user_mapping')
-        try:
-            exam_user_mapping = ExamUserMapping.objects.get(hash=exam_user_mapping_hash)
-        except ExamUserMapping.DoesNotExist:
-            exam_user_mapping = None
-        request.exam_user_mapping = exam_user_mapping
+        exam_user_mapping_ref = exam_user_mapping_resolver.resolve(kwargs.get('hash_exam_user_mapping'))
+        request.exam_user_mapping_ref = exam_user_mapping_ref
+        request.exam_user_mapping = lazy_instance(ExamUserMapping, exam_user_mapping_ref)
 
 
 class ExamUserMappingCreateView(ExamBaseView):
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
-        exam = request.exam
+        exam_ref = request.exam_ref
 
-        if not exam:
+        if not exam_ref:
             raise NotFound(detail="Exam not found.")
         now = timezone.now()
-        if exam.completed or exam.end_timestamp <= now:
+        if exam_ref.completed or exam_ref.end_timestamp <= now:
             raise ValidationError({
                 "exam": "Cannot start mapping for a completed or expired exam."
             })
 
+    @staticmethod
+    def post(request, *args, **kwargs):
+        # Admission comes before any session query, so queued retries do not add to the database load.
+        # Candidates whose session already started are marked and let through without taking a slot.
+        admission = admit_exam_start(request.exam_ref.id, request.user.id)
+        if admission is not None and not admission.admitted:
+            response = Response({
+                "message": "Exam start queued, retry after the given delay.",
+                "position": admission.position,
+                "retry_after": admission.retry_after,
+            }, status=202)
+            response['Retry-After'] = admission.retry_after
+            return response
+        requested_at = get_requested_at(admission)
+
         try:
-            exam_user_mapping = ExamUserMapping.objects.get(
-                exam=exam,
-                user=request.user
-            )
+            exam_user_mapping = ExamUserMapping.objects.get(exam_id=request.exam_ref.id, user=request.user)
+            created = False
         except ExamUserMapping.DoesNotExist:
-            exam_user_mapping = None
+            # Walk-ins without a pre-provisioned session get their rows created here.
+            exam_user_mapping, created = create_walk_in_exam_user_mapping(
+                request.exam_ref.id, request.user, request.exam_ref.duration, requested_at
+            )
+
+        if not created:
+            started = activate_exam_user_mapping(exam_user_mapping, request.exam_ref.duration, requested_at)
+            mark_exam_started(request.exam_ref.id, request.user.id, exam_user_mapping.end_timestamp)
+            return Response(
+                serializer_data(ExamUserMappingMinimumSerializer(exam_user_mapping)), status=201 if started else 200
+            )
+
+        mark_exam_started(request.exam_ref.id, request.user.id, exam_user_mapping.end_timestamp)
+        response = Response(serializer_data(ExamUserMappingMinimumSerializer(exam_user_mapping)), status=201)
+        provisioning_stats = getattr(exam_user_mapping, 'provisioning_stats', None)
+        if provisioning_stats:
+            response['X-Provisioning-Queries'] = provisioning_stats['queries']
+            response['X-Provisioning-Time-Ms'] = provisioning_stats['duration_ms']
+        return response
 
-        request.exam_user_mapping = exam_user_mapping
+
+class ExamRegistrationView(ExamBaseView):
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        exam_ref = request.exam_ref
+
+        if not exam_ref:
+            raise NotFound(detail="Exam not found.")
+        if exam_ref.completed or exam_ref.end_timestamp <= timezone.now():
+            raise ValidationError({
+                "exam": "Cannot register for a completed or expired exam."
+            })
 
     @staticmethod
     def post(request, *args, **kwargs):
-        exam_user_mapping = request.exam_user_mapping
-
-        now = timezone.now()
-        if exam_user_mapping:
-            return Response(ExamUserMappingMinimumSerializer(exam_user_mapping).data, status=200)
-
-
-        duration = request.exam.duration
-        start_timestamp = now + timedelta(minutes=1)
-        end_timestamp = start_timestamp + timedelta(minutes=duration) + timedelta(seconds=30)
-        exam_user_mapping = ExamUserMapping.objects.create(
-            exam = request.exam,
-            user = request.user,
-            start_timestamp = start_timestamp,
-            end_timestamp = end_timestamp,
+        register_exam_candidates(request.exam_ref.id, [request.user.id])
+        return Response(
+            {
+                "message": "Registered for the exam.",
+            },
+            status=200
         )
-        return Response(ExamUserMappingMinimumSerializer(exam_user_mapping).data, status=201)
 
 
 class ExamUserMappingDetailView(ExamUserMappingBaseView):
@@ -90,25 +141,56 @@ class ExamUserMappingDetailView(ExamUserMappingBaseView):
     def get(request, *args, **kwargs):
         exam_user_mapping = request.exam_user_mapping
 
-        if not exam_user_mapping:
+        if not request.exam_user_mapping_ref:
             raise NotFound(detail="Exam user mapping not found.")
+        if not request.exam_user_mapping_ref.activated:
+            raise ValidationError({
+                "message": "Exam not started yet."
+            })
+
+        since = request.query_params.get('since')
+        if since is not None:
+            try:
+                since = int(since)
+            except ValueError:
+                return Response({
+                    "message": "since must be an integer state version."
+                }, status=400)
+
+        etag = get_session_etag(exam_user_mapping, since)
+        if etag_matches(request.headers.get('If-None-Match'), etag):
+            response = HttpResponse(status=304)
+            response['ETag'] = etag
+            return response
 
         include_answers = bool(exam_user_mapping.completed)
-        serializer = ExamUserMappingFullSerializer(
-            exam_user_mapping,
-            context={
-                'request': request,
-                'include_answers': include_answers,
-            }
+        if since is not None:
+            response = HttpResponse(
+                render_session_changes(exam_user_mapping, since, include_answers),
+                content_type='application/json',
+                status=200,
+            )
+            response['ETag'] = etag
+            return response
+
+        response = HttpResponse(
+            render_exam_user_mapping_detail(exam_user_mapping, include_answers, request),
+            content_type='application/json',
+            status=200,
         )
-        return Response(serializer.data, status=200)
+        response['ETag'] = etag
+        return response
 
     @staticmethod
     def put(request, *args, **kwargs):
         exam_user_mapping = request.exam_user_mapping
 
-        if not exam_user_mapping:
+        if not request.exam_user_mapping_ref:
             raise NotFound(detail="Exam user mapping not found.")
+        if not request.exam_user_mapping_ref.activated:
+            raise ValidationError({
+                "message": "Exam not started yet."
+            })
 
         if exam_user_mapping.completed:
             return Response(
@@ -119,12 +201,7 @@ class ExamUserMappingDetailView(ExamUserMappingBaseView):
                 status=400
             )
 
-        with transaction.atomic():
-            exam_user_mapping.refresh_from_db()
-            now = timezone.now()
-            exam_user_mapping.completed = True
-            exam_user_mapping.completed_at = now
-            exam_user_mapping.save(update_fields=['completed', 'completed_at'])
+        complete_exam_user_mapping(exam_user_mapping)
 
         return Response(
             {
@@ -138,41 +215,128 @@ class ExamUserMappingDetailView(ExamUserMappingBaseView):
 class ExamUserMultipleChoiceQuestionMappingSubmitView(APIView):
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
-        exam_user_multiple_choice_question_mapping_hash = kwargs.get('hash_exam_user_multiple_choice_question_mapping')
-        try:
-            exam_user_multiple_choice_question_mapping = ExamUserMultipleChoiceQuestionMapping.objects.get(
-                hash=exam_user_multiple_choice_question_mapping_hash
+        hash_exam_user_multiple_choice_question_mapping = kwargs.get('hash_exam_user_multiple_choice_question_mapping')
+        # Questions of packed sessions are addressed by slot instead of by their own row.
+        if is_answer_slot_hash(hash_exam_user_multiple_choice_question_mapping):
+            exam_user_multiple_choice_question_mapping_ref = resolve_answer_slot(
+                hash_exam_user_multiple_choice_question_mapping
             )
-        except ExamUserMapping.DoesNotExist:
+        else:
+            exam_user_multiple_choice_question_mapping_ref = exam_user_multiple_choice_question_mapping_resolver.resolve(
+                hash_exam_user_multiple_choice_question_mapping
+            )
+        if exam_user_multiple_choice_question_mapping_ref is None:
             raise ValidationError({
                 "message": "Exam user multiple choice question mapping not found."
             })
+        exam_user_mapping_ref = exam_user_mapping_resolver.resolve(
+            exam_user_multiple_choice_question_mapping_ref.exam_user_mapping_hash
+        )
         now = timezone.now()
-        if exam_user_multiple_choice_question_mapping.exam_user_mapping.completed or \
-           exam_user_multiple_choice_question_mapping.exam_user_mapping.end_timestamp <= now:
+        if exam_user_mapping_ref is None or not exam_user_mapping_ref.activated or exam_user_mapping_ref.completed or \
+           exam_user_mapping_ref.end_timestamp <= now:
             raise ValidationError({
                 "message": "Cannot submit answer for a completed or expired exam."
             })
 
-        request.exam_user_multiple_choice_question_mapping = exam_user_multiple_choice_question_mapping
+        request.exam_user_multiple_choice_question_mapping_ref = exam_user_multiple_choice_question_mapping_ref
+        request.exam_user_mapping_ref = exam_user_mapping_ref
 
     @staticmethod
     def put(request, *args, **kwargs):
-        exam_user_multiple_choice_question_mapping = request.exam_user_multiple_choice_question_mapping
+        exam_user_multiple_choice_question_mapping_ref = request.exam_user_multiple_choice_question_mapping_ref
         selected_choice = request.data.get('selected_choice')
         if not selected_choice:
             return Response({
                 "message": "Selected choice is required."
             }, status=400)
 
-        exam_user_multiple_choice_question_mapping.selected_choice = selected_choice
-        exam_user_multiple_choice_question_mapping.is_completed = True
-        exam_user_multiple_choice_question_mapping.completed_at = timezone.now()
-        exam_user_multiple_choice_question_mapping.is_correct = exam_user_multiple_choice_question_mapping.get_is_correct()
-        exam_user_multiple_choice_question_mapping.save(
-            update_fields=['selected_choice', 'is_completed', 'completed_at', 'is_correct']
+        answer_slot = None
+        if isinstance(exam_user_multiple_choice_question_mapping_ref, AnswerSlotRef):
+            answer_slot = exam_user_multiple_choice_question_mapping_ref.slot
+            selected_choice = parse_slot_choice(selected_choice)
+            if selected_choice is None:
+                return Response({
+                    "message": "Selected choice is invalid."
+                }, status=400)
+
+        exam_id = request.exam_user_mapping_ref.exam_id
+        answer_key = get_answer_key(exam_id)
+        live_leaderboard = get_live_leaderboard()
+        exam_user_multiple_choice_question_mapping = ExamUserMultipleChoiceQuestionMapping(
+            id=exam_user_multiple_choice_question_mapping_ref.id,
+            exam_id=exam_id,
+            exam_user_mapping_id=exam_user_multiple_choice_question_mapping_ref.exam_user_mapping_id,
+            multiple_choice_question_id=exam_user_multiple_choice_question_mapping_ref.multiple_choice_question_id,
+            input_puzzle_answer=exam_user_multiple_choice_question_mapping_ref.input_puzzle_answer,
+            selected_choice=selected_choice,
         )
 
+        answer_buffer = get_answer_buffer()
+        if answer_buffer:
+            if answer_slot is not None:
+                buffer_answer_slot(
+                    answer_buffer,
+                    exam_id,
+                    exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                    answer_slot,
+                    selected_choice,
+                    timezone.now(),
+                )
+            else:
+                buffer_answer(
+                    answer_buffer,
+                    exam_id,
+                    exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                    exam_user_multiple_choice_question_mapping.id,
+                    selected_choice,
+                    timezone.now(),
+                )
+            if live_leaderboard:
+                record_live_answer(
+                    live_leaderboard,
+                    answer_key,
+                    exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                    exam_user_multiple_choice_question_mapping.multiple_choice_question_id,
+                    exam_user_multiple_choice_question_mapping.get_is_correct(answer_key=answer_key),
+                )
+            return Response(
+                {
+                    "message": "Answer submitted successfully.",
+                }, status=200
+            )
+
+        is_correct = exam_user_multiple_choice_question_mapping.get_is_correct(answer_key=answer_key)
+        if answer_slot is not None:
+            updated = save_answer_slot(
+                exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                answer_slot,
+                selected_choice,
+                timezone.now(),
+            )
+        else:
+            updated = save_submitted_answer(
+                exam_id,
+                exam_user_multiple_choice_question_mapping.id,
+                exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                selected_choice,
+                is_correct,
+                timezone.now(),
+            )
+        if not updated:
+            return Response({
+                "message": "Cannot submit answer for a completed or expired exam."
+            }, status=400)
+
+        if live_leaderboard:
+            record_live_answer(
+                live_leaderboard,
+                answer_key,
+                exam_user_multiple_choice_question_mapping.exam_user_mapping_id,
+                exam_user_multiple_choice_question_mapping.multiple_choice_question_id,
+                is_correct,
+            )
+
         return Response(
             {
                 "message": "Answer submitted successfully.",
@@ -180,51 +344,57 @@ class ExamUserMultipleChoiceQuestionMappingSubmitView(APIView):
         )
 
 
-class LeaderboardPagination(LimitOffsetPagination):
-    default_limit = 100
-    max_limit = 500
-
-
-class ExamLeaderboardView(ListAPIView, ExamBaseView):
+class ExamLeaderboardView(InstrumentedListMixin, ListAPIView, ExamBaseView):
     serializer_class = ExamLeaderboardSerializer
-    pagination_class = LeaderboardPagination
+    pagination_class = LeaderboardCursorPagination
 
     def initial(self, request, *args, **kwargs):
-        exam = self.request.exam
-        if not exam or not exam.completed:
+        super().initial(request, *args, **kwargs)
+        exam_ref = request.exam_ref
+        if not exam_ref or not exam_ref.completed:
             raise NotFound(detail="Exam not found or leaderboard not available.")
 
-        try:
-            exam_user_mapping = ExamUserMapping.objects.filter(exam=exam)
-        except ExamUserMapping.DoesNotExist:
-            return PermissionDenied()
-
-        request.exam_user_mapping = exam_user_mapping
-
     def get_queryset(self):
         request = self.request
-        exam = request.exam
+        exam_ref = request.exam_ref
 
         percentile = self.request.query_params.get("percentile", False)
         subject_hash = self.request.query_params.get("subject_hash")
 
-        queryset = ExamUserMapping.objects.filter(exam=exam).select_related("user")
+        queryset = ExamUserMapping.objects.filter(exam_id=exam_ref.id).select_related("user", "exam")
 
         if subject_hash:
+            self.cursor_ordering = (("rank", False), ("id", False))
             try:
                 topic = Topic.objects.get(hash=subject_hash)
                 request.topic = topic
             except Topic.DoesNotExist:
-
+                request.topic = None
                 return ExamUserMapping.objects.none()
 
-            queryset = get_subject_leaderboard_queryset(exam.id, topic.title)
-            return queryset
+            return get_subject_leaderboard_queryset(exam_ref.id, topic.id)
         else:
             request.topic = None
 
-        order_field = "-overall_percentile" if percentile else "overall_rank"
-        return queryset.order_by(order_field)
+        if percentile:
+            self.cursor_ordering = (("overall_percentile", True), ("id", False))
+        else:
+            self.cursor_ordering = (("overall_rank", False), ("id", False))
+        return queryset.filter(**{f"{self.cursor_ordering[0][0]}__isnull": False})
+
+    def get_cursor_ordering(self):
+        return self.cursor_ordering
+
+    def get_caller_cursor_key(self, queryset):
+        request = self.request
+        if not request.user.is_authenticated:
+            return None
+
+        fields = [field for field, _ in self.cursor_ordering]
+        key = queryset.filter(user=request.user).values_list(*fields).first()
+        if key is None or key[0] is None:
+            return None
+        return key
 
     def get_serializer_context(self):
         context = super().get_serializer_context()
@@ -232,33 +402,144 @@ class ExamLeaderboardView(ListAPIView, ExamBaseView):
         return context
 
 
-class ExamResultPredictView(ExamUserMappingBaseView):
+class ExamResultsExportView(ExamBaseView):
+    # Full results as one streamed CSV or NDJSON file, for analysts who would otherwise page through
+    # ExamLeaderboardView. ?kind=overall|subjects|answers&output=csv|ndjson&subject_hash=...&gzip=1
+    permission_classes = [IsAdminUser]
+
     def initial(self, request, *args, **kwargs):
         super().initial(request, *args, **kwargs)
-        exam_user_mapping = request.exam_user_mapping
+        exam_ref = request.exam_ref
+        if not exam_ref or not exam_ref.completed:
+            raise NotFound(detail="Exam not found or results not available.")
 
-        if not exam_user_mapping or not exam_user_mapping.completed:
-            raise NotFound(detail="Exam user mapping not found or exam not completed.")
+    @staticmethod
+    def get(request, *args, **kwargs):
+        kind = request.query_params.get("kind", EXPORT_KIND_OVERALL)
+        export_format = request.query_params.get("output", EXPORT_FORMAT_CSV)
+        if kind not in EXPORT_KINDS or export_format not in EXPORT_FORMATS:
+            return Response({
+                "message": f"kind must be one of {', '.join(EXPORT_KINDS)} and output one of {', '.join(EXPORT_FORMATS)}."
+            }, status=400)
+        compress = request.query_params.get("gzip") in ("1", "true")
+
+        topic_id = None
+        if kind == EXPORT_KIND_SUBJECTS:
+            topic = get_live_leaderboard_topic(request)
+            topic_id = topic.id if topic else None
+
+        chunks = stream_results_export(
+            get_results_export(request.exam_ref.id, kind, topic_id=topic_id), export_format, compress=compress
+        )
+        if isinstance(request._request, ASGIRequest):
+            chunks = AsyncChunkIterator(chunks)
+        response = StreamingHttpResponse(
+            chunks, content_type="application/gzip" if compress else EXPORT_CONTENT_TYPES[export_format]
+        )
+        filename = get_export_filename(kwargs.get("hash_exam"), kind, export_format, compress=compress)
+        response["Content-Disposition"] = f'attachment; filename="{filename}"'
+        return response
+
+
+def get_live_leaderboard_topic(request):
+    subject_hash = request.query_params.get("subject_hash")
+    if not subject_hash:
+        return None
+    try:
+        return Topic.objects.only('id').get(hash=subject_hash)
+    except Topic.DoesNotExist:
+        raise NotFound(detail="Subject not found.")
+
+
+class ExamLiveLeaderboardView(ExamBaseView):
+    permission_classes = [IsAdminUser]
 
     @staticmethod
     def get(request, *args, **kwargs):
-        exam_user_mapping = request.exam_user_mapping
-        exam_year = exam_user_mapping.exam.year
+        exam = request.exam_ref
+        live_leaderboard = get_live_leaderboard()
+        if not exam or not live_leaderboard:
+            raise NotFound(detail="Exam not found or live leaderboard not enabled.")
 
-        prediction_year = exam_year - 1
         try:
-            prediction_stats = PastExamStats.objects.get(
-                    exam_year = prediction_year,
-                    exam_type = exam_user_mapping.exam.exam_type
-            )
-        except PastExamStats.DoesNotExist:
+            limit = min(int(request.query_params.get("limit", 100)), settings.LIVE_LEADERBOARD_MAX_LIMIT)
+        except ValueError:
             return Response({
-                "message": "Prediction data not available for the given exam year and type."
-            }, status=404)
+                "message": "limit must be an integer."
+            }, status=400)
+        if limit <= 0:
+            return Response({"exam": exam.title, "results": []}, status=200)
+        topic = get_live_leaderboard_topic(request)
+
+        entries = live_leaderboard.top(exam.id, limit, topic_id=topic.id if topic else None)
+        exam_user_mappings = {
+            exam_user_mapping['id']: exam_user_mapping
+            for exam_user_mapping in ExamUserMapping.objects.filter(
+                id__in=[exam_user_mapping_id for exam_user_mapping_id, _, _ in entries]
+            ).values('id', 'hash', 'user__username')
+        }
+        return Response(
+            {
+                "exam": exam.title,
+                "results": [
+                    {
+                        "hash": exam_user_mappings[exam_user_mapping_id]['hash'],
+                        "username": exam_user_mappings[exam_user_mapping_id]['user__username'],
+                        "score": score,
+                        "rank": rank,
+                    }
+                    for exam_user_mapping_id, score, rank in entries
+                    if exam_user_mapping_id in exam_user_mappings
+                ],
+            },
+            status=200,
+        )
 
+
+class ExamUserMappingLiveRankView(ExamUserMappingBaseView):
+    @staticmethod
+    def get(request, *args, **kwargs):
+        exam_user_mapping = request.exam_user_mapping_ref
+        live_leaderboard = get_live_leaderboard()
+        if not exam_user_mapping or not live_leaderboard:
+            raise NotFound(detail="Exam user mapping not found or live leaderboard not enabled.")
+
+        topic = get_live_leaderboard_topic(request)
+        position = live_leaderboard.position(
+            exam_user_mapping.exam_id, exam_user_mapping.id, topic_id=topic.id if topic else None
+        )
+        if position is None:
+            raise NotFound(detail="No provisional rank yet.")
+
+        return Response({"provisional": True, **position}, status=200)
+
+
+class ExamResultPredictView(ExamUserMappingBaseView):
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        exam_user_mapping = request.exam_user_mapping
+
+        if not request.exam_user_mapping_ref or not exam_user_mapping.completed:
+            raise NotFound(detail="Exam user mapping not found or exam not completed.")
+
+    @staticmethod
+    def get(request, *args, **kwargs):
+        exam_user_mapping = request.exam_user_mapping
         exam = exam_user_mapping.exam
         score = exam_user_mapping.total_score or 0
-        prediction = predict_rank_from_score_and_percentile(score, prediction_stats)
+
+        if exam_user_mapping.predicted_rank is not None:
+            prediction = {
+                "predicted_percentile": float(exam_user_mapping.predicted_percentile),
+                "predicted_rank": exam_user_mapping.predicted_rank,
+            }
+        else:
+            compiled_prediction = get_compiled_prediction(exam.exam_type, exam.year - 1)
+            if compiled_prediction is None:
+                return Response({
+                    "message": "Prediction data not available for the given exam year and type."
+                }, status=404)
+            prediction = compiled_prediction.predict(score)
 
         return Response(
             {
@@ -270,6 +551,3 @@ class ExamResultPredictView(ExamUserMappingBaseView):
             },
             status=200,
         )
-
-
-